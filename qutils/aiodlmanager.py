@@ -0,0 +1,255 @@
+import asyncio
+import json
+
+import aiohttp
+import requests
+
+from qutils.dlmanager import DLManager, DL, User, Ticket
+
+
+class _Response:
+    def __init__(self, url, status_code, reason, text):
+        super().__init__()
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncDLManager(DLManager):
+    """
+    asyncio version of DLManager on top of aiohttp. Every API method is a coroutine, while the models
+    (DL, User, Ticket) and the error classes are the same as DLManager's.
+    Each instance owns its connection pool; use it as an async context manager or call close() when done.
+    Unlike DLManager, it caches nothing: there is no response cache, so exists_check='cache' is not supported.
+    """
+
+    def __init__(self, executor: str, token: str, url_prefix: str = None,
+                 pool_size=100, pool_size_per_host=0, keepalive_timeout=15, timeout=30, connect_timeout=None,
+                 exists_check='api', circuit_breaker=None):
+        """
+        :param pool_size: max number of simultaneous connections, 0 for no limit
+        :param pool_size_per_host: max number of simultaneous connections to the same host, 0 for no limit
+        :param keepalive_timeout: seconds to keep an idle connection alive, None to disable keep-alive
+        :param timeout: total seconds allowed for one API call, None for no limit
+        :param connect_timeout: seconds allowed for acquiring a connection, None for no limit
+        :param exists_check: 'api' or 'off', see DLManager
+        :param circuit_breaker: see DLManager
+        """
+        if exists_check == 'cache':
+            raise ValueError("exists_check='cache' needs the response cache, which AsyncDLManager does not have")
+        super().__init__(executor, token, url_prefix,
+                         exists_check=exists_check, circuit_breaker=circuit_breaker)
+        self.pool_size = pool_size
+        self.pool_size_per_host = pool_size_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def get_dl_properties(self, dl_name):
+        url = self.PREFIX + '/DL/properties/{}/{}/{}'.format(dl_name, self.executor, self.token)
+        return DL((await self._get_dl_info(url, dl_name, 'get the properties of')).json())
+
+    async def get_dl_members(self, dl_name, recursive=False):
+        url = self.PREFIX + '/DL/members{}/{}/{}/{}'.format('/recursive' if recursive else '',
+                                                            dl_name, self.executor, self.token)
+        return [User(u) for u in (await self._get_dl_info(url, dl_name, 'get the members of')).json()]
+
+    async def get_user_memberships(self, user):
+        if isinstance(user, User):
+            user = user.samAccountName
+        url = self.PREFIX + '/User/memberships/{}/{}/{}'.format(user, self.executor, self.token)
+        return await self._get_user_related_dls(url, user)
+
+    async def get_user_ownerships(self, user):
+        if isinstance(user, User):
+            user = user.samAccountName
+        url = self.PREFIX + '/User/ownerships/{}/{}/{}'.format(user, self.executor, self.token)
+        return await self._get_user_related_dls(url, user)
+
+    async def get_user_properties(self, user_name):
+        url = self.PREFIX + '/User/properties/{}/{}/{}'.format(user_name, self.executor, self.token)
+        resp = await self._request('GET', url)
+        await self._raise_for_error(resp, 'Cannot get properties of user "{}"'.format(user_name),
+                                    {requests.codes.server_error: 'invalid corp id / invalid executor / '
+                                                                  'invalid token / internal server error'})
+        user_json = resp.json()
+        if user_json:
+            return User(user_json)
+        raise self.UserNotExist('User "{}" does not exist'.format(user_name))
+
+    async def exists_dl(self, dl_name):
+        url = self.PREFIX + '/DL/exist/{}/{}/{}'.format(dl_name, self.executor, self.token)
+        resp = await self._request('GET', url)
+        await self._raise_for_error(resp, 'Cannot check if DL "{}" exists'.format(dl_name),
+                                    {requests.codes.server_error: 'invalid executor / invalid token / '
+                                                                  'internal server error'})
+        return resp.text == 'true'
+
+    async def new_dl(self, dl_name=None, members=None, owners=None, ticket=None):
+        url = self.PREFIX + '/DL/new/{}/{}'.format(self.executor, self.token)
+        if dl_name is None and members is None and owners is None:
+            if ticket is None:
+                raise ValueError('Cannot create an empty DL without any specifications')
+        else:
+            if ticket is None:
+                ticket = Ticket()
+            if dl_name is not None:
+                ticket.dlName = dl_name
+            if members is not None:
+                ticket.members = self._ensure_name_list(members)
+            else:
+                ticket.members = []
+            if owners is not None:
+                ticket.owners = self._ensure_name_list(owners)
+        resp = await self._request('POST', url, json=ticket.to_dict())
+        await self._raise_for_error(resp, 'Cannot create DL "{}"'.format(dl_name),
+                                    {requests.codes.unauthorized: 'invalid executor or token',
+                                     requests.codes.server_error: 'invalid ticket: {!r}'.format(ticket)})
+
+    async def rename_dl(self, dl_name, new_dl_name):
+        url = self.PREFIX + '/DL/renameDL/{}/{}/{}/{}'.format(dl_name, new_dl_name, self.executor, self.token)
+        await self._get_dl_info(url, dl_name, 'rename to "{}" from'.format(new_dl_name))
+
+    async def set_public_dl(self, dl_name, public):
+        url = self.PREFIX + '/DL/setPublic/{}/{}/{}/{}'.format(dl_name, public and 'true' or 'false',
+                                                               self.executor, self.token)
+        resp = await self._request('GET', url)
+        await self._raise_for_error(resp, 'Cannot set DL "{}" to {}public'.format(dl_name, '' if public else 'non-'),
+                                    {requests.codes.unauthorized: 'invalid executor or token',
+                                     requests.codes.bad_request: 'invalid public status',
+                                     requests.codes.server_error: 'server error'},
+                                    dl_name, requests.codes.server_error)
+
+    async def search_dl(self, keyword):
+        url = self.PREFIX + '/DL/search/{}/{}/{}'.format(keyword, self.executor, self.token)
+        resp = await self._request('GET', url)
+        await self._raise_for_error(resp, 'Cannot search DLs with keyword "{}"'.format(keyword),
+                                    {requests.codes.server_error: 'invalid executor / invalid token / server errors'})
+        return [DL(d) for d in resp.json()]
+
+    async def remove_dl(self, dl_names):
+        url = self.PREFIX + '/DL/delete/{}/{}'.format(self.executor, self.token)
+        dl_names = self._ensure_name_list(dl_names)
+        if any(not isinstance(d, str) for d in dl_names):
+            raise ValueError('the dl_names must be one or a list of DLs')
+        resp = await self._request('POST', url, json=dl_names)
+        await self._raise_for_error(
+            resp,
+            'Cannot delete DLs {}'.format(', '.join('"{}"'.format(d) for d in dl_names)),
+            {requests.codes.unauthorized: 'invalid executor or token',
+             requests.codes.expectation_failed: 'invalid DL names or server errors',
+             requests.codes.server_error: 'invalid DL names or server errors'}
+        )
+
+    async def _process_dl_users(self, url, dl_name, users, log_action, log_action_prep):
+        users = self._ensure_name_list(users)
+        if any(not isinstance(u, str) for u in users):
+            raise ValueError('the users must be one or a list of corp ids')
+        resp = await self._request('POST', url, json=users)
+        await self._raise_for_error(
+            resp,
+            'Cannot {} {} {} DL "{}"'.format(log_action, ', '.join('"{}"'.format(u) for u in users),
+                                             log_action_prep, dl_name),
+            {requests.codes.unauthorized: 'invalid executor or token',
+             requests.codes.expectation_failed: 'invalid corp ids or server errors',
+             requests.codes.server_error: 'invalid corp ids or server errors'}
+        )
+
+    async def _get_dl_info(self, url, dl_name, log_action):
+        resp = await self._request('GET', url)
+        await self._raise_for_error(resp, 'Cannot {} DL "{}"'.format(log_action, dl_name),
+                                    {requests.codes.bad_request: 'invalid DL name',
+                                     requests.codes.server_error: 'invalid executor / invalid token / '
+                                                                  'internal server error'},
+                                    dl_name)
+        return resp
+
+    async def _get_user_related_dls(self, url, user):
+        resp = await self._request('GET', url)
+        await self._raise_for_error(resp, 'Cannot get related DLs of user "{}"'.format(user),
+                                    {requests.codes.server_error: 'invalid corp id / invalid executor / '
+                                                                  'invalid token / internal server error'})
+        return [DL(d) for d in resp.json()]
+
+    async def _call_many(self, fn, names, max_workers=None):
+        names = list(dict.fromkeys(self._ensure_name_list(names)))
+        semaphore = asyncio.Semaphore(max_workers or self.pool_size or len(names) or 1)
+
+        async def call(name):
+            async with semaphore:
+                return await self._call_with_retry(fn, name)
+
+        outcomes = await asyncio.gather(*(call(name) for name in names), return_exceptions=True)
+        results, errors = {}, {}
+        for name, outcome in zip(names, outcomes):
+            if isinstance(outcome, (self.Error, aiohttp.ClientError, asyncio.TimeoutError)):
+                errors[name] = outcome
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            else:
+                results[name] = outcome
+        return results, errors
+
+    async def _call_with_retry(self, fn, *args, **kwargs):
+        backoff = self.BULK_RETRY_BACKOFF
+        for retry in range(self.BULK_MAX_RETRIES + 1):
+            try:
+                return await fn(*args, **kwargs)
+            except self.CallAPIError as err:
+                if retry >= self.BULK_MAX_RETRIES or (err.status_code or 0) < requests.codes.server_error:
+                    raise
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if retry >= self.BULK_MAX_RETRIES:
+                    raise
+            await asyncio.sleep(backoff)
+            backoff *= 2
+
+    async def _request(self, method, url, **kwargs):
+        self._check_circuit(method, url)
+        if self.session is None:
+            connector_kwargs = {'limit': self.pool_size, 'limit_per_host': self.pool_size_per_host, 'ssl': False}
+            if self.keepalive_timeout is None:
+                connector_kwargs['force_close'] = True
+            else:
+                connector_kwargs['keepalive_timeout'] = self.keepalive_timeout
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(**connector_kwargs),
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout)
+            )
+        try:
+            async with self.session.request(method, url, **kwargs) as resp:
+                resp = _Response(str(resp.url), resp.status, resp.reason, await resp.text())
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self._record_response(None)
+            raise
+        self._record_response(resp.status_code)
+        return resp
+
+    async def _raise_for_error(self, resp, log_error_action,
+                               code_log_reason=None, check_exists_dl=None, check_exists_dl_when=None):
+        if resp.status_code != requests.codes.ok:
+            exists = None
+            if check_exists_dl and (check_exists_dl_when is None or check_exists_dl_when == resp.status_code):
+                exists = self._known_dl_existence(check_exists_dl)
+                if exists is None and self._can_call_exists_dl():
+                    try:
+                        exists = await self.exists_dl(check_exists_dl)
+                    except self.CallAPIError:
+                        pass
+            raise self._api_error(resp, log_error_action, code_log_reason, check_exists_dl, exists is False)
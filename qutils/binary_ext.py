@@ -0,0 +1,268 @@
+import struct
+
+from qutils.json_ext import SkyNetJSONable
+
+
+class SkyNetBinaryCodec:
+    """
+    A compact binary codec of the plain JSON-like objects, bytes and the SkyNetJSONable types, in the format of
+    MessagePack, except that a SkyNetJSONable object is written as the byte 0xc1 (never used by MessagePack),
+    followed by the integer tag of its type and then its encode() result, which is decoded by the decode() of the type.
+    The data starts with the array of the type keys used, indexed by their tags, which are assigned in the order
+    of the first use, so it is decoded by the type keys regardless of the types registered in either process.
+    """
+
+    OBJECT = 0xc1
+
+    def dumpb(self, obj) -> bytes:
+        tags = {}
+        body = bytearray()
+        self._encode(obj, body, tags)
+        out = bytearray()
+        _encode_list(self, sorted(tags, key=tags.get), out, {})
+        out += body
+        return bytes(out)
+
+    def loadb(self, data, zero_copy=False):
+        """
+        :param data: bytes-like
+        :param zero_copy: if True, the bytes fields are decoded as memoryview slices of data instead of bytes copies
+        """
+        view = memoryview(data)
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast('B')
+        decoder = _Decoder(view, {}, zero_copy)
+        keys = decoder.decode()
+        if not isinstance(keys, list):
+            raise ValueError('Expecting the array of the type keys at byte 0')
+        decoder.keys = dict(enumerate(keys))
+        obj = decoder.decode()
+        if decoder.pos != len(view):
+            raise ValueError('Extra data at byte {} of {}'.format(decoder.pos, len(view)))
+        return obj
+
+    def _encode(self, obj, out, tags):
+        """:param tags: {type key: tag} of the types encoded so far, which a new type is added to"""
+        encode = _ENCODERS.get(type(obj))
+        if encode is not None:
+            encode(self, obj, out, tags)
+        elif isinstance(obj, SkyNetJSONable):
+            tag = tags.get(obj.type)
+            if tag is None:
+                if SkyNetJSONable.all_types.get(obj.type) is None:
+                    raise TypeError('Object of type {} is not a registered SkyNetJSONable type'
+                                    .format(type(obj).__name__))
+                tag = tags[obj.type] = len(tags)
+            out.append(self.OBJECT)
+            _encode_int(self, tag, out, tags)
+            encoded = obj.encode()
+            if isinstance(encoded, dict) and '_type' in encoded:
+                encoded = {k: v for k, v in encoded.items() if k != '_type'}
+            self._encode(encoded, out, tags)
+        else:
+            for base, encode in _ENCODERS.items():
+                if isinstance(obj, base):
+                    return encode(self, obj, out, tags)
+            raise TypeError('Object of type {} is not binary serializable'.format(type(obj).__name__))
+
+
+def _encode_none(codec, obj, out, tags):
+    out.append(0xc0)
+
+
+def _encode_bool(codec, obj, out, tags):
+    out.append(0xc3 if obj else 0xc2)
+
+
+def _encode_int(codec, obj, out, tags):
+    if 0 <= obj < 0x80:
+        out.append(obj)
+    elif -0x20 <= obj < 0:
+        out.append(obj & 0xff)
+    elif obj >= 0:
+        if obj <= 0xff:
+            out += struct.pack('>BB', 0xcc, obj)
+        elif obj <= 0xffff:
+            out += struct.pack('>BH', 0xcd, obj)
+        elif obj <= 0xffffffff:
+            out += struct.pack('>BI', 0xce, obj)
+        elif obj <= 0xffffffffffffffff:
+            out += struct.pack('>BQ', 0xcf, obj)
+        else:
+            raise OverflowError('int {} is too large to be encoded'.format(obj))
+    elif obj >= -0x80:
+        out += struct.pack('>Bb', 0xd0, obj)
+    elif obj >= -0x8000:
+        out += struct.pack('>Bh', 0xd1, obj)
+    elif obj >= -0x80000000:
+        out += struct.pack('>Bi', 0xd2, obj)
+    elif obj >= -0x8000000000000000:
+        out += struct.pack('>Bq', 0xd3, obj)
+    else:
+        raise OverflowError('int {} is too small to be encoded'.format(obj))
+
+
+def _encode_float(codec, obj, out, tags):
+    out += struct.pack('>Bd', 0xcb, obj)
+
+
+def _encode_header(out, size, fix, fix_max, code8, code16, code32):
+    if size <= fix_max:
+        out.append(fix | size)
+    elif code8 is not None and size <= 0xff:
+        out += struct.pack('>BB', code8, size)
+    elif size <= 0xffff:
+        out += struct.pack('>BH', code16, size)
+    elif size <= 0xffffffff:
+        out += struct.pack('>BI', code32, size)
+    else:
+        raise OverflowError('{} items / bytes are too many to be encoded'.format(size))
+
+
+def _encode_str(codec, obj, out, tags):
+    data = obj.encode('utf-8')
+    _encode_header(out, len(data), 0xa0, 0x1f, 0xd9, 0xda, 0xdb)
+    out += data
+
+
+def _encode_bytes(codec, obj, out, tags):
+    size = obj.nbytes if isinstance(obj, memoryview) else len(obj)
+    _encode_header(out, size, 0xc4, -1, 0xc4, 0xc5, 0xc6)
+    out += obj
+
+
+def _encode_list(codec, obj, out, tags):
+    _encode_header(out, len(obj), 0x90, 0x0f, None, 0xdc, 0xdd)
+    for item in obj:
+        codec._encode(item, out, tags)
+
+
+def _encode_dict(codec, obj, out, tags):
+    _encode_header(out, len(obj), 0x80, 0x0f, None, 0xde, 0xdf)
+    for key, value in obj.items():
+        codec._encode(key, out, tags)
+        codec._encode(value, out, tags)
+
+
+# by exact types first, then by isinstance() in this order
+_ENCODERS = {
+    type(None): _encode_none,
+    bool: _encode_bool,
+    int: _encode_int,
+    float: _encode_float,
+    str: _encode_str,
+    bytes: _encode_bytes,
+    bytearray: _encode_bytes,
+    memoryview: _encode_bytes,
+    list: _encode_list,
+    tuple: _encode_list,
+    dict: _encode_dict,
+}
+
+
+class _Decoder:
+    def __init__(self, view, keys, zero_copy):
+        # bytes for the fast indexing / slicing, and the view for the zero-copy slices
+        self.data = view.obj if isinstance(view.obj, bytes) and len(view.obj) == len(view) else view.tobytes()
+        self.view = view
+        self.keys = keys
+        self.zero_copy = zero_copy
+        self.pos = 0
+
+    def take(self, size):
+        start = self.pos
+        end = self.pos = start + size
+        if end > len(self.data):
+            raise ValueError('Truncated data: expecting {} bytes at byte {} of {}'.format(size, start, len(self.data)))
+        return start, end
+
+    def unpack(self, fmt):
+        fmt = _STRUCTS[fmt]
+        return fmt.unpack_from(self.data, self.take(fmt.size)[0])[0]
+
+    def decode(self):
+        start, _ = self.take(1)
+        code = self.data[start]
+        if code < 0x80:
+            return code
+        if code >= 0xe0:
+            return code - 0x100
+        if code < 0x90:
+            return self.decode_map(code & 0x0f)
+        if code < 0xa0:
+            return self.decode_array(code & 0x0f)
+        if code < 0xc0:
+            return self.decode_str(code & 0x1f)
+        decode = _DECODERS.get(code)
+        if decode is None:
+            raise ValueError('Unknown type code 0x{:02x} at byte {}'.format(code, start))
+        return decode(self)
+
+    def decode_str(self, size):
+        start, end = self.take(size)
+        return self.data[start:end].decode('utf-8')
+
+    def decode_bin(self, size):
+        start, end = self.take(size)
+        return self.view[start:end] if self.zero_copy else self.data[start:end]
+
+    def decode_array(self, size):
+        decode = self.decode
+        return [decode() for _ in range(size)]
+
+    def decode_map(self, size):
+        decode = self.decode
+        obj = {}
+        for _ in range(size):
+            key = decode()
+            obj[key] = decode()
+        return obj
+
+    def decode_object(self):
+        start = self.pos - 1
+        tag = self.decode()
+        if tag not in self.keys:
+            raise ValueError('Unknown type tag {!r} at byte {}'.format(tag, start))
+        cls = SkyNetJSONable.all_types.get(self.keys[tag])
+        if cls is None:
+            raise ValueError('Unregistered type "{}" at byte {}'.format(self.keys[tag], start))
+        return cls.decode(self.decode())
+
+
+_STRUCTS = {fmt: struct.Struct('>' + fmt) for fmt in 'BHIQbhiqd'}
+
+_DECODERS = {
+    0xc0: lambda d: None,
+    0xc1: _Decoder.decode_object,
+    0xc2: lambda d: False,
+    0xc3: lambda d: True,
+    0xc4: lambda d: d.decode_bin(d.unpack('B')),
+    0xc5: lambda d: d.decode_bin(d.unpack('H')),
+    0xc6: lambda d: d.decode_bin(d.unpack('I')),
+    0xcb: lambda d: d.unpack('d'),
+    0xcc: lambda d: d.unpack('B'),
+    0xcd: lambda d: d.unpack('H'),
+    0xce: lambda d: d.unpack('I'),
+    0xcf: lambda d: d.unpack('Q'),
+    0xd0: lambda d: d.unpack('b'),
+    0xd1: lambda d: d.unpack('h'),
+    0xd2: lambda d: d.unpack('i'),
+    0xd3: lambda d: d.unpack('q'),
+    0xd9: lambda d: d.decode_str(d.unpack('B')),
+    0xda: lambda d: d.decode_str(d.unpack('H')),
+    0xdb: lambda d: d.decode_str(d.unpack('I')),
+    0xdc: lambda d: d.decode_array(d.unpack('H')),
+    0xdd: lambda d: d.decode_array(d.unpack('I')),
+    0xde: lambda d: d.decode_map(d.unpack('H')),
+    0xdf: lambda d: d.decode_map(d.unpack('I')),
+}
+
+_default_codec = SkyNetBinaryCodec()
+
+
+def dumpb(obj) -> bytes:
+    return _default_codec.dumpb(obj)
+
+
+def loadb(data, zero_copy=False):
+    return _default_codec.loadb(data, zero_copy)
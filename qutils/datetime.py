@@ -1,15 +1,67 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+import numpy as np
 import pandas as pd
 import re
 
 
+_DATETIME_LITERAL = re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}')
+_NUMBER_LITERAL = re.compile(r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+
+
 def to_seconds(timedelta_str):
     return to_timedelta(timedelta_str).total_seconds()
 
 
 def to_timedelta(timedelta_repr):
-    return pd.to_timedelta(str(timedelta_repr), unit='s')
+    if isinstance(timedelta_repr, pd.Timedelta):
+        return timedelta_repr
+    return _parse_timedelta(str(timedelta_repr))
+
+
+TIME_LITERAL_CACHE_SIZE = 4096
+# the number of offsets from which ensure_timestamps() converts them with one to_datetime_array() call
+BULK_OFFSETS_THRESHOLD = 32
+
+
+@functools.lru_cache(maxsize=TIME_LITERAL_CACHE_SIZE)
+def _parse_timedelta(literal):
+    if _NUMBER_LITERAL.match(literal):
+        return pd.to_timedelta(float(literal), unit='s')
+    return pd.to_timedelta(literal)
+
+
+@functools.lru_cache(maxsize=TIME_LITERAL_CACHE_SIZE)
+def _parse_datetime(literal):
+    """:return: None if it is not a datetime, which is memoized as well"""
+    try:
+        return pd.to_datetime(literal, errors='raise')
+    except (ValueError, TypeError):
+        return None
+
+
+def time_literal_cache_info():
+    """
+    :return: {'timedelta' / 'datetime': {'hits', 'misses', 'size', 'maxsize', 'hit_rate'}} of the caches of the
+             parsed literals
+    """
+    info = {}
+    for name, parse in (('timedelta', _parse_timedelta), ('datetime', _parse_datetime)):
+        hits, misses, maxsize, size = parse.cache_info()
+        info[name] = {'hits': hits, 'misses': misses, 'size': size, 'maxsize': maxsize,
+                      'hit_rate': hits / (hits + misses) if hits + misses else None}
+    return info
+
+
+def clear_time_literal_cache():
+    _parse_timedelta.cache_clear()
+    _parse_datetime.cache_clear()
 
 
 def to_datetime(time_repr, from_datetime=None, if_invalid='use_now'):
@@ -19,21 +71,7 @@ def to_datetime(time_repr, from_datetime=None, if_invalid='use_now'):
     :return: A datetime object
     """
     def get_from_datetime():
-        ret = from_datetime
-        if callable(ret):
-            ret = ret()
-        if not ret:
-            if if_invalid == 'raise':
-                raise ValueError('Cannot convert to datetime {!r} from {!r}'
-                                 .format(time_repr, from_datetime))
-            elif if_invalid == 'return_none':
-                return None
-            elif if_invalid == 'use_now':
-                return pd.Timestamp.now()
-            else:
-                raise NotImplementedError('Unsupported fallback when invalid: {!r}'
-                                          .format(if_invalid))
-        return ret
+        return _get_from_datetime(time_repr, from_datetime, if_invalid)
 
     if time_repr is None:
         return get_from_datetime()
@@ -45,11 +83,10 @@ def to_datetime(time_repr, from_datetime=None, if_invalid='use_now'):
         time_repr = str(time_repr)
         if time_repr.lower() == 'now':
             return get_from_datetime()
-        if time_repr.isdigit() or re.match('\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}', time_repr):
-            try:  # assume it is a datetime object
-                return pd.to_datetime(time_repr, errors='raise')
-            except (ValueError, TypeError):
-                pass
+        if time_repr.isdigit() or _DATETIME_LITERAL.match(time_repr):
+            parsed = _parse_datetime(time_repr)  # assume it is a datetime object
+            if parsed is not None:
+                return parsed
     # it must be a timedelta
     # the following line works no matter it is already a timedelta object or a literal
     tdelta = to_timedelta(time_repr)
@@ -59,6 +96,110 @@ def to_datetime(time_repr, from_datetime=None, if_invalid='use_now'):
     return _from_datetime + tdelta
 
 
+def to_datetime_array(time_reprs, from_datetime=None, if_invalid='use_now'):
+    """
+    the vectorized to_datetime() for a sequence of time representations: they are classified in one pass and
+    each class is parsed with one pandas call, then the offsets are added to from_datetime, which is resolved only
+    once, with array arithmetic. Timezone-aware datetimes are converted to naive UTC ones.
+    Strings of 8 or 14 digits are parsed as "%Y%m%d" or "%Y%m%d%H%M%S", and other digit strings are offsets in seconds.
+    :param time_reprs: a list / array / Series of what to_datetime() accepts
+    :return: a DatetimeIndex, or a Series with the same index if time_reprs is a Series; NaT where the offsets cannot
+             be resolved because from_datetime is invalid and if_invalid is "return_none"
+    """
+    index = time_reprs.index if isinstance(time_reprs, pd.Series) else None
+    values = list(time_reprs)
+    bases, datetimes, literals, seconds, timedeltas = [], [], [], [], []
+    digits = {8: [], 14: []}
+    for i, value in enumerate(values):
+        if value is None:
+            bases.append(i)
+        elif isinstance(value, (datetime, np.datetime64)):
+            datetimes.append(i)
+        elif isinstance(value, str):
+            if value.isdigit():
+                digits.get(len(value), seconds).append(i)
+            elif _DATETIME_LITERAL.match(value):
+                literals.append(i)
+            elif _NUMBER_LITERAL.match(value):
+                seconds.append(i)
+            elif value.lower() == 'now':
+                bases.append(i)
+            else:
+                timedeltas.append(i)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            seconds.append(i)
+        else:
+            timedeltas.append(i)
+
+    result = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[ns]')
+
+    def put(positions, parsed):
+        result[positions] = np.asarray(parsed, dtype='datetime64[ns]')
+
+    if datetimes:
+        put(datetimes, pd.to_datetime([values[i] for i in datetimes], utc=True).tz_localize(None))
+    for length, fmt in ((8, '%Y%m%d'), (14, '%Y%m%d%H%M%S')):
+        if digits[length]:
+            parsed = pd.to_datetime([values[i] for i in digits[length]], format=fmt, errors='coerce')
+            valid = ~parsed.isna()
+            put([i for i, v in zip(digits[length], valid) if v], parsed[valid])
+            seconds.extend(i for i, v in zip(digits[length], valid) if not v)
+    if literals:
+        try:
+            put(literals, _parse_datetime_literals([values[i] for i in literals]))
+        except (ValueError, TypeError):
+            for i in literals:
+                try:
+                    put([i], [pd.to_datetime(values[i], errors='raise', utc=True).tz_localize(None)])
+                except (ValueError, TypeError):
+                    timedeltas.append(i)
+
+    offsets = bases + seconds + timedeltas
+    if offsets:
+        base = _get_from_datetime(time_reprs, from_datetime, if_invalid)
+        if base is not None:
+            base = pd.Timestamp(base)
+            if base.tzinfo is not None:
+                base = base.tz_convert(None)
+            base = np.datetime64(base.value, 'ns')
+            if bases:
+                result[bases] = base
+            if seconds:
+                result[seconds] = base + np.asarray(pd.to_timedelta(np.array([float(values[i]) for i in seconds]),
+                                                                    unit='s'), dtype='timedelta64[ns]')
+            if timedeltas:
+                result[timedeltas] = base + np.asarray(pd.to_timedelta([values[i] for i in timedeltas]),
+                                                       dtype='timedelta64[ns]')
+    result = pd.DatetimeIndex(result)
+    return result if index is None else pd.Series(result, index=index)
+
+
+def _parse_datetime_literals(strs):
+    try:
+        parsed = pd.to_datetime(strs, format='ISO8601', utc=True)
+    except ValueError:  # pandas < 2.0 does not know "ISO8601" but parses ISO 8601 strings of any precision
+        parsed = pd.to_datetime(strs, utc=True)
+    return parsed.tz_localize(None)
+
+
+def _get_from_datetime(time_repr, from_datetime, if_invalid):
+    ret = from_datetime
+    if callable(ret):
+        ret = ret()
+    if not ret:
+        if if_invalid == 'raise':
+            raise ValueError('Cannot convert to datetime {!r} from {!r}'
+                             .format(time_repr, from_datetime))
+        elif if_invalid == 'return_none':
+            return None
+        elif if_invalid == 'use_now':
+            return pd.Timestamp.now()
+        else:
+            raise NotImplementedError('Unsupported fallback when invalid: {!r}'
+                                      .format(if_invalid))
+    return ret
+
+
 def ensure_timestamps(timestamps, func_get_latest_time=None, if_fail='ignore'):
     t_is_not_timestamp = [t is None or isinstance(t, (str, pd.Timedelta, timedelta))
                           for t in timestamps]
@@ -77,8 +218,193 @@ def ensure_timestamps(timestamps, func_get_latest_time=None, if_fail='ignore'):
             timestamps[-1] = last_timestamp
         else:
             last_timestamp = timestamps[-1]
+        # the offsets of a long list are converted in bulk, which to_datetime_array() resolves exactly as
+        # to_datetime() does, while the datetime literals and digit strings are always parsed one by one.
+        # A short window, e.g. ['-1h', 'now'], is faster without the array setup, and to_datetime_array() returns
+        # naive UTC datetimes, so an aware base keeps the per-value path entirely
+        if getattr(last_timestamp, 'tzinfo', None) is None:
+            offsets = [i for i, t in enumerate(timestamps[:-1]) if t_is_not_timestamp[i]
+                       and not (isinstance(t, str) and (t.isdigit() or _DATETIME_LITERAL.match(t)))]
+            if len(offsets) >= BULK_OFFSETS_THRESHOLD:
+                converted = to_datetime_array([timestamps[i] for i in offsets], from_datetime=last_timestamp)
+                for i, t in zip(offsets, converted):
+                    timestamps[i] = t
+                    t_is_not_timestamp[i] = False
         timestamps[:-1] = [to_datetime(t, from_datetime=last_timestamp) if is_not_timestamp else t
                            for t, is_not_timestamp in zip(timestamps[:-1], t_is_not_timestamp[:-1])]
     # if all(t == timestamps[0] for t in timestamps[1:]):
     #     timestamps = [timestamps[0]]
     return timestamps
+
+
+class WindowScheduler:
+    """
+    Runs many periodic jobs on one timer. Each time a job fires, its window spec, like ['-1h', 'now'], is resolved
+    by ensure_timestamps() against the fire time, and the job is called with the resolved timestamps.
+    The next fire times of all the jobs are kept in a heap, and the due jobs run on a thread pool,
+    either from a timer thread with start() or from an asyncio task with run_async(), where coroutine functions are
+    run as tasks of the event loop instead.
+    """
+
+    CATCH_UP = 'catch_up'  # run once for each of the missed fire times
+    SKIP = 'skip'  # run once for the latest missed fire time only
+
+    class Job:
+        def __init__(self, fn, interval, window, next_time, policy, name):
+            super().__init__()
+            self.fn = fn
+            self.interval = interval
+            self.window = window
+            self.next_time = next_time
+            self.policy = policy
+            self.name = name
+            self.cancelled = False
+            self.runs = 0
+            self.skipped = 0
+            self.errors = 0
+            self.last_error = None
+
+        def __repr__(self):
+            return '{}({!r}, every {}, next at {})'.format(type(self).__name__, self.name, self.interval,
+                                                           self.next_time)
+
+    def __init__(self, executor=None, max_workers=None, timer=pd.Timestamp.now):
+        """
+        :param executor: a concurrent.futures executor to run the jobs, by default a ThreadPoolExecutor of max_workers
+        :param timer: the function returning the current time as a Timestamp
+        """
+        super().__init__()
+        self.executor = executor or ThreadPoolExecutor(max_workers)
+        self.timer = timer
+        self.running = False
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._loop = None
+        self._event = None
+
+    def add(self, fn, interval, window=('now',), start=None, policy=SKIP, name=None):
+        """
+        :param interval: a timedelta or a timedelta literal like "5m"
+        :param window: the time expressions to resolve at every fire time, which is what "now" means in them
+        :param start: the first fire time as what to_datetime() accepts, by default now
+        :param policy: CATCH_UP or SKIP, what to do with the fire times missed because of the scheduler being late
+        """
+        if policy not in (self.CATCH_UP, self.SKIP):
+            raise ValueError('Unsupported policy for missed fire times: {!r}'.format(policy))
+        interval = to_timedelta(interval)
+        if interval <= pd.Timedelta(0):
+            raise ValueError('The interval must be positive, but got {!r}'.format(interval))
+        next_time = to_datetime(start, from_datetime=self.timer)
+        ensure_timestamps(list(window), func_get_latest_time=lambda: next_time, if_fail='raise')  # fail early
+        job = self.Job(fn, interval, tuple(window), next_time, policy, name or getattr(fn, '__name__', repr(fn)))
+        with self._cond:
+            self._push(job)
+        self._wake_up()
+        return job
+
+    def remove(self, job):
+        with self._cond:
+            job.cancelled = True
+        self._wake_up()
+
+    def run_pending(self):
+        """
+        run the jobs due by now without waiting for them
+        :return: the futures of the job runs
+        """
+        return [self.executor.submit(self._run, job, timestamps) for job, timestamps in self._pop_due()]
+
+    def start(self):
+        """run the jobs in a timer thread until stop()"""
+        self.running = True
+        thread = threading.Thread(target=self._run_thread, name='WindowScheduler')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    async def run_async(self):
+        """run the jobs in the current event loop until stop()"""
+        self._loop = asyncio.get_event_loop()
+        self._event = asyncio.Event()
+        self.running = True
+        try:
+            while self.running:
+                for job, timestamps in self._pop_due():
+                    if asyncio.iscoroutinefunction(job.fn):
+                        asyncio.ensure_future(self._run_async(job, timestamps))
+                    else:
+                        self._loop.run_in_executor(self.executor, self._run, job, timestamps, False)
+                self._event.clear()
+                try:
+                    await asyncio.wait_for(self._event.wait(), self._seconds_until_next())
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._loop = self._event = None
+
+    def stop(self):
+        self.running = False
+        self._wake_up()
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.next_time, next(self._seq), job))
+
+    def _pop_due(self):
+        now = self.timer()
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                fire_time, _, job = heapq.heappop(self._heap)
+                if job.cancelled:
+                    continue
+                missed = int((now - fire_time) / job.interval)
+                if job.policy == self.CATCH_UP:
+                    fire_times = [fire_time + job.interval * i for i in range(missed + 1)]
+                else:
+                    fire_times = [fire_time + job.interval * missed]
+                    job.skipped += missed
+                job.next_time = fire_times[-1] + job.interval
+                self._push(job)
+                due.extend((job, fire_time) for fire_time in fire_times)
+        return [(job, ensure_timestamps(list(job.window), func_get_latest_time=lambda t=fire_time: t, if_fail='raise'))
+                for job, fire_time in due]
+
+    def _seconds_until_next(self):
+        with self._cond:
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            return max((self._heap[0][0] - self.timer()).total_seconds(), 0)
+
+    def _wake_up(self):
+        with self._cond:
+            self._cond.notify()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    def _run_thread(self):
+        while self.running:
+            self.run_pending()
+            with self._cond:
+                if self.running:
+                    self._cond.wait(self._seconds_until_next())
+
+    def _run(self, job, timestamps, reraise=True):
+        job.runs += 1
+        try:
+            return job.fn(*timestamps)
+        except Exception as err:
+            job.errors += 1
+            job.last_error = err
+            if reraise:
+                raise
+
+    async def _run_async(self, job, timestamps):
+        job.runs += 1
+        try:
+            return await job.fn(*timestamps)
+        except Exception as err:
+            job.errors += 1
+            job.last_error = err
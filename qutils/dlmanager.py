@@ -1,4 +1,10 @@
+import inspect
 import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
 
 import requests
 
@@ -53,41 +59,220 @@ class Ticket(JsonModel):
     }
 
 
+class ResponseCache:
+    """
+    A thread-safe LRU cache of API responses. An entry is fresh for `ttl` seconds, after which it is still served
+    for another `stale_ttl` seconds while it is re-fetched in the background (stale-while-revalidate).
+    """
+
+    def __init__(self, maxsize=10000, ttl=60, stale_ttl=0, refresh_workers=4, timer=time.monotonic):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_workers = refresh_workers
+        self.timer = timer
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, fetch time)
+        self._refreshing = set()
+        self._generation = 0  # bumped on invalidation so that in-flight fetches do not store outdated values
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def get(self, key, fetch):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = self.timer() - fetched_at
+                if age < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if age < self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        if self._executor is None:
+                            self._executor = ThreadPoolExecutor(max_workers=self.refresh_workers)
+                        self._executor.submit(self._refresh, key, fetch, self._generation)
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            generation = self._generation
+        value = fetch()
+        self._store(key, value, generation)
+        return value
+
+    def peek(self, key, default=None):
+        """return the cached value (fresh or stale) without fetching or refreshing it"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self.timer() - entry[1] >= self.ttl + self.stale_ttl:
+                return default
+            return entry[0]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def invalidate_if(self, predicate):
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _refresh(self, key, fetch, generation):
+        try:
+            self._store(key, fetch(), generation)
+        except Exception:
+            pass  # keep serving the stale value until it expires
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, value, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (value, self.timer())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, so that calls fail fast instead of hitting a struggling
+    server. After `reset_timeout` seconds one trial call is let through: the circuit closes if it succeeds,
+    or stays open for another `reset_timeout` if it fails.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, timer=time.monotonic):
+        super().__init__()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timer = timer
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def closed(self):
+        return self.opened_at is None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._trial and self.timer() - self.opened_at >= self.reset_timeout:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.timer()
+                self._trial = False
+
+
+def _cached_read(fn):
+    """cache the results of a read API of DLManager in DLManager.cache, keyed by the API name and its arguments"""
+    signature = inspect.signature(fn)
+
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if self.cache is None:
+            return fn(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = (fn.__name__,) + tuple(a.samAccountName if isinstance(a, User) else a
+                                     for a in list(bound.arguments.values())[1:])
+        return self.cache.get(key, lambda: fn(self, *args, **kwargs))
+
+    return wrapper
+
+
 class DLManager:
     PREFIX = 'https://dlmanager.paypalcorp.com/API'
     session = requests.Session()
 
-    def __init__(self, executor: str, token: str, url_prefix: str = None):
+    # bulk calls fan out over a thread pool; keep it within the session's default per-host connection pool (10)
+    BULK_MAX_WORKERS = 8
+    BULK_MAX_RETRIES = 3
+    BULK_RETRY_BACKOFF = 0.5
+
+    def __init__(self, executor: str, token: str, url_prefix: str = None, cache: ResponseCache = None,
+                 exists_check='api', circuit_breaker: CircuitBreaker = None):
+        """
+        :param cache: if given, the results of the read APIs are cached in it, and invalidated by the writing APIs.
+            The cached models are shared between callers, so do not modify them.
+        :param exists_check: how a failed call on a DL tells DLNotExist from CallAPIError:
+            'api' asks exists_dl (through the cache if any), 'cache' only looks up the cached exists_dl results,
+            'off' never checks. The error keeps the DL name in `dl_name`, so the check can be done later if needed.
+        :param circuit_breaker: if given, calls fail fast with CircuitOpen after repeated server errors (5xx)
+        """
         super().__init__()
         self.executor = executor
         self.token = token
         if url_prefix is not None:
             self.PREFIX = url_prefix
+        self.cache = cache
+        if exists_check not in ('api', 'cache', 'off'):
+            raise ValueError('unrecognized exists_check: {!r}'.format(exists_check))
+        self.exists_check = exists_check
+        self.circuit_breaker = circuit_breaker
 
+    @_cached_read
     def get_dl_properties(self, dl_name):
         url = self.PREFIX + '/DL/properties/{}/{}/{}'.format(dl_name, self.executor, self.token)
         return DL(self._get_dl_info(url, dl_name, 'get the properties of').json())
 
+    @_cached_read
     def get_dl_members(self, dl_name, recursive=False):
         url = self.PREFIX + '/DL/members{}/{}/{}/{}'.format('/recursive' if recursive else '',
                                                             dl_name, self.executor, self.token)
         return [User(u) for u in self._get_dl_info(url, dl_name, 'get the members of').json()]
 
+    @_cached_read
     def get_user_memberships(self, user):
         if isinstance(user, User):
             user = user.samAccountName
         url = self.PREFIX + '/User/memberships/{}/{}/{}'.format(user, self.executor, self.token)
         return self._get_user_related_dls(url, user)
 
+    @_cached_read
     def get_user_ownerships(self, user):
         if isinstance(user, User):
             user = user.samAccountName
         url = self.PREFIX + '/User/ownerships/{}/{}/{}'.format(user, self.executor, self.token)
         return self._get_user_related_dls(url, user)
 
+    @_cached_read
     def get_user_properties(self, user_name):
         url = self.PREFIX + '/User/properties/{}/{}/{}'.format(user_name, self.executor, self.token)
-        resp = self.session.get(url, verify=False)
+        resp = self._request('GET', url)
         self._raise_for_error(resp, 'Cannot get properties of user "{}"'.format(user_name),
                               {requests.codes.server_error: 'invalid corp id / invalid executor / '
                                                             'invalid token / internal server error'})
@@ -96,14 +281,30 @@ class DLManager:
             return User(user_json)
         raise self.UserNotExist('User "{}" does not exist'.format(user_name))
 
+    @_cached_read
     def exists_dl(self, dl_name):
         url = self.PREFIX + '/DL/exist/{}/{}/{}'.format(dl_name, self.executor, self.token)
-        resp = self.session.get(url, verify=False)
+        resp = self._request('GET', url)
         self._raise_for_error(resp, 'Cannot check if DL "{}" exists'.format(dl_name),
                               {requests.codes.server_error: 'invalid executor / invalid token / '
                                                             'internal server error'})
         return resp.text == 'true'
 
+    def get_many_dl_properties(self, dl_names, max_workers=None):
+        return self._call_many(self.get_dl_properties, dl_names, max_workers)
+
+    def get_many_dl_members(self, dl_names, recursive=False, max_workers=None):
+        return self._call_many(partial(self.get_dl_members, recursive=recursive), dl_names, max_workers)
+
+    def get_many_user_memberships(self, users, max_workers=None):
+        return self._call_many(self.get_user_memberships, users, max_workers)
+
+    def get_many_user_properties(self, user_names, max_workers=None):
+        return self._call_many(self.get_user_properties, user_names, max_workers)
+
+    def exists_many_dl(self, dl_names, max_workers=None):
+        return self._call_many(self.exists_dl, dl_names, max_workers)
+
     def new_dl(self, dl_name=None, members=None, owners=None, ticket=None):
         url = self.PREFIX + '/DL/new/{}/{}'.format(self.executor, self.token)
         if dl_name is None and members is None and owners is None:
@@ -120,28 +321,37 @@ class DLManager:
                 ticket.members = []
             if owners is not None:
                 ticket.owners = self._ensure_name_list(owners)
-        resp = self.session.post(url, json=ticket.to_dict(), verify=False)
-        self._raise_for_error(resp, 'Cannot create DL "{}"'.format(dl_name),
-                              {requests.codes.unauthorized: 'invalid executor or token',
-                               requests.codes.server_error: 'invalid ticket: {!r}'.format(ticket)})
+        try:
+            resp = self._request('POST', url, json=ticket.to_dict())
+            self._raise_for_error(resp, 'Cannot create DL "{}"'.format(dl_name),
+                                  {requests.codes.unauthorized: 'invalid executor or token',
+                                   requests.codes.server_error: 'invalid ticket: {!r}'.format(ticket)})
+        finally:
+            self._invalidate_cache([ticket.dlName], ('get_user_memberships', 'get_user_ownerships'))
 
     def rename_dl(self, dl_name, new_dl_name):
         url = self.PREFIX + '/DL/renameDL/{}/{}/{}/{}'.format(dl_name, new_dl_name, self.executor, self.token)
-        self._get_dl_info(url, dl_name, 'rename to "{}" from'.format(new_dl_name))
+        try:
+            self._get_dl_info(url, dl_name, 'rename to "{}" from'.format(new_dl_name))
+        finally:
+            self._invalidate_cache([dl_name, new_dl_name], ('get_user_memberships', 'get_user_ownerships'))
 
     def set_public_dl(self, dl_name, public):
         url = self.PREFIX + '/DL/setPublic/{}/{}/{}/{}'.format(dl_name, public and 'true' or 'false',
                                                                self.executor, self.token)
-        resp = self.session.get(url, verify=False)
-        self._raise_for_error(resp, 'Cannot set DL "{}" to {}public'.format(dl_name, '' if public else 'non-'),
-                              {requests.codes.unauthorized: 'invalid executor or token',
-                               requests.codes.bad_request: 'invalid public status',
-                               requests.codes.server_error: 'server error'},
-                              dl_name, requests.codes.server_error)
+        try:
+            resp = self._request('GET', url)
+            self._raise_for_error(resp, 'Cannot set DL "{}" to {}public'.format(dl_name, '' if public else 'non-'),
+                                  {requests.codes.unauthorized: 'invalid executor or token',
+                                   requests.codes.bad_request: 'invalid public status',
+                                   requests.codes.server_error: 'server error'},
+                                  dl_name, requests.codes.server_error)
+        finally:
+            self._invalidate_cache([dl_name], dl_apis=('get_dl_properties',))
 
     def search_dl(self, keyword):
         url = self.PREFIX + '/DL/search/{}/{}/{}'.format(keyword, self.executor, self.token)
-        resp = self.session.get(url, verify=False)
+        resp = self._request('GET', url)
         self._raise_for_error(resp, 'Cannot search DLs with keyword ""'.format(keyword),
                               {requests.codes.server_error: 'invalid executor / invalid token / server errors'})
         return [DL(d) for d in resp.json()]
@@ -151,38 +361,55 @@ class DLManager:
         dl_names = self._ensure_name_list(dl_names)
         if any(not isinstance(d, str) for d in dl_names):
             raise ValueError('the dl_names must be one or a list of DLs')
-        resp = self.session.post(url, data=json.dumps(dl_names),
-                                 headers={'Content-Type': 'application/json'}, verify=False)
-        self._raise_for_error(
-            resp,
-            'Cannot delete DLs {}'.format(', '.format('"{}"'.format(d) for d in dl_names)),
-            {requests.codes.unauthorized: 'invalid executor or token',
-             requests.codes.expectation_failed: 'invalid DL names or server errors',
-             requests.codes.server_error: 'invalid DL names or server errors'}
-        )
+        try:
+            resp = self._request('POST', url, data=json.dumps(dl_names),
+                                 headers={'Content-Type': 'application/json'})
+            self._raise_for_error(
+                resp,
+                'Cannot delete DLs {}'.format(', '.format('"{}"'.format(d) for d in dl_names)),
+                {requests.codes.unauthorized: 'invalid executor or token',
+                 requests.codes.expectation_failed: 'invalid DL names or server errors',
+                 requests.codes.server_error: 'invalid DL names or server errors'}
+            )
+        finally:
+            self._invalidate_cache(dl_names, ('get_user_memberships', 'get_user_ownerships'))
 
     def add_dl_members(self, dl_name, members):
         url = self.PREFIX + '/DL/members/add/{}/{}/{}'.format(dl_name, self.executor, self.token)
-        return self._process_dl_users(url, dl_name, members, 'add member(s)', 'to')
+        try:
+            return self._process_dl_users(url, dl_name, members, 'add member(s)', 'to')
+        finally:
+            self._invalidate_cache([dl_name], ('get_user_memberships',), members,
+                                   ('get_dl_properties', 'get_dl_members'))
 
     def add_dl_owners(self, dl_name, owners):
         url = self.PREFIX + '/DL/owners/add/{}/{}/{}'.format(dl_name, self.executor, self.token)
-        return self._process_dl_users(url, dl_name, owners, 'add owners(s)', 'to')
+        try:
+            return self._process_dl_users(url, dl_name, owners, 'add owners(s)', 'to')
+        finally:
+            self._invalidate_cache([dl_name], ('get_user_ownerships',), owners, ('get_dl_properties',))
 
     def remove_dl_members(self, dl_name, members):
         url = self.PREFIX + '/DL/members/remove/{}/{}/{}'.format(dl_name, self.executor, self.token)
-        return self._process_dl_users(url, dl_name, members, 'remove member(s)', 'from')
+        try:
+            return self._process_dl_users(url, dl_name, members, 'remove member(s)', 'from')
+        finally:
+            self._invalidate_cache([dl_name], ('get_user_memberships',), members,
+                                   ('get_dl_properties', 'get_dl_members'))
 
     def remove_dl_owners(self, dl_name, owners):
         url = self.PREFIX + '/DL/owners/remove/{}/{}/{}'.format(dl_name, self.executor, self.token)
-        return self._process_dl_users(url, dl_name, owners, 'remove owner(s)', 'from')
+        try:
+            return self._process_dl_users(url, dl_name, owners, 'remove owner(s)', 'from')
+        finally:
+            self._invalidate_cache([dl_name], ('get_user_ownerships',), owners, ('get_dl_properties',))
 
     def _process_dl_users(self, url, dl_name, users, log_action, log_action_prep):
         users = self._ensure_name_list(users)
         if any(not isinstance(u, str) for u in users):
             raise ValueError('the users must be one or a list of corp ids')
-        resp = self.session.post(url, data=json.dumps(users),
-                                 headers={'Content-Type': 'application/json'}, verify=False)
+        resp = self._request('POST', url, data=json.dumps(users),
+                             headers={'Content-Type': 'application/json'})
         self._raise_for_error(
             resp,
             'Cannot {} {} {} DL "{}"'.format(log_action, ', '.format('"{}"'.format(u) for u in users),
@@ -193,7 +420,7 @@ class DLManager:
         )
 
     def _get_dl_info(self, url, dl_name, log_action):
-        resp = self.session.get(url, verify=False)
+        resp = self._request('GET', url)
         self._raise_for_error(resp, 'Cannot {} DL "{}"'.format(log_action, dl_name),
                               {requests.codes.bad_request: 'invalid DL name',
                                requests.codes.server_error: 'invalid executor / invalid token / '
@@ -202,12 +429,63 @@ class DLManager:
         return resp
 
     def _get_user_related_dls(self, url, user):
-        resp = self.session.get(url, verify=False)
+        resp = self._request('GET', url)
         self._raise_for_error(resp, 'Cannot get related DLs of user "{}"'.format(user),
                               {requests.codes.server_error: 'invalid corp id / invalid executor / '
                                                             'invalid token / internal server error'})
         return [DL(d) for d in resp.json()]
 
+    def _invalidate_cache(self, dl_names, user_apis=(), users=None,
+                          dl_apis=('get_dl_properties', 'get_dl_members', 'exists_dl')):
+        """
+        drop the cached results of dl_apis for the given DLs, and of user_apis for the given users (None for all).
+        Changing the members of a DL may affect the nested DLs, so all the cached recursive members are dropped too.
+        """
+        if self.cache is None:
+            return
+        dl_names = set(dl_names)
+        users = None if users is None else set(self._ensure_name_list(users))
+
+        def affected(key):
+            api = key[0]
+            if api in dl_apis:
+                return key[1] in dl_names or api == 'get_dl_members' and key[2]
+            return api in user_apis and (users is None or key[1] in users)
+
+        self.cache.invalidate_if(affected)
+
+    def _call_many(self, fn, names, max_workers=None):
+        """
+        call fn(name) for every name concurrently, retrying on server errors.
+        :return: a tuple of two dicts (results, errors), both keyed by name and in the order of names
+        """
+        names = list(dict.fromkeys(self._ensure_name_list(names)))
+        results, errors = {}, {}
+        if not names:
+            return results, errors
+        with ThreadPoolExecutor(max_workers=min(max_workers or self.BULK_MAX_WORKERS, len(names))) as executor:
+            futures = [executor.submit(self._call_with_retry, fn, name) for name in names]
+            for name, future in zip(names, futures):
+                try:
+                    results[name] = future.result()
+                except (self.Error, requests.RequestException) as err:
+                    errors[name] = err
+        return results, errors
+
+    def _call_with_retry(self, fn, *args, **kwargs):
+        backoff = self.BULK_RETRY_BACKOFF
+        for retry in range(self.BULK_MAX_RETRIES + 1):
+            try:
+                return fn(*args, **kwargs)
+            except self.CallAPIError as err:
+                if retry >= self.BULK_MAX_RETRIES or (err.status_code or 0) < requests.codes.server_error:
+                    raise
+            except (requests.ConnectionError, requests.Timeout):
+                if retry >= self.BULK_MAX_RETRIES:
+                    raise
+            time.sleep(backoff)
+            backoff *= 2
+
     @staticmethod
     def _ensure_name_list(users_or_dls):
         if not is_list(users_or_dls):
@@ -215,34 +493,201 @@ class DLManager:
         users_or_dls = [u.samAccountName if isinstance(u, User) else u for u in users_or_dls]
         return users_or_dls
 
+    def _request(self, method, url, **kwargs):
+        self._check_circuit(method, url)
+        try:
+            resp = self.session.request(method, url, verify=False, **kwargs)
+        except requests.RequestException:
+            self._record_response(None)
+            raise
+        self._record_response(resp.status_code)
+        return resp
+
+    def _check_circuit(self, method, url):
+        if self.circuit_breaker is not None and not self.circuit_breaker.allow():
+            raise self.CircuitOpen('Cannot call API "{} {}" because of too many server errors recently'
+                                   .format(method, url))
+
+    def _record_response(self, status_code):
+        if self.circuit_breaker is not None:
+            if status_code is None or status_code >= requests.codes.server_error:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
     def _raise_for_error(self, resp, log_error_action,
                          code_log_reason=None, check_exists_dl=None, check_exists_dl_when=None):
         if resp.status_code != requests.codes.ok:
-            error_cls = self.CallAPIError
-            reason_message = ''
+            exists = None
             if check_exists_dl and (check_exists_dl_when is None or check_exists_dl_when == resp.status_code):
-                try:
-                    exist_dl = self.exists_dl(check_exists_dl)
-                except self.CallAPIError:
-                    pass
-                else:
-                    if not exist_dl:
-                        error_cls = self.DLNotExist
-                        reason_message = 'DL "{}" does not exist'.format(check_exists_dl)
-            reason_message = reason_message or (code_log_reason or {}).get(resp.status_code, '')
-            reason_message = reason_message and ' because of ' + reason_message
-            raise error_cls('{} through API "{}"{}. Server response: <{}: {}> {}'
-                            .format(log_error_action, resp.url, reason_message,
-                                    resp.status_code, resp.reason, resp.text))
+                exists = self._known_dl_existence(check_exists_dl)
+                if exists is None and self._can_call_exists_dl():
+                    try:
+                        exists = self.exists_dl(check_exists_dl)
+                    except self.CallAPIError:
+                        pass
+            raise self._api_error(resp, log_error_action, code_log_reason, check_exists_dl, exists is False)
+
+    def _known_dl_existence(self, dl_name):
+        if self.exists_check == 'off' or self.cache is None:
+            return None
+        return self.cache.peek(('exists_dl', dl_name))
+
+    def _can_call_exists_dl(self):
+        return self.exists_check == 'api' and (self.circuit_breaker is None or self.circuit_breaker.closed)
+
+    def _api_error(self, resp, log_error_action, code_log_reason=None, dl_name=None, dl_not_exist=False):
+        if dl_not_exist:
+            error_cls = self.DLNotExist
+            reason_message = 'DL "{}" does not exist'.format(dl_name)
+        else:
+            error_cls = self.CallAPIError
+            reason_message = (code_log_reason or {}).get(resp.status_code, '')
+        reason_message = reason_message and ' because of ' + reason_message
+        return error_cls('{} through API "{}"{}. Server response: <{}: {}> {}'
+                         .format(log_error_action, resp.url, reason_message,
+                                 resp.status_code, resp.reason, resp.text),
+                         status_code=resp.status_code, dl_name=dl_name)
 
     class Error(Exception):
-        pass
+        def __init__(self, *args, status_code=None, dl_name=None):
+            super().__init__(*args)
+            self.status_code = status_code
+            self.dl_name = dl_name
 
     class CallAPIError(Error):
         pass
 
+    class CircuitOpen(CallAPIError):
+        pass
+
     class DLNotExist(Error):
         pass
 
     class UserNotExist(Error):
         pass
+
+
+class MembershipGraph:
+    """
+    A local graph of direct DL memberships, built from the results of DLManager.get_dl_members and
+    DLManager.get_user_memberships, that answers transitive membership queries without calling the API.
+    Cycles of nested DLs are allowed. Queries only see what has been loaded into the graph.
+    """
+
+    # the User.type values of the members that are DLs themselves
+    DL_MEMBER_TYPES = ('DL', 'Group', 'group')
+
+    def __init__(self, dl_manager: DLManager = None):
+        super().__init__()
+        self.dl_manager = dl_manager
+        self._members = {}  # dl name -> set of the names of its direct members
+        self._parents = {}  # member name -> set of the names of the DLs it directly belongs to
+        self._loaded_at = {}  # dl name -> time when its members were last loaded
+        self._ancestors = {}  # memoized transitive memberships, reset whenever the graph changes
+        self._descendants = {}  # memoized transitive members, reset whenever the graph changes
+        self._lock = threading.RLock()
+
+    def set_dl_members(self, dl_name, members):
+        """replace the direct members of a DL with the result of DLManager.get_dl_members"""
+        members = set(DLManager._ensure_name_list(members))
+        with self._lock:
+            for member in self._members.get(dl_name, set()) - members:
+                self._parents[member].discard(dl_name)
+            for member in members:
+                self._parents.setdefault(member, set()).add(dl_name)
+            self._members[dl_name] = members
+            self._loaded_at[dl_name] = time.monotonic()
+            self._changed()
+
+    def set_user_memberships(self, user, dls):
+        """replace the DLs a user directly belongs to with the result of DLManager.get_user_memberships"""
+        user = DLManager._ensure_name_list(user)[0]
+        dls = set(d.samAccountName if isinstance(d, DL) else d for d in dls)
+        with self._lock:
+            parents = self._parents.setdefault(user, set())
+            for dl_name in parents - dls:
+                self._members[dl_name].discard(user)
+            for dl_name in dls:
+                self._members.setdefault(dl_name, set()).add(user)
+            parents.clear()
+            parents.update(dls)
+            self._changed()
+
+    def remove_dl(self, dl_name):
+        with self._lock:
+            for member in self._members.pop(dl_name, ()):
+                self._parents[member].discard(dl_name)
+            for parent in self._parents.pop(dl_name, ()):
+                self._members[parent].discard(dl_name)
+            self._loaded_at.pop(dl_name, None)
+            self._changed()
+
+    def load(self, dl_names, nested=True, max_workers=None):
+        """
+        fetch the direct members of the DLs through the DL manager, and those of their nested DLs if nested.
+        :return: the dict of errors keyed by the names of the DLs that failed to load
+        """
+        all_errors = {}
+        to_load = DLManager._ensure_name_list(dl_names)
+        visited = set()
+        while to_load:
+            visited.update(to_load)
+            results, errors = self.dl_manager.get_many_dl_members(to_load, max_workers=max_workers)
+            all_errors.update(errors)
+            for dl_name, error in errors.items():
+                if isinstance(error, DLManager.DLNotExist):
+                    self.remove_dl(dl_name)
+            to_load = []
+            for dl_name, members in results.items():
+                self.set_dl_members(dl_name, members)
+                if nested:
+                    to_load.extend(m.samAccountName for m in members
+                                   if m.type in self.DL_MEMBER_TYPES and m.samAccountName not in visited)
+            to_load = list(dict.fromkeys(to_load))
+        return all_errors
+
+    def load_user(self, user):
+        """fetch the DLs a user directly belongs to through the DL manager"""
+        self.set_user_memberships(user, self.dl_manager.get_user_memberships(user))
+
+    def refresh(self, max_age=None, max_workers=None):
+        """
+        re-fetch the members of the loaded DLs that were loaded more than max_age seconds ago (all if None)
+        :return: the dict of errors keyed by the names of the DLs that failed to refresh
+        """
+        now = time.monotonic()
+        with self._lock:
+            dl_names = [d for d, loaded_at in self._loaded_at.items() if max_age is None or now - loaded_at > max_age]
+        return self.load(dl_names, nested=False, max_workers=max_workers) if dl_names else {}
+
+    def memberships(self, member):
+        """all the DLs a user or DL effectively belongs to, directly or through nested DLs"""
+        member = DLManager._ensure_name_list(member)[0]
+        return self._closure(member, self._parents, self._ancestors)
+
+    def members(self, dl_name):
+        """all the users and DLs that effectively belong to a DL, directly or through nested DLs"""
+        return self._closure(dl_name, self._members, self._descendants)
+
+    def is_member(self, member, dl_name):
+        return dl_name in self.memberships(member)
+
+    def _closure(self, node, edges, memo):
+        result = memo.get(node)
+        if result is None:
+            with self._lock:
+                visited = set()
+                stack = list(edges.get(node, ()))
+                while stack:
+                    n = stack.pop()
+                    if n not in visited:
+                        visited.add(n)
+                        stack.extend(edges.get(n, ()))
+                visited.discard(node)
+                result = memo[node] = frozenset(visited)
+        return result
+
+    def _changed(self):
+        self._ancestors = {}
+        self._descendants = {}
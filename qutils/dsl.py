@@ -234,13 +234,15 @@ class AsyncDSLTransformer(DSLTransformer):
             body=[
                 ast.AsyncFunctionDef(
                     name='_f',
-                    args=ast.arguments(args=[ast.arg(arg='_ns')],
+                    args=ast.arguments(posonlyargs=[], args=[ast.arg(arg='_ns')],
                                        vararg=None, kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[]),
                     body=node.body,
                     decorator_list=[],
                     returns=None
                 )
-            ]
+            ],
+            # required since Python 3.8, and so is posonlyargs
+            type_ignores=[]
         )
 
 
@@ -253,13 +255,15 @@ class SyncDSLTransformer(DSLTransformer):
             body=[
                 ast.FunctionDef(
                     name='_f',
-                    args=ast.arguments(args=[ast.arg(arg='_ns')],
+                    args=ast.arguments(posonlyargs=[], args=[ast.arg(arg='_ns')],
                                        vararg=None, kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[]),
                     body=node.body,
                     decorator_list=[],
                     returns=None
                 )
-            ]
+            ],
+            # required since Python 3.8, and so is posonlyargs
+            type_ignores=[]
         )
 
 
@@ -1,3 +1,8 @@
+import asyncio
+import hashlib
+import json
+import numbers
+import threading
 import time
 
 import collections
@@ -7,36 +12,343 @@ import functools
 
 
 class lazy:
-    def __init__(self, fn):
+    """
+    memoizes the result of a function without arguments. Concurrent first calls wait for the same call of fn
+    instead of calling it again, and if fn is a coroutine function, calling lazy returns an awaitable that is
+    shared by the concurrent tasks of the same event loop in the same way.
+    Errors are not memoized, so the next call tries again.
+    """
+
+    def __init__(self, fn, ttl=None, refresh_ahead=None, timer=time.monotonic):
+        """
+        :param ttl: seconds to keep the result, None for forever
+        :param refresh_ahead: seconds before the result expires, from when a call returns the current result and
+                              refreshes it in the background (in a thread, or a task for coroutine functions)
+        """
         super().__init__()
+        functools.update_wrapper(self, fn)
         self.fn = fn
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.timer = timer
         self.called = False
         self.res = None
+        self.expires = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._generation = 0
+        self._refreshing = False
+        self._future = None
+        self._async = asyncio.iscoroutinefunction(fn)
 
     def __call__(self):
+        if self._async:
+            return self._async_call()
+        with self._lock:
+            if self._fresh():
+                self.hits += 1
+                return self.res
+        with self._load_lock:
+            with self._lock:
+                if self._fresh():
+                    self.hits += 1
+                    return self.res
+                self.misses += 1
+                generation = self._generation
+            return self._store(self.fn(), generation)
+
+    def reset(self):
+        with self._lock:
+            self._generation += 1
+            self.called = False
+            self.res = None
+            self.expires = None
+
+    def _fresh(self):
         if not self.called:
-            self.res = self.fn()
-            self.called = True
-        return self.res
+            return False
+        if self.expires is None:
+            return True
+        now = self.timer()
+        if now >= self.expires:
+            return False
+        if self.refresh_ahead is not None and now >= self.expires - self.refresh_ahead and not self._refreshing:
+            self._refreshing = True
+            if self._async:
+                if self._future is None:
+                    self._start_async_load()
+            else:
+                thread = threading.Thread(target=self._refresh, args=(self._generation,))
+                thread.daemon = True
+                thread.start()
+        return True
+
+    def _store(self, res, generation):
+        with self._lock:
+            if generation == self._generation:
+                self.res = res
+                self.called = True
+                self.expires = None if self.ttl is None else self.timer() + self.ttl
+        return res
+
+    def _refresh(self, generation):
+        try:
+            with self._load_lock:
+                self._store(self.fn(), generation)
+        except Exception:
+            pass  # the current result expires as usual, and the next call loads it again
+        finally:
+            self._refreshing = False
+
+    async def _async_call(self):
+        with self._lock:
+            if self._fresh():
+                self.hits += 1
+                return self.res
+            if self._future is None:
+                self.misses += 1
+                self._start_async_load()
+            else:
+                self.hits += 1
+            future = self._future
+        return await asyncio.shield(future)
+
+    def _start_async_load(self):
+        self._future = asyncio.ensure_future(self._async_load(self._generation))
+        # a failed background refresh may have nobody waiting for it
+        self._future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    async def _async_load(self, generation):
+        try:
+            return self._store(await self.fn(), generation)
+        finally:
+            self._future = None
+            self._refreshing = False
+
+
+try:
+    import contextvars
+except ImportError:  # python < 3.7
+    contextvars = None
+
+try:
+    _perf_counter_ns = time.perf_counter_ns
+except AttributeError:  # python < 3.7
+    def _perf_counter_ns():
+        return int(time.perf_counter() * 1e9)
+
+_EPOCH_OFFSET_NS = int(time.time() * 1e9) - _perf_counter_ns()
 
 
 class timeit:
-    def __init__(self, title='', output_fn=print):
+    """
+    times a block as a context manager (also async), or each call of a function as a decorator.
+    Start and done are printed with output_fn, which can be None to keep quiet in hot loops,
+    and the timing is recorded into the profiler, if any, nested under the enclosing timeit of the same profiler.
+    """
+
+    def __init__(self, title='', output_fn=print, profiler=None):
         self.title = title
         self.output_fn = output_fn
+        self.profiler = profiler
+        self.start_ns = self.end_ns = None
+        self.interval = None
+        self._token = None
+
+    @property
+    def time_start(self):
+        return (self.start_ns + _EPOCH_OFFSET_NS) / 1e9
+
+    @property
+    def time_end(self):
+        return (self.end_ns + _EPOCH_OFFSET_NS) / 1e9
 
     def __enter__(self):
         if callable(self.output_fn):
             self.output_fn('Start {}.'.format(self.title))
-        self.time_start = time.time()
+        if self.profiler is not None:
+            self._token = self.profiler._enter(self.title)
+        self.start_ns = _perf_counter_ns()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.time_end = time.time()
-        self.interval = self.time_end - self.time_start
+        self.end_ns = _perf_counter_ns()
+        elapsed = self.end_ns - self.start_ns
+        self.interval = elapsed / 1e9
+        if self.profiler is not None:
+            self.profiler._exit(self._token, elapsed)
         if callable(self.output_fn):
             self.output_fn('Done {}. Took {} seconds.'.format(self.title, self.interval))
 
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.__exit__(exc_type, exc_val, exc_tb)
+
+    def __call__(self, fn):
+        title = self.title or fn.__qualname__
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def timed(*args, **kwargs):
+                async with timeit(title, self.output_fn, self.profiler):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def timed(*args, **kwargs):
+                with timeit(title, self.output_fn, self.profiler):
+                    return fn(*args, **kwargs)
+        return timed
+
+
+class Profiler:
+    """
+    Collects the timings of timeit blocks into a tree of spans by their nesting, which is tracked per thread
+    and per asyncio task. The durations of each span are kept in a log-linear histogram, so that recording
+    takes constant time and memory.
+    """
+
+    class Histogram:
+        SUB_BUCKET_BITS = 4  # relative error within 1/16
+
+        def __init__(self):
+            super().__init__()
+            self.count = 0
+            self.total = 0
+            self.max = 0
+            self.buckets = {}
+
+        def add(self, value):
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+            shift = max(value.bit_length() - self.SUB_BUCKET_BITS - 1, 0)
+            key = shift << (self.SUB_BUCKET_BITS + 1) | value >> shift
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+
+        def merge(self, other):
+            self.count += other.count
+            self.total += other.total
+            self.max = max(self.max, other.max)
+            for key, count in other.buckets.items():
+                self.buckets[key] = self.buckets.get(key, 0) + count
+
+        def percentile(self, q):
+            if not self.count:
+                return None
+            if q >= 100:
+                return self.max
+            rank = q / 100 * self.count
+            seen = 0
+            for key in sorted(self.buckets):
+                seen += self.buckets[key]
+                if seen >= rank:
+                    shift = key >> (self.SUB_BUCKET_BITS + 1)
+                    value = key & ((1 << (self.SUB_BUCKET_BITS + 1)) - 1)
+                    return min(((value << shift) + ((value + 1) << shift) - 1) // 2, self.max)
+            return self.max
+
+        def to_dict(self):
+            p50, p99 = (self.percentile(50) / 1e9, self.percentile(99) / 1e9) if self.count else (None, None)
+            return {'count': self.count, 'total': self.total / 1e9, 'p50': p50, 'p99': p99, 'max': self.max / 1e9}
+
+    class Span:
+        def __init__(self, title, parent=None):
+            super().__init__()
+            self.title = title
+            self.parent = parent
+            self.children = collections.OrderedDict()
+            self.histogram = Profiler.Histogram()
+
+        def child(self, title):
+            span = self.children.get(title)
+            if span is None:
+                span = self.children.setdefault(title, Profiler.Span(title, self))
+            return span
+
+        def to_dict(self):
+            d = {'title': self.title}
+            d.update(self.histogram.to_dict())
+            d['children'] = [c.to_dict() for c in self.children.values()]
+            return d
+
+    def __init__(self):
+        super().__init__()
+        self.root = self.Span(None)
+        self._lock = threading.Lock()
+        if contextvars is not None:
+            self._current = contextvars.ContextVar('qutils.functions.Profiler', default=None)
+        else:
+            self._local = threading.local()
+
+    def span(self, title=''):
+        """
+        :return: a quiet timeit recording into this profiler, to be used as a context manager or a decorator
+        """
+        return timeit(title, output_fn=None, profiler=self)
+
+    def reset(self):
+        with self._lock:
+            self.root = self.Span(None)
+
+    def stats(self):
+        """
+        :return: {title: {'count', 'total', 'p50', 'p99', 'max'}} in seconds, aggregated over the spans of each title
+        """
+        histograms = collections.OrderedDict()
+        for _, span in self._walk():
+            histograms.setdefault(span.title, self.Histogram()).merge(span.histogram)
+        return collections.OrderedDict((title, h.to_dict()) for title, h in histograms.items())
+
+    def to_dict(self):
+        return [c.to_dict() for c in self.root.children.values()]
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_folded(self):
+        """
+        :return: one "title;nested title;... microseconds" line per span with its self time, which is the input format
+                 of flamegraph.pl and speedscope
+        """
+        lines = []
+        for path, span in self._walk():
+            self_time = span.histogram.total - sum(c.histogram.total for c in span.children.values())
+            lines.append('{} {}'.format(';'.join(path), max(self_time, 0) // 1000))
+        return '\n'.join(lines)
+
+    def _walk(self):
+        stack = [((c.title,), c) for c in reversed(list(self.root.children.values()))]
+        while stack:
+            path, span = stack.pop()
+            yield path, span
+            stack.extend((path + (c.title,), c) for c in reversed(list(span.children.values())))
+
+    def _enter(self, title):
+        if contextvars is not None:
+            parent = self._current.get()
+            if parent is None or parent[0] is not self.root:
+                parent = (self.root, self.root)
+            return self._current.set((parent[0], parent[1].child(title)))
+        parent = getattr(self._local, 'current', None)
+        if parent is None or parent[0] is not self.root:
+            parent = (self.root, self.root)
+        self._local.current = (parent[0], parent[1].child(title))
+        return parent
+
+    def _exit(self, token, elapsed):
+        if contextvars is not None:
+            span = self._current.get()[1]
+            self._current.reset(token)
+        else:
+            span = self._local.current[1]
+            self._local.current = token
+        with self._lock:
+            span.histogram.add(elapsed)
+
 
 def pretty_str_mongo_collection(collection):
     database = collection.database
@@ -52,43 +364,132 @@ def is_list(obj):
 
 def update(current, to_update,
            deep=False, update_list=False, extend_list=False, ignore_exist=False, ignore_none=False):
-    def update_mapping(current, to_update):
-        current = copy(current)
-        for k, v in to_update.items():
-            if k in current:
-                current[k] = update_one(current[k], v, deep)
-            else:
-                if ignore_none and v is None:
-                    pass
-                else:
-                    current[k] = v
-        return current
-
-    def update_one(cur, up, deep_this):
-        if deep_this and isinstance(cur, collections.Mapping) and isinstance(up, collections.Mapping):
-            return update_mapping(cur, up)
-        elif update_list and is_list(cur) and is_list(up):
-            len_cur, len_up = len(cur), len(up)
-            uped = [c if ignore_none and u is None else update_one(c, u, deep)
-                    for c, u in zip(cur, up)]
-            if len_cur < len_up:
-                rest = up[(len_cur - len_up):]
-            elif len_cur > len_up:
-                rest = cur[(len_up - len_cur):]
+    return update_many(current, (to_update,), deep=deep, update_list=update_list, extend_list=extend_list,
+                       ignore_exist=ignore_exist, ignore_none=ignore_none)
+
+
+class _Delete:
+    def __repr__(self):
+        return 'DELETE'
+
+    def __reduce__(self):
+        return 'DELETE'
+
+
+DELETE = _Delete()  # as a value in to_update, removes the key from current
+
+
+def update_many(current, updates,
+                deep=False, update_list=False, extend_list=False, ignore_exist=False, ignore_none=False):
+    """
+    the same as applying update() with each of the updates in order, but in one pass: the containers that are
+    copied for an earlier update are modified in place by the later ones instead of being copied again.
+    Neither current nor the updates are modified. The result is a new container even if nothing changes,
+    but below the top level it shares all the unmodified parts with them, so do not modify these in place.
+    """
+    merger = _Merger(deep, update_list, extend_list, ignore_exist, ignore_none)
+    result = current
+    for to_update in updates:
+        result = merger.merge(result, to_update)
+    if result is current and (_is_mapping(result) or _is_list(result)):
+        result = list(result) if _is_list(result) else copy(result)
+    return result
+
+
+def _is_mapping(obj):
+    return type(obj) is dict or isinstance(obj, collections.Mapping)
+
+
+def _is_list(obj):
+    return type(obj) is list or type(obj) is not dict and is_list(obj)
+
+
+class _MergeFrame:
+    __slots__ = ('container', 'parent', 'key')
+
+    def __init__(self, container, parent, key):
+        self.container = container
+        self.parent = parent
+        self.key = key
+
+
+class _Merger:
+    """
+    Merges iteratively with copy-on-write: a container is only copied when something in it changes,
+    together with its ancestors, and at most once for all the merges done by the same merger.
+    """
+
+    def __init__(self, deep, update_list, extend_list, ignore_exist, ignore_none):
+        super().__init__()
+        self.deep = deep
+        self.update_list = update_list
+        self.extend_list = extend_list
+        self.ignore_exist = ignore_exist
+        self.ignore_none = ignore_none
+        self.owned = {}  # id -> the containers created by this merger, which can be modified in place
+
+    def merge(self, current, to_update):
+        root = _MergeFrame([current], None, None)
+        self.owned[id(root.container)] = root.container
+        stack = []
+        self._merge_item(root, 0, to_update, True, stack)
+        while stack:
+            frame, up = stack.pop()
+            if _is_mapping(up):
+                for key, value in up.items():
+                    if value is DELETE:
+                        if key in frame.container:
+                            self._own(frame)
+                            del frame.container[key]
+                    elif key in frame.container:
+                        self._merge_item(frame, key, value, self.deep, stack)
+                    elif not (self.ignore_none and value is None):
+                        self._set(frame, key, value)
             else:
-                rest = []
-            uped.extend(rest)
-            return uped
-        elif extend_list and is_list(cur) and is_list(up):
-            cur = list(cur)
-            cur.extend(up)
-            return cur
-        elif ignore_exist or ignore_none and up is None:
-            return cur
-        else:
-            return up
+                len_cur, len_up = len(frame.container), len(up)
+                for i in range(min(len_cur, len_up)):
+                    value = up[i]
+                    if not (self.ignore_none and value is None):
+                        self._merge_item(frame, i, value, self.deep, stack)
+                if len_up > len_cur:
+                    self._own(frame)
+                    frame.container.extend(up[len_cur:])
+        del self.owned[id(root.container)]
+        return root.container[0]
+
+    def _merge_item(self, frame, key, up, deep_this, stack):
+        cur = frame.container[key]
+        if deep_this and _is_mapping(cur) and _is_mapping(up):
+            stack.append((_MergeFrame(cur, frame, key), up))
+        elif (self.update_list or self.extend_list) and _is_list(cur) and _is_list(up):
+            if self.update_list:
+                child = _MergeFrame(cur, frame, key)
+                if not isinstance(cur, collections.Sequence):
+                    self._own(child)  # make it indexable
+                stack.append((child, up if isinstance(up, collections.Sequence) else list(up)))
+            elif len(up) > 0:
+                child = _MergeFrame(cur, frame, key)
+                self._own(child)
+                child.container.extend(up)
+        elif self.ignore_exist or self.ignore_none and up is None:
+            pass
+        elif cur is not up:
+            self._set(frame, key, up)
+
+    def _set(self, frame, key, value):
+        self._own(frame)
+        frame.container[key] = value
 
-    return update_one(current, to_update, True)
+    def _own(self, frame):
+        chain = []
+        while id(frame.container) not in self.owned:
+            chain.append(frame)
+            frame = frame.parent
+        for frame in reversed(chain):
+            container = list(frame.container) if _is_list(frame.container) else copy(frame.container)
+            self.owned[id(container)] = container
+            frame.container = container
+            frame.parent.container[frame.key] = container
 
 
 def deep_equal_naive(lhs, rhs):
@@ -109,30 +510,243 @@ def deep_equal_naive(lhs, rhs):
     return lhs == rhs
 
 
-def freeze(obj, unordered_list=False):
-    @functools.cmp_to_key
-    def cmp_with_types(lhs, rhs):
-        try:
-            return (lhs > rhs) - (lhs < rhs)
-        except TypeError:
-            lhs = type(lhs).__name__
-            rhs = type(rhs).__name__
-            return (lhs > rhs) - (lhs < rhs)
+def _cmp_with_types(lhs, rhs):
+    try:
+        return (lhs > rhs) - (lhs < rhs)
+    except TypeError:
+        lhs = type(lhs).__name__
+        rhs = type(rhs).__name__
+        return (lhs > rhs) - (lhs < rhs)
+
 
+def _sorted_with_types(items):
+    items = list(items)
+    try:
+        items.sort()
+    except TypeError:
+        items.sort(key=functools.cmp_to_key(_cmp_with_types))
+    return tuple(items)
+
+
+def freeze(obj, unordered_list=False):
     if isinstance(obj, dict):
-        return tuple(sorted(((freeze(k, unordered_list), freeze(v, unordered_list))
-                            for k, v in obj.items()), key=cmp_with_types))
+        return _sorted_with_types((freeze(k, unordered_list), freeze(v, unordered_list)) for k, v in obj.items())
     elif isinstance(obj, list):
         if unordered_list:
-            return tuple(sorted((freeze(i, unordered_list) for i in obj), key=cmp_with_types))
+            return _sorted_with_types(freeze(i, unordered_list) for i in obj)
         else:
             return tuple(freeze(i, unordered_list) for i in obj)
     else:
         return obj
 
 
-def deep_equal(lhs, rhs, unordered_list=False):
-    return freeze(lhs, unordered_list) == freeze(rhs, unordered_list)
+def deep_equal(lhs, rhs, unordered_list=False, hash_cache=None):
+    """
+    compares dicts and lists structurally like comparing their freeze(), and stops at the first difference.
+    Tuples are compared by == as freeze() keeps them, which equal a list only as the tuple of its frozen items.
+    :param hash_cache: see deep_hash(), only used to match the items of unordered lists
+    """
+    stack = [(lhs, rhs)]
+    while stack:
+        lhs, rhs = stack.pop()
+        if lhs is rhs:
+            continue
+        if isinstance(lhs, dict):
+            if not isinstance(rhs, dict) or len(lhs) != len(rhs):
+                return False
+            for key, value in lhs.items():
+                if key not in rhs:
+                    return False
+                stack.append((value, rhs[key]))
+        elif isinstance(lhs, list) and isinstance(rhs, list):
+            if len(lhs) != len(rhs):
+                return False
+            if not unordered_list:
+                stack.extend(zip(lhs, rhs))
+            elif not _unordered_equal(lhs, rhs, hash_cache):
+                return False
+        elif isinstance(lhs, list) or isinstance(rhs, list):
+            if not isinstance(lhs, tuple) and not isinstance(rhs, tuple) or \
+                    freeze(lhs, unordered_list) != freeze(rhs, unordered_list):
+                return False
+        elif isinstance(rhs, dict) or lhs != rhs:
+            return False
+    return True
+
+
+def _unordered_equal(lhs, rhs, hash_cache):
+    buckets = {}
+    for item in lhs:
+        buckets.setdefault(deep_hash(item, True, hash_cache, stable=False), []).append(item)
+    for item in rhs:
+        bucket = buckets.get(deep_hash(item, True, hash_cache, stable=False))
+        if not bucket:
+            return False
+        for i, candidate in enumerate(bucket):
+            if deep_equal(candidate, item, True, hash_cache):
+                del bucket[i]
+                break
+        else:
+            return False
+    return True
+
+
+def deep_hash(obj, unordered_list=False, cache=None, stable=True):
+    """
+    structural hash of dicts, lists and tuples, so that deep_equal() objects always have the same hash.
+    :param cache: a dict to remember the hashes of the visited dicts and lists by id(), which can be reused by the
+                  following calls as long as none of these objects are modified
+    :param stable: if True, the hash is a 64-bit digest of a canonical encoding, which is the same across processes
+                   and Python versions for the JSON values, bytes and sets of them, while the other objects are
+                   encoded by hash(); if False, it is built on hash() only, faster but only stable within the process
+    """
+    if stable:
+        return int.from_bytes(_stable_digest(obj, unordered_list, cache), 'big', signed=True)
+    if not isinstance(obj, (dict, list, tuple)):
+        return hash(frozenset(obj)) if isinstance(obj, (set, frozenset)) else hash(obj)
+    key = (id(obj), unordered_list, False)
+    if cache is not None and key in cache:
+        return cache[key][1]
+    if isinstance(obj, dict):
+        h = hash((dict, frozenset((k, deep_hash(v, unordered_list, cache, False)) for k, v in obj.items())))
+    elif unordered_list:
+        h = hash((list, tuple(sorted(deep_hash(i, unordered_list, cache, False) for i in obj))))
+    else:
+        h = hash((list, tuple(deep_hash(i, unordered_list, cache, False) for i in obj)))
+    if cache is not None:
+        cache[key] = (obj, h)  # keep the object alive so that its id is not reused
+    return h
+
+
+def _digest(tag, data):
+    return hashlib.sha1(tag + data).digest()[:8]
+
+
+def _stable_digest(obj, unordered_list, cache):
+    # by isinstance(), so that the subclasses, e.g. of enum.IntEnum, are encoded the same as the values they equal
+    if isinstance(obj, str):
+        return _digest(b's', str.encode(obj, 'utf-8', 'surrogatepass'))
+    # the numbers equal to each other, e.g. True, 1 and 1.0, are encoded the same
+    if isinstance(obj, bool):
+        return _digest(b'i', b'1' if obj else b'0')
+    if isinstance(obj, int):
+        return _digest(b'i', int.__repr__(obj).encode())
+    if isinstance(obj, float):
+        if obj.is_integer():
+            return _digest(b'i', str(int(obj)).encode())
+        return _digest(b'f', float.__repr__(obj).encode())
+    if obj is None:
+        return _digest(b'n', b'')
+    if isinstance(obj, (bytes, bytearray)):
+        return _digest(b'b', bytes(obj))
+    if isinstance(obj, (set, frozenset)):
+        return _digest(b'S', b''.join(sorted(_stable_digest(i, unordered_list, cache) for i in obj)))
+    if not isinstance(obj, (dict, list, tuple)):
+        # the other numbers equal to the Python ones, e.g. the numpy scalars
+        if isinstance(obj, numbers.Integral):
+            return _stable_digest(int(obj), unordered_list, cache)
+        if isinstance(obj, numbers.Real):
+            return _stable_digest(float(obj), unordered_list, cache)
+        return _digest(b'h', str(hash(obj)).encode())
+    key = (id(obj), unordered_list, True)
+    if cache is not None and key in cache:
+        return cache[key][1]
+    if isinstance(obj, dict):
+        h = _digest(b'D', b''.join(sorted(_stable_digest(k, unordered_list, cache) +
+                                          _stable_digest(v, unordered_list, cache) for k, v in obj.items())))
+    elif unordered_list:
+        h = _digest(b'L', b''.join(sorted(_stable_digest(i, unordered_list, cache) for i in obj)))
+    else:
+        h = _digest(b'L', b''.join(_stable_digest(i, unordered_list, cache) for i in obj))
+    if cache is not None:
+        cache[key] = (obj, h)  # keep the object alive so that its id is not reused
+    return h
+
+
+Diff = collections.namedtuple('Diff', ['op', 'path', 'old', 'new'])
+
+
+def deep_diff(lhs, rhs, unordered_list=False, hash_cache=None):
+    """
+    generates the differences from lhs to rhs as Diff(op, path, old, new), where op is one of "add", "remove"
+    and "change", and path is the tuple of keys and list indices. Identical subtrees are skipped by identity,
+    and the items of unordered lists are matched by deep_hash().
+    :param hash_cache: see deep_hash()
+    """
+    stack = [((), lhs, rhs)]
+    while stack:
+        task = stack.pop()
+        if isinstance(task, Diff):
+            yield task
+            continue
+        path, lhs, rhs = task
+        if lhs is rhs:
+            continue
+        children = []
+        if isinstance(lhs, dict) and isinstance(rhs, dict):
+            for key, value in lhs.items():
+                if key in rhs:
+                    children.append((path + (key,), value, rhs[key]))
+                else:
+                    children.append(Diff('remove', path + (key,), value, None))
+            children.extend(Diff('add', path + (key,), None, value) for key, value in rhs.items() if key not in lhs)
+        elif isinstance(lhs, (list, tuple)) and isinstance(rhs, (list, tuple)):
+            if unordered_list:
+                removed, added = _unordered_diff(lhs, rhs, hash_cache)
+                children.extend(Diff('remove', path + (i,), lhs[i], None) for i in removed)
+                children.extend(Diff('add', path + (i,), None, rhs[i]) for i in added)
+            else:
+                children.extend((path + (i,), l, r) for i, (l, r) in enumerate(zip(lhs, rhs)))
+                children.extend(Diff('remove', path + (i,), lhs[i], None) for i in range(len(rhs), len(lhs)))
+                children.extend(Diff('add', path + (i,), None, rhs[i]) for i in range(len(lhs), len(rhs)))
+        elif isinstance(lhs, (dict, list, tuple)) or isinstance(rhs, (dict, list, tuple)) or lhs != rhs:
+            children.append(Diff('change', path, lhs, rhs))
+        stack.extend(reversed(children))
+
+
+def _unordered_diff(lhs, rhs, hash_cache):
+    buckets = {}
+    for i, item in enumerate(lhs):
+        buckets.setdefault(deep_hash(item, True, hash_cache, stable=False), []).append(i)
+    added = []
+    for j, item in enumerate(rhs):
+        bucket = buckets.get(deep_hash(item, True, hash_cache, stable=False))
+        for k, i in enumerate(bucket or ()):
+            if deep_equal(lhs[i], item, True, hash_cache):
+                del bucket[k]
+                break
+        else:
+            added.append(j)
+    return sorted(i for bucket in buckets.values() for i in bucket), added
+
+
+def diff_to_patch(diffs, rhs):
+    """
+    builds from the deep_diff() results the patch that update(lhs, patch, deep=True) turns lhs into rhs with.
+    Dicts are patched key by key, while a changed list is replaced as a whole by the one in rhs.
+    """
+    if not isinstance(rhs, dict):
+        return rhs
+    patch = {}
+    for diff in diffs:
+        if not diff.path:
+            return rhs
+        node, parent = rhs, patch
+        for depth, key in enumerate(diff.path):
+            if key not in node:
+                parent[key] = DELETE
+                break
+            value = node[key]
+            if depth + 1 == len(diff.path) or not isinstance(value, dict):
+                parent[key] = value
+                break
+            child = parent.get(key)
+            if child is None:
+                child = parent[key] = {}
+            elif child is value:
+                break  # already replaced as a whole
+            node, parent = value, child
+    return patch
 
 
 def all_equal(seq):
@@ -1,3 +1,6 @@
+import codecs
+import json
+import re
 from abc import abstractmethod
 from json import JSONEncoder, JSONDecoder
 
@@ -13,6 +16,35 @@ class RegisterJSONableTypeMeta(type):
                 raise TypeError('type key "{}" conflicts between class "{}" and "{}"'
                                 .format(type_key, cls.__name__, cls.all_types[type_key].__name__))
             cls.all_types[type_key] = cls
+        cls._json_encoder = staticmethod(_compile_json_encoder(cls))
+
+
+def _compile_json_encoder(cls):
+    """
+    build the function converting an object of cls to a JSON serializable object with "_type" added,
+    without modifying what encode() returns, which may be e.g. the __dict__ of the object itself.
+    Unless it has "_type" already, the result is a shallow copy with "_type" added, which costs one dict per object:
+    the json encoders turn every dict into a list of its items anyway, and both a dict subclass chaining "_type"
+    before the items and writing '{"_type": ..., ' before the encoded text were measured slower than the copy
+    """
+    type_key = cls.type
+    if cls.encode is _encode_dict:
+        def encoder(obj):
+            encoded = obj.__dict__
+            return encoded if '_type' in encoded else {**encoded, '_type': type_key}
+    else:
+        def encoder(obj):
+            encoded = obj.encode()
+            if not isinstance(encoded, dict):
+                raise TypeError('{}.encode() returned {} instead of a dict'
+                                .format(type(obj).__name__, type(encoded).__name__))
+            return encoded if '_type' in encoded else {**encoded, '_type': type_key}
+    return encoder
+
+
+def _encode_dict(self):
+    """return a serializable object of self"""
+    return self.__dict__
 
 
 class SkyNetJSONable(object, metaclass=RegisterJSONableTypeMeta):
@@ -21,10 +53,8 @@ class SkyNetJSONable(object, metaclass=RegisterJSONableTypeMeta):
     # distinguish the JSON object of this class from the other plain JSON objects
     type = None
 
-    @abstractmethod
-    def encode(self):
-        """return a serializable object of self"""
-        return self.__dict__
+    # the default is recognized by _compile_json_encoder(), which reads the __dict__ directly
+    encode = abstractmethod(_encode_dict)
 
     @classmethod
     @abstractmethod
@@ -35,25 +65,224 @@ class SkyNetJSONable(object, metaclass=RegisterJSONableTypeMeta):
 
 class SkyNetJSONEncoder(JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, SkyNetJSONable):
-            encoded = obj.encode()
-            if '_type' not in encoded:
-                encoded['_type'] = obj.type
-            return encoded
+        # the types are checked by the class attribute rather than isinstance()
+        encoder = getattr(type(obj), '_json_encoder', None)
+        if encoder is not None:
+            return encoder(obj)
         return super().default(obj)
 
 
 class SkyNetJSONDecoder(JSONDecoder):
     def __init__(self, object_hook=None, parse_float=None, parse_int=None, parse_constant=None, strict=True,
                  object_pairs_hook=None):
-        super().__init__(object_hook or self.object_hook, parse_float, parse_int, parse_constant, strict, object_pairs_hook)
+        super().__init__(object_hook=object_hook or self._object_hook, parse_float=parse_float, parse_int=parse_int,
+                         parse_constant=parse_constant, strict=strict, object_pairs_hook=object_pairs_hook)
 
     @staticmethod
-    def object_hook(obj: dict):
+    def object_hook(obj: dict, _get_type=SkyNetJSONable.all_types.get):
+        """convert a json dict with a registered "_type" to the object, which leaves the dict untouched"""
         if '_type' in obj:
-            cls = SkyNetJSONable.all_types.get(obj['_type'])
+            cls = _get_type(obj['_type'])
             if cls is not None:
-                encoded = obj.copy()
-                encoded.pop('_type', None)
-                return cls.decode(encoded)
+                return cls.decode({k: v for k, v in obj.items() if k != '_type'})
         return obj
+
+    @staticmethod
+    def _object_hook(obj: dict, _get_type=SkyNetJSONable.all_types.get):
+        # the hook used by the decoder itself, which has just created the dict and references it nowhere else,
+        # so "_type" is removed in place without copying
+        if '_type' in obj:
+            cls = _get_type(obj['_type'])
+            if cls is not None:
+                del obj['_type']
+                return cls.decode(obj)
+        return obj
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iterload(fp, cls=SkyNetJSONDecoder, chunk_size=65536, **kwargs):
+    """
+    decode the elements of a top-level JSON array one by one from a text / binary file-like object,
+    without reading the whole file or building the whole list.
+    :param cls: the JSONDecoder class, created with kwargs
+    :param chunk_size: the number of bytes / characters read at a time, at least
+    """
+    decoder = cls(**kwargs)
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf, pos, eof = '', 0, False
+
+    def read(size):
+        """:return: the text read, and whether it is the end of the file"""
+        chunk = fp.read(size)
+        # the text may be empty before the end, when the bytes read end in the middle of a character
+        if isinstance(chunk, bytes):
+            return utf8.decode(chunk, final=not chunk), not chunk
+        return chunk, not chunk
+
+    def skip_whitespace():
+        nonlocal buf, pos, eof
+        while True:
+            match = _WHITESPACE.match(buf, pos)
+            pos = match.end()
+            if pos < len(buf) or eof:
+                return
+            pos = 0
+            buf, eof = read(chunk_size)
+
+    def expect(chars):
+        nonlocal pos
+        skip_whitespace()
+        if pos >= len(buf) or buf[pos] not in chars:
+            raise json.JSONDecodeError('Expecting {}'.format(' or '.join(repr(c) for c in chars)), buf, pos)
+        pos += 1
+        return buf[pos - 1]
+
+    expect('[')
+    skip_whitespace()
+    if buf[pos:pos + 1] == ']':
+        return
+    while True:
+        skip_whitespace()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # something may follow at the end of buffer, e.g. more digits of a number, so a separator is needed
+                if end < len(buf) or eof:
+                    break
+            chunk, eof = read(max(chunk_size, len(buf) - pos))
+            buf, pos = buf[pos:] + chunk, 0
+        pos = end
+        yield obj
+        if expect(',]') == ']':
+            return
+
+
+def iterdump(objs, fp, cls=SkyNetJSONEncoder, **kwargs):
+    """
+    encode the objects from an iterable one by one into a top-level JSON array written to a text / binary file-like
+    object, without building the whole list or the whole text, the counterpart of iterload()
+    :param cls: the JSONEncoder class, created with kwargs
+    :return: the number of objects written
+    """
+    encoder = cls(**kwargs)
+    write = fp.write
+    try:
+        write('[')
+    except TypeError:
+        def write(s):
+            fp.write(s.encode())
+        write('[')
+    count = 0
+    for obj in objs:
+        if count:
+            write(encoder.item_separator)
+        # iterencode() of an object would fall back to the pure Python encoder, one object at a time is enough
+        write(encoder.encode(obj))
+        count += 1
+    write(']')
+    return count
+
+
+class JSONBackend:
+    """the minimal interface of a JSON library used for encoding / decoding plain JSON objects"""
+
+    name = None
+    # whether datetime objects are encoded natively (into ISO 8601 strings)
+    native_datetime = False
+
+    def loads(self, s):
+        raise NotImplementedError
+
+    def dumps(self, obj) -> str:
+        raise NotImplementedError
+
+    def dumpb(self, obj) -> bytes:
+        return self.dumps(obj).encode()
+
+
+class StdJSONBackend(JSONBackend):
+    name = 'json'
+
+    def loads(self, s):
+        return json.loads(s)
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+
+class OrJSONBackend(JSONBackend):
+    name = 'orjson'
+    native_datetime = True
+
+    def __init__(self):
+        super().__init__()
+        import orjson
+        self.orjson = orjson
+
+    def loads(self, s):
+        return self.orjson.loads(s)
+
+    def dumps(self, obj):
+        return self.dumpb(obj).decode()
+
+    def dumpb(self, obj):
+        return self.orjson.dumps(obj, default=_datetime_like_to_datetime)
+
+
+class UJSONBackend(JSONBackend):
+    name = 'ujson'
+
+    def __init__(self):
+        super().__init__()
+        import ujson
+        self.ujson = ujson
+
+    def loads(self, s):
+        return self.ujson.loads(s)
+
+    def dumps(self, obj):
+        return self.ujson.dumps(obj)
+
+
+# in the order of preference when choosing the backend automatically
+JSON_BACKENDS = (OrJSONBackend, UJSONBackend, StdJSONBackend)
+_json_backends = {}
+
+
+def get_json_backend(name='auto') -> JSONBackend:
+    """
+    :param name: the name of a backend in JSON_BACKENDS, or "auto" for the fastest one installed,
+        or a JSONBackend object which is returned as is
+    """
+    if isinstance(name, JSONBackend):
+        return name
+    backend = _json_backends.get(name)
+    if backend is None:
+        if name == 'auto':
+            for backend_cls in JSON_BACKENDS:
+                try:
+                    backend = backend_cls()
+                    break
+                except ImportError:
+                    pass
+        else:
+            backend_cls = next((c for c in JSON_BACKENDS if c.name == name), None)
+            if backend_cls is None:
+                raise ValueError('unrecognized JSON backend: {!r}'.format(name))
+            backend = backend_cls()
+        _json_backends[name] = backend
+    return backend
+
+
+def _datetime_like_to_datetime(obj):
+    # e.g. pandas.Timestamp, which is not encoded natively by orjson
+    to_pydatetime = getattr(obj, 'to_pydatetime', None)
+    if to_pydatetime is None:
+        raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+    return to_pydatetime()
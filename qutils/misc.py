@@ -1,26 +1,242 @@
+import errno
+import os
+import re
 import socket
-from multiprocessing.dummy import Process, Pipe
+import sys
+import time
 
 import yaml
 
+try:
+    import fcntl
+except ImportError:  # e.g. on Windows
+    fcntl = None
 
-def is_single_instance(port):
-    this, that = Pipe()
 
-    def try_binding_port(that):
+class ProcessLock:
+    """
+    A named lock across the processes of a host, released by the OS when the holding process exits,
+    so a lock left by a crashed process is never stale. The methods are
+    SOCKET: binding the abstract Unix socket "qutils-lock-<name>", which exists on Linux only and leaves no file,
+    whose holder is found in /proc, among the processes of the same user unless privileged.
+    Like a TCP port, it is shared by all the processes and users of the host (of the same network namespace);
+    FCNTL: flock() on the file "<lock_dir>/<name>.lock", which records the pid of the holder.
+    It is shared by the processes seeing the same lock_dir only, e.g. not across the private /tmp of systemd,
+    and a file created by another user may not be writable, which is taken as being held while it is locked,
+    but raises PermissionError once it is not.
+    The lock is held by the ProcessLock object, i.e. the other objects of the same name conflict with it
+    even in the same process, and it is not reentrant.
+    """
+
+    FCNTL = 'fcntl'
+    SOCKET = 'socket'
+    # fixed rather than tempfile.gettempdir(), which varies by TMPDIR
+    LOCK_DIR = '/tmp'
+
+    def __init__(self, name, method=None, lock_dir=None, timeout=None):
+        """
+        :param name: letters, digits, "_", "-" and "."
+        :param method: SOCKET (by default on Linux) or FCNTL (by default elsewhere)
+        :param lock_dir: the directory of the lock files of FCNTL, by default LOCK_DIR
+        :param timeout: the timeout of acquiring the lock by "with", which raises TimeoutError
+        """
+        super().__init__()
+        self._fd = self._socket = None
+        if not re.match(r'^[\w.-]+$', name):
+            raise ValueError('Invalid lock name "{}"'.format(name))
+        if method is None:
+            method = self.SOCKET if sys.platform.startswith('linux') else self.FCNTL
+        if method == self.FCNTL:
+            if fcntl is None:
+                raise ValueError('fcntl is not available on this platform')
+        elif method == self.SOCKET:
+            if not sys.platform.startswith('linux'):
+                raise ValueError('Abstract Unix sockets are only available on Linux')
+        else:
+            raise ValueError('Unrecognized lock method "{}"'.format(method))
+        self.name = name
+        self.method = method
+        self.path = os.path.join(lock_dir or self.LOCK_DIR, name + '.lock')
+        self.address = '\0qutils-lock-' + name
+        self.timeout = timeout
+
+    @property
+    def locked(self):
+        """whether this object is holding the lock"""
+        return self._fd is not None or self._socket is not None
+
+    def acquire(self, blocking=True, timeout=None) -> bool:
+        """
+        :param timeout: the seconds to wait for the lock at most, None for waiting forever
+        :return: whether the lock is acquired
+        :raise PermissionError: if the lock file of FCNTL is not held but not writable by this user either
+        """
+        if self.locked:
+            raise RuntimeError('Lock "{}" is already acquired by this object'.format(self.name))
+        try_acquire = self._try_flock if self.method == self.FCNTL else self._try_bind
+        if not blocking:
+            return try_acquire(False)
+        if timeout is None and self.method == self.FCNTL:
+            return try_acquire(True)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.001
+        while not try_acquire(False):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            time.sleep(delay if remaining is None else min(delay, remaining))
+            delay = min(delay * 2, 0.1)
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            # the file is kept, since another process may have opened it and be waiting for its lock
+            fd, self._fd = self._fd, None
+            try:
+                os.ftruncate(fd, 0)
+            finally:
+                os.close(fd)
+        elif self._socket is not None:
+            sock, self._socket = self._socket, None
+            sock.close()
+        else:
+            raise RuntimeError('Lock "{}" is not acquired'.format(self.name))
+
+    def holder(self):
+        """:return: the pid of the process holding the lock, or None if it is not held or the pid is unknown"""
+        if self.locked:
+            return os.getpid()
+        if self.method == self.FCNTL:
+            return self._flock_holder()
+        return self._socket_holder()
+
+    def __enter__(self):
+        if not self.acquire(timeout=self.timeout):
+            raise TimeoutError('Timed out waiting for lock "{}"'.format(self.name))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def __del__(self):
+        if self.locked:
+            self.release()
+
+    def _try_flock(self, blocking):
+        try:
+            # without O_CREAT first, which fs.protected_regular denies for a file of another user in /tmp
+            fd = os.open(self.path, os.O_RDWR)
+        except FileNotFoundError:
+            fd = None
+        except OSError as e:
+            if e.errno not in (errno.EACCES, errno.EPERM):
+                raise
+            return self._check_unwritable(blocking)
+        if fd is None:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            except OSError as e:
+                if e.errno not in (errno.EACCES, errno.EPERM):
+                    raise
+                return self._check_unwritable(blocking)
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.bind(('', port))
-            s.listen(1)
-            that.send(True)
-            s.accept()
-        except socket.error:
-            that.send(False)
-
-    process = Process(target=try_binding_port, args=(that,))
-    process.daemon = True
-    process.start()
-    return this.recv()
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.ftruncate(fd, 0)
+            os.write(fd, '{}\n'.format(os.getpid()).encode())
+        except OSError as e:
+            os.close(fd)
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        self._fd = fd
+        return True
+
+    def _check_unwritable(self, blocking):
+        """
+        for the lock file not writable by this user, e.g. created by another user with a umask not sharing it:
+        :return: False if it is held, otherwise raise PermissionError, since the lock may never be taken over
+        """
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH if blocking else fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return False
+                raise
+        finally:
+            os.close(fd)
+        raise PermissionError('Lock file "{}" is not writable by this user, remove it or use another lock_dir'
+                              .format(self.path))
+
+    def _flock_holder(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            else:
+                # not held, though the file may still have the pid of a holder exited without releasing
+                return None
+            content = os.read(fd, 32).strip()
+            return int(content) if content.isdigit() else None
+        finally:
+            os.close(fd)
+
+    def _try_bind(self, blocking):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self.address)
+        except OSError as e:
+            sock.close()
+            if e.errno == errno.EADDRINUSE:
+                return False
+            raise
+        self._socket = sock
+        return True
+
+    def _socket_holder(self):
+        # the inode of the socket bound to the address, then the process having it open
+        path = '@' + self.address[1:]
+        with open('/proc/net/unix') as f:
+            inode = next((fields[6] for fields in (line.split() for line in f)
+                          if len(fields) == 8 and fields[7] == path), None)
+        if inode is None:
+            return None
+        target = 'socket:[{}]'.format(inode)
+        for pid in filter(str.isdigit, os.listdir('/proc')):
+            fd_dir = '/proc/{}/fd'.format(pid)
+            try:
+                if any(os.readlink(os.path.join(fd_dir, fd)) == target for fd in os.listdir(fd_dir)):
+                    return int(pid)
+            except OSError:  # exited, or not permitted
+                pass
+        return None
+
+
+# the locks held for the lifetime of the process
+_instance_locks = {}
+
+
+def is_single_instance(name, method=None, lock_dir=None):
+    """
+    :param name: the name of the ProcessLock held by the only instance, e.g. the port number previously bound
+    :return: whether the lock is acquired, which is then kept until the process exits,
+        so the following calls of the same name return False, even in the same process, as binding the port did
+    """
+    name = str(name)
+    if name in _instance_locks:
+        return False
+    lock = ProcessLock(name, method, lock_dir)
+    if not lock.acquire(blocking=False):
+        return False
+    _instance_locks[name] = lock
+    return True
 
 
 class NumberSequence:
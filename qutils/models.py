@@ -1,9 +1,13 @@
+import io
 import json
+import keyword
 
 import pandas as pd
 from datetime import datetime
+from types import MemberDescriptorType
 
 from qutils.functions import is_list
+from qutils.json_ext import get_json_backend
 
 
 class O:
@@ -38,8 +42,373 @@ class O:
         return cls(**d)
 
 
-class JsonModel:
+_MISSING = object()
+
+
+def _json_decoder(converter):
+    has_valid_type = converter.has_valid_type
+    json2value = converter.json2value
+
+    def decode(value):
+        value_type = type(value)
+        if value_type is list or value_type is not dict and value_type is not str and is_list(value):
+            return [v if has_valid_type(v) else json2value(v) for v in value]
+        return value if has_valid_type(value) else json2value(value)
+
+    return decode
+
+
+def _json_encoder(converter, native_datetime=False):
+    value2json = converter.value2native if native_datetime else converter.value2json
+
+    def encode(value):
+        if type(value) is list or is_list(value):
+            return [value2json(v) for v in value]
+        return value2json(value)
+
+    return encode
+
+
+def _to_bool(value):
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    if value in (0, 1):
+        return bool(value)
+    raise ValueError('not a boolean')
+
+
+def _to_int(value):
+    if isinstance(value, str):
+        return int(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    raise ValueError('not an integer')
+
+
+def _to_float(value):
+    if isinstance(value, str):
+        return float(value)
+    if isinstance(value, int) and not isinstance(value, bool) and float(value) == value:
+        return float(value)
+    raise ValueError('not a float')
+
+
+def _to_str(value):
+    # only from the numbers, while the containers are not strings in disguise and str(True) is a Python repr
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError('not a string')
+
+
+# how a json value is coerced to the type of a field when it is not an instance of the type yet,
+# raising ValueError when it would lose data
+_COERCIONS = {int: _to_int, float: _to_float, str: _to_str, bool: _to_bool}
+
+
+def _field_checker(spec):
+    """build a function that validates and coerces the json value of a field, and collects the errors found"""
+    converter, value_type = spec.converter, spec.value_type
+
+    if isinstance(converter, JsonModel.ModelType):
+        model_cls = converter.model_cls
+
+        def check_one(value, path, errors):
+            if isinstance(value, model_cls):
+                return value
+            if not callable(getattr(value, 'items', None)):
+                errors.append((path, 'expected a {} object, got {!r}'.format(model_cls.__name__, value)))
+                return value
+            return model_cls._validate(value, path + '.', errors)
+    elif converter is not None:
+        has_valid_type, json2value = converter.has_valid_type, converter.json2value
+
+        def check_one(value, path, errors):
+            if has_valid_type(value):
+                return value
+            try:
+                return json2value(value)
+            except (ValueError, TypeError) as err:
+                errors.append((path, 'cannot convert {!r}: {}'.format(value, err)))
+                return value
+    elif value_type is not None:
+        coerce = _COERCIONS.get(value_type)
+
+        def check_one(value, path, errors):
+            if isinstance(value, value_type) and not (value_type is int and isinstance(value, bool)):
+                return value
+            if coerce is not None:
+                try:
+                    return coerce(value)
+                except (ValueError, TypeError):
+                    pass
+            errors.append((path, 'expected {}, got {!r}'.format(value_type.__name__, value)))
+            return value
+    else:
+        check_one = None
+
+    list_of = spec.list_of
+
+    def check(value, path, errors):
+        value_is_list = is_list(value)
+        if list_of is not None and value_is_list != list_of:
+            errors.append((path, 'expected {}, got {!r}'.format('a list' if list_of else 'a single value', value)))
+            return value
+        if check_one is None:
+            return value
+        if value_is_list:
+            return [check_one(v, '{}[{}]'.format(path, i), errors) for i, v in enumerate(value)]
+        return check_one(value, path, errors)
+
+    return check
+
+
+class OView:
+    """
+    A memory-compact, read-optimized alternative to O.from_dict: it wraps a dict as is instead of copying it,
+    and the nested dicts are wrapped into views only when they are accessed, so nothing is built per node.
+    Like O, a missing attribute reads as an empty view, which is put into the wrapped dict only when something is
+    set through it, so reading never modifies the wrapped dict. A frozen view raises for a missing attribute instead,
+    and rejects any modification through it or its child views (the wrapped dict itself is not protected).
+    The keys starting with "_" are accessible through items only, e.g. view['_key'].
+    """
+
+    __slots__ = ('_dict', '_frozen', '_parent', '_key')
+
+    def __init__(self, d: dict = None, frozen=False):
+        object.__setattr__(self, '_dict', {} if d is None else d)
+        object.__setattr__(self, '_frozen', frozen)
+        # the view and the key which the dict of a view for a missing key is put into when set
+        object.__setattr__(self, '_parent', None)
+        object.__setattr__(self, '_key', None)
+
+    def __getattr__(self, item):
+        if item.startswith('_'):
+            raise AttributeError(item)
+        try:
+            return self[item]
+        except KeyError:
+            raise AttributeError('{!r} has no attribute "{}"'.format(self, item))
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+    def __delattr__(self, item):
+        del self[item]
+
+    def __getitem__(self, item):
+        d = self._dict
+        try:
+            value = d[item]
+        except KeyError:
+            if self._frozen:
+                raise
+            child = OView()
+            object.__setattr__(child, '_parent', self)
+            object.__setattr__(child, '_key', item)
+            return child
+        return OView(value, self._frozen) if type(value) is dict else value
+
+    def __setitem__(self, key, value):
+        if self._frozen:
+            raise TypeError('cannot set "{}" of a frozen {}'.format(key, type(self).__name__))
+        self._attach()
+        self._dict[key] = value._dict if isinstance(value, OView) else value
+
+    def _attach(self):
+        """put the dict of a view for a missing key into its parent, and the parent into its own parent and so on"""
+        parent = self._parent
+        if parent is not None:
+            parent._attach()
+            d = parent._dict.get(self._key)
+            if type(d) is dict:
+                # set by another view in the meantime
+                object.__setattr__(self, '_dict', d)
+            else:
+                parent._dict[self._key] = self._dict
+            object.__setattr__(self, '_parent', None)
+
+    def __delitem__(self, key):
+        if self._frozen:
+            raise TypeError('cannot delete "{}" of a frozen {}'.format(key, type(self).__name__))
+        del self._dict[key]
+
+    def __call__(self, *args, **kwargs):
+        pass
+
+    def __bool__(self):
+        return bool(self._dict)
+
+    def __len__(self):
+        return len(self._dict)
+
+    def __iter__(self):
+        return iter(self._dict)
+
+    def __contains__(self, item):
+        return item in self._dict
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self._dict)
+
+    @property
+    def frozen(self):
+        return self._frozen
+
+    def freeze(self):
+        """:return: a frozen view of the same dict"""
+        return self if self._frozen else OView(self._dict, True)
+
+    def to_dict(self):
+        """:return: the wrapped dict itself"""
+        return self._dict
+
+
+class JsonModelMeta(type):
+    """
+    Compiles the __fields__ of a JsonModel class when the class is created: every field named as a valid identifier
+    is stored in a slot of its own, and every field gets a specialized setter, getter and encoder.
+    Call compile() on the class again if its __fields__ are modified afterwards.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        if '__slots__' not in namespace:
+            namespace['__slots__'] = tuple(
+                key for key in namespace.get('__fields__', ())
+                if key.isidentifier() and not keyword.iskeyword(key) and not key.startswith('__') and
+                key not in namespace and not any(hasattr(base, key) for base in bases)
+            )
+        return super().__new__(mcs, name, bases, namespace)
+
+    def __init__(cls, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+        cls.compile()
+
+    def compile(cls):
+        specs, stores, setters, getters, encoders, checkers, defaults = {}, {}, {}, {}, [], [], []
+        for key, spec in cls.__fields__.items():
+            if not isinstance(spec, JsonModel.Field):
+                spec = JsonModel.Field(converter=spec)
+            specs[key] = spec
+            converter = spec.converter
+            slot = None
+            for klass in cls.__mro__:
+                if key in klass.__dict__:
+                    slot = klass.__dict__[key]
+                    break
+            if isinstance(slot, MemberDescriptorType):
+                store, get = slot.__set__, slot.__get__
+            else:
+                store, get = cls._dict_field_accessors(key)
+            decode = None if converter is None else _json_decoder(converter)
+            stores[key] = store
+            setters[key] = cls._field_setter(store, decode)
+            getter = cls._field_getter(get)
+            getters[key] = cls._lazy_field_getter(key, getter, store, decode) if cls.__lazy__ else getter
+            encoders.append((key, getter, None if converter is None else _json_encoder(converter),
+                             None if converter is None else _json_encoder(converter, native_datetime=True)))
+            checkers.append((key, spec.required, _field_checker(spec)))
+            if spec.default is not None:
+                defaults.append((key, getter, store, spec.default))
+        cls.__specs__ = specs
+        cls.__checkers__ = tuple(checkers)
+        cls.__defaults__ = tuple(defaults)
+        cls.__stores__ = stores
+        cls.__setters__ = setters
+        cls.__getters__ = getters
+        cls.__encoders__ = tuple(encoders)
+
+    @staticmethod
+    def _dict_field_accessors(key):
+        values_slot = JsonModel.__dict__['__values__']
+
+        def store(obj, value):
+            try:
+                values = values_slot.__get__(obj)
+            except AttributeError:
+                values = {}
+                values_slot.__set__(obj, values)
+            values[key] = value
+
+        def get(obj):
+            return values_slot.__get__(obj)[key]
+
+        return store, get
+
+    @staticmethod
+    def _field_setter(store, decode):
+        if decode is None:
+            def setter(obj, value):
+                if value is not None:
+                    store(obj, value)
+        else:
+            def setter(obj, value):
+                if value is not None:
+                    store(obj, decode(value))
+        return setter
+
+    @staticmethod
+    def _field_getter(get):
+        def getter(obj):
+            try:
+                return get(obj)
+            except (AttributeError, KeyError):
+                return _MISSING
+        return getter
+
+    @staticmethod
+    def _lazy_field_getter(key, getter, store, decode):
+        def lazy_getter(obj):
+            value = getter(obj)
+            if value is _MISSING:
+                raw = _get_raw(obj)
+                if raw is not None:
+                    value = raw.get(key)
+                    if value is None:
+                        return _MISSING
+                    if decode is not None:
+                        value = decode(value)
+                    store(obj, value)
+            return value
+        return lazy_getter
+
+
+class JsonModel(metaclass=JsonModelMeta):
     __fields__ = {}
+    # __values__ holds the fields that cannot be slots, created on demand
+    # __raw__ holds the json dict that a lazy model is created from
+    __slots__ = ('__values__', '__raw__')
+
+    # the name of the JSON backend (see qutils.json_ext.JSON_BACKENDS) for parsing json strings and to_json,
+    # "auto" for the fastest one installed
+    __json_backend__ = 'json'
+
+    # if True, the json dict is kept as is, and a field is only converted when it is read for the first time.
+    # The fields never read are passed through to_dict untouched. Do not modify the json dict afterwards.
+    __lazy__ = False
+
+    class Field:
+        """
+        The declarative spec of a field, which can be used in __fields__ in place of a converter.
+        :param value_type: the type of the value, to which the json value is coerced by parse() if possible
+        :param converter: a Converter between the json value and the value
+        :param list_of: True if the value must be a list (of the type / converter), False if it must not be,
+            None if either is allowed
+        :param required: whether parse() rejects the json objects without this field
+        :param default: the value (or a function returning it) of the field when it is absent
+        """
+
+        def __init__(self, value_type=None, converter=None, list_of=None, required=False, default=None):
+            super().__init__()
+            self.value_type = value_type
+            self.converter = converter
+            self.list_of = list_of
+            self.required = required
+            self.default = default
+
+    class ValidationError(ValueError):
+        def __init__(self, errors):
+            super().__init__('; '.join('{}: {}'.format(path, message) for path, message in errors))
+            self.errors = errors
 
     class Converter:
         valid_types = ()
@@ -50,22 +419,37 @@ class JsonModel:
         def value2json(self, value):
             return None
 
+        def value2native(self, value):
+            """the same as value2json, but may leave the datetime objects to a JSON backend that encodes them natively"""
+            return self.value2json(value)
+
         def has_valid_type(self, obj):
             return isinstance(obj, self.valid_types)
 
     class DateTimeType(Converter):
+        ISO_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
         valid_types = (pd.Timestamp, datetime)
 
-        def __init__(self, dt_format='%Y-%m-%dT%H:%M:%S.%f'):
+        def __init__(self, dt_format=ISO_FORMAT):
             super().__init__()
             self.dt_format = dt_format
 
         def json2value(self, time_str):
-            return pd.to_datetime(time_str, format=self.dt_format)
+            return self.json2values(time_str)
+
+        def json2values(self, time_strs):
+            """convert either one or an array of time strings"""
+            return pd.to_datetime(time_strs, format=self.dt_format)
 
         def value2json(self, dt):
             return dt.strftime(self.dt_format)
 
+        def value2native(self, dt):
+            # the JSON backends omit a zero fraction and write the UTC offset, which the format does not accept
+            if self.dt_format == self.ISO_FORMAT and dt.microsecond and dt.tzinfo is None:
+                return dt
+            return dt.strftime(self.dt_format)
+
     class ModelType(Converter):
         def __init__(self, model_cls):
             super().__init__()
@@ -77,88 +461,229 @@ class JsonModel:
         def value2json(self, model):
             return model.to_dict()
 
+        def value2native(self, model):
+            return model.to_dict(native_datetime=True)
+
         def has_valid_type(self, obj):
             return isinstance(obj, self.model_cls)
 
     def __init__(self, *args, **kwargs):
-        super_self = super()
-        super_self.__init__()
-        super_self.__setattr__('__values__', {})
+        super().__init__()
         if len(args) > 0:
             json_obj = args[0]
         else:
             json_obj = {}
         if isinstance(json_obj, str):
-            try:
-                json_obj = json.loads(json_obj)
-            except json.JSONDecodeError:
-                raise TypeError('json object is not valid (dict-like or json string) for conversion to model: {!r}'
+            json_obj = self._loads(json_obj)
+        if self.__lazy__:
+            if not callable(getattr(json_obj, 'get', None)):
+                raise TypeError('json object is not valid (dict-like) for conversion to model: {!r}'
                                 .format(json_obj))
-        self.from_dict(json_obj)
-        self.from_dict(kwargs)
+            _raw_slot.__set__(self, json_obj)
+        else:
+            self.from_dict(json_obj)
+        if kwargs:
+            self.from_dict(kwargs)
+        if self.__defaults__:
+            raw = _get_raw(self) if self.__lazy__ else None
+            for key, getter, store, default in self.__defaults__:
+                if getter(self) is _MISSING and (raw is None or raw.get(key) is None):
+                    store(self, default() if callable(default) else default)
+
+    @classmethod
+    def parse(cls, json_obj, trusted=False):
+        """
+        create a model from a json dict or string according to the field specs.
+        :param trusted: if False, all the fields are validated and coerced first, and a ValidationError
+            listing all the errors found is raised if any; if True, the checks are skipped
+        """
+        if not trusted:
+            if isinstance(json_obj, str):
+                json_obj = cls._loads(json_obj)
+            errors = []
+            json_obj = cls._validate(json_obj, '', errors)
+            if errors:
+                raise cls.ValidationError(errors)
+        return cls(json_obj)
+
+    @classmethod
+    def _loads(cls, json_str):
+        try:
+            return get_json_backend(cls.__json_backend__).loads(json_str)
+        except ValueError:
+            raise TypeError('json object is not valid (dict-like or json string) for conversion to model: {!r}'
+                            .format(json_str))
+
+    @classmethod
+    def validate(cls, json_obj):
+        """:return: the list of (path, message) of all the errors found in the json dict according to the field specs"""
+        errors = []
+        cls._validate(json_obj, '', errors)
+        return errors
+
+    @classmethod
+    def _validate(cls, json_obj, prefix, errors):
+        get = getattr(json_obj, 'get', None)
+        if not callable(get):
+            errors.append((prefix.rstrip('.'), 'expected a json object, got {!r}'.format(json_obj)))
+            return json_obj
+        validated = {}
+        for key, required, check in cls.__checkers__:
+            value = get(key)
+            if value is None:
+                if required:
+                    errors.append((prefix + key, 'required but missing'))
+            else:
+                validated[key] = check(value, prefix + key, errors)
+        return validated
 
     def from_dict(self, dict_obj):
         try:
             kvs = dict_obj.items()
         except AttributeError:
             raise TypeError('json object is not valid (dict-like) for conversion to model: {!r}'.format(dict_obj))
+        setters = self.__setters__
         for key, value in kvs:
-            try:
-                self.__setitem__(key, value)
-            except KeyError:
-                pass
-
-    def to_dict(self):
-        d = self.__values__.copy()
-        for key, value in d.items():
-            converter = self.__fields__[key]
-            if converter is not None:
-                if is_list(value):
-                    value = [converter.value2json(v) for v in value]
-                else:
-                    value = converter.value2json(value)
-                d[key] = value
+            setter = setters.get(key)
+            if setter is not None:
+                setter(self, value)
+
+    def to_dict(self, native_datetime=False):
+        """
+        :param native_datetime: leave the datetime fields in ISO format as datetime objects,
+            for the JSON backends that encode them natively
+        """
+        d = {}
+        raw = _get_raw(self) if self.__lazy__ else None
+        for key, getter, encode, encode_native in self.__encoders__:
+            value = getter(self)
+            if value is not _MISSING:
+                if native_datetime:
+                    encode = encode_native
+                d[key] = value if encode is None else encode(value)
+            elif raw is not None:
+                value = raw.get(key)
+                if value is not None:
+                    d[key] = value
         return d
 
     def to_json(self, *args, **kwargs):
-        d = self.to_dict()
-        return json.dumps(d, *args, **kwargs)
+        """encode with the JSON backend of the model, or with the json module if any argument of json.dumps is given"""
+        if args or kwargs:
+            return json.dumps(self.to_dict(), *args, **kwargs)
+        backend = get_json_backend(self.__json_backend__)
+        return backend.dumps(self.to_dict(backend.native_datetime))
+
+    @classmethod
+    def dump_json(cls, models, fp, backend=None, chunk_size=65536):
+        """
+        write an iterable of models as a JSON array to a text / binary file-like object or a socket,
+        one model at a time, without building the whole list of dicts or the whole JSON string.
+        :param backend: the JSON backend to use, by default the one of this class
+        :param chunk_size: the number of bytes / characters buffered between two writes
+        :return: the number of models written
+        """
+        backend = get_json_backend(cls.__json_backend__ if backend is None else backend)
+        if isinstance(fp, io.TextIOBase):
+            write, dumps, start, sep, end = fp.write, backend.dumps, '[', ',', ']'
+        else:
+            write = fp.sendall if hasattr(fp, 'sendall') else fp.write
+            dumps, start, sep, end = backend.dumpb, b'[', b',', b']'
+        native_datetime = backend.native_datetime
+        chunk, chunk_len, count = [start], 1, 0
+        for model in models:
+            if count:
+                chunk.append(sep)
+            encoded = dumps(model.to_dict(native_datetime))
+            chunk.append(encoded)
+            chunk_len += len(encoded) + 1
+            count += 1
+            if chunk_len >= chunk_size:
+                write(start[:0].join(chunk))
+                chunk, chunk_len = [], 0
+        chunk.append(end)
+        write(start[:0].join(chunk))
+        return count
+
+    @classmethod
+    def from_records(cls, records, sep='.'):
+        """
+        convert a list of json dicts of this model into a DataFrame column by column, without creating any models.
+        DateTimeType fields are parsed with one pd.to_datetime call per column, and ModelType fields holding single
+        models are flattened into columns named "<field><sep><sub field>". Unknown keys are dropped.
+        """
+        return pd.DataFrame(cls._frame_columns(list(records), '', sep))
+
+    @classmethod
+    def to_frame(cls, models, sep='.'):
+        """the same as from_records, but for a list of models (or json dicts) of this class"""
+        return pd.DataFrame(cls._frame_columns(list(models), '', sep))
+
+    @classmethod
+    def _frame_columns(cls, rows, prefix, sep):
+        columns = {}
+        for key, spec in cls.__specs__.items():
+            converter = spec.converter
+            values = [None if row is None else row[key] if isinstance(row, JsonModel) else row.get(key)
+                      for row in rows]
+            if isinstance(converter, JsonModel.DateTimeType):
+                values = converter.json2values(values)
+            elif isinstance(converter, JsonModel.ModelType) and not any(is_list(v) for v in values):
+                columns.update(converter.model_cls._frame_columns(values, prefix + key + sep, sep))
+                continue
+            columns[prefix + key] = values
+        return columns
 
     def __getitem__(self, key):
-        try:
-            return self.__values__[key]
-        except KeyError:
-            if key in self.__fields__:
-                return None
-            else:
-                raise KeyError('{!r} has no field "{}"'.format(self, key))
+        getter = self.__getters__.get(key)
+        if getter is None:
+            raise KeyError('{!r} has no field "{}"'.format(self, key))
+        value = getter(self)
+        return None if value is _MISSING else value
 
     def __setitem__(self, key, value):
-        try:
-            converter = self.__fields__[key]
-        except KeyError:
+        setter = self.__setters__.get(key)
+        if setter is None:
             raise KeyError('{!r} has no field "{}"'.format(self, key))
-        else:
-            if value is not None:
-                if converter is not None:
-                    if is_list(value):
-                        value = [v if converter.has_valid_type(v) else converter.json2value(v) for v in value]
-                    else:
-                        value = value if converter.has_valid_type(value) else converter.json2value(value)
-                self.__values__[key] = value
+        setter(self, value)
 
     def __getattr__(self, key):
+        if key.startswith('__'):
+            raise AttributeError(key)  # let the protocols like copy and pickle fall back to their defaults
         return self.__getitem__(key)
 
     def __setattr__(self, key, value):
         return self.__setitem__(key, value)
 
+    def __getstate__(self):
+        state = {}
+        for key, getter in self.__getters__.items():
+            value = getter(self)
+            if value is not _MISSING:
+                state[key] = value
+        return state
+
+    def __setstate__(self, state):
+        stores = self.__stores__
+        for key, value in state.items():
+            stores[key](self, value)
+
     def __repr__(self):
         return '{}({})'.format(type(self).__name__,
                                ', '.join('{}={!r}'.format(k, getattr(self, k))
                                          for k in self.__fields__ if hasattr(self, k)))
 
 
+_raw_slot = JsonModel.__dict__['__raw__']
+
+
+def _get_raw(model):
+    try:
+        return _raw_slot.__get__(model)
+    except AttributeError:
+        return None
+
+
 class Ref:
     def __init__(self, container, key):
         super().__init__()
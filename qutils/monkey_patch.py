@@ -1,34 +1,98 @@
 from datetime import timedelta
+from functools import lru_cache
 
+import numpy as np
 import pandas as pd
 
+try:  # a private module, which differs across the pandas versions
+    from pandas.core.indexes.accessors import TimedeltaProperties
+except ImportError:
+    TimedeltaProperties = None
 
-def timedelta_to_human(self: timedelta, short=True, precision=1, unit=None) -> str:
-    secs = self.total_seconds()
+# (seconds per unit, short name, long name) from the largest, the last one is used for everything smaller
+_MAGNITUDES = ((86400, 'day', 'day'), (3600, 'hour', 'hour'), (60, 'min', 'minute'), (1, 'sec', 'second'))
+TO_HUMAN_CACHE_SIZE = 4096
+
+
+def _find_magnitude(unit):
+    if unit.endswith('s'):
+        unit = unit[:-1]
+    for i, (_, short_name, long_name) in enumerate(_MAGNITUDES):
+        if unit in (short_name, long_name):
+            return i
+    raise ValueError('Unrecognized time unit "{}"'.format(unit))
+
+
+def _format_human(secs, short, precision, magnitude):
     negative = secs < 0
     secs = abs(secs)
-    magnitudes = [(86400, ('day',)), (3600, ('hour',)), (60, ('min', 'minute')), (0, ('sec', 'second'))]
+    if magnitude is None:
+        magnitude = next((i for i, (threshold, _, _) in enumerate(_MAGNITUDES) if secs >= threshold),
+                         len(_MAGNITUDES) - 1)
+    threshold, short_name, long_name = _MAGNITUDES[magnitude]
+    val = round(secs / threshold, precision)
+    return '{} {}{}{}'.format(val, short_name if short else long_name, 's' if val > 1 else '',
+                              ' ago' if negative else '')
+
+
+_cached_format_human = lru_cache(maxsize=TO_HUMAN_CACHE_SIZE)(_format_human)
+
+
+def timedelta_to_human(self: timedelta, short=True, precision=1, unit=None, cache=True) -> str:
+    """
+    :param cache: whether to memoize the result, for formatting the same durations repeatedly
+    """
+    secs = self.total_seconds()
+    if secs != secs:
+        raise ValueError('No proper unit can be found for "{!r}"'.format(self))
+    magnitude = None if unit is None else _find_magnitude(unit)
+    return (_cached_format_human if cache else _format_human)(secs, short, precision, magnitude)
+
+
+def timedeltas_to_human(values, short=True, precision=1, unit=None):
+    """
+    the vectorized timedelta_to_human(), with NaT formatted as None
+    :param values: a TimedeltaIndex, a Series or an array-like of timedelta-likes
+    :return: an Index of str, or a Series of str with the same index for a Series
+    """
+    tds = pd.to_timedelta(values)
+    # the same as Timedelta.total_seconds() called by timedelta_to_human(), which truncates to microseconds,
+    # i.e. the whole seconds plus the microseconds / 1e6, while that of TimedeltaIndex multiplies by 1e-9 instead
+    nanos = np.asarray(tds, dtype='timedelta64[ns]')
+    whole_secs, micros = np.divmod(nanos.view('i8') // 1000, 10 ** 6)
+    secs = whole_secs.astype(float) + micros / 1e6
+    secs[np.isnat(nanos)] = np.nan
+    negative = secs < 0
+    secs = np.abs(secs)
+    thresholds = np.array([m[0] for m in _MAGNITUDES], dtype=float)
     if unit is None:
-        for threshold, unit_strs in magnitudes:
-            if secs >= threshold:
-                val = secs / threshold
-                unit = unit_strs[0 if short else 1]
-                break
-        else:
-            raise ValueError('No proper unit can be found for "{!r}"'.format(self))
+        # the number of thresholds greater than secs, i.e. the index of the first one <= secs
+        magnitudes = np.minimum(np.searchsorted(-thresholds, -secs, side='left'), len(_MAGNITUDES) - 1)
     else:
-        if unit.endswith('s'):
-            unit = unit[:-1]
-        for threshold, unit_strs in magnitudes:
-            if unit in unit_strs:
-                val = secs / threshold
-                break
-        else:
-            raise ValueError('Unrecognized time unit "{}" for "{!r}"'.format(unit, self))
-    val = round(val, precision)
-    if val > 1:
-        unit += 's'
-    return '{} {}{}'.format(val, unit, ' ago' if negative else '')
+        magnitudes = np.full(len(secs), _find_magnitude(unit), dtype=int)
+    vals = secs / thresholds[magnitudes]
+    rounded = np.round(vals, precision)
+    # np.round() scales by 10 ** precision, which may round the values close to a half differently from round()
+    scaled = vals * 10.0 ** precision
+    halves = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    rounded[halves] = [round(v, precision) for v in vals[halves].tolist()]
+    vals = rounded
+    # all the combinations of the unit, plural and " ago"
+    suffixes = np.array([' {}{}{}'.format(m[1] if short else m[2], plural, ago)
+                         for m in _MAGNITUDES for plural in ('', 's') for ago in ('', ' ago')], dtype=object)
+    humans = vals.astype(str).astype(object) + suffixes[magnitudes * 4 + (vals > 1) * 2 + negative]
+    humans[np.isnan(secs)] = None
+    if isinstance(tds, pd.Series):
+        return pd.Series(humans, index=tds.index, name=tds.name, dtype=object)
+    return pd.Index(humans, dtype=object, name=getattr(tds, 'name', None))
+
+
+def _timedelta_properties_to_human(self, short=True, precision=1, unit=None):
+    return timedeltas_to_human(self._parent, short, precision, unit)
 
 
 pd.Timedelta.to_human = timedelta_to_human
+pd.TimedeltaIndex.to_human = timedeltas_to_human
+# Series.dt.to_human(), skipped for the pandas versions without the accessor class at the known place
+if TimedeltaProperties is not None:
+    TimedeltaProperties.to_human = _timedelta_properties_to_human
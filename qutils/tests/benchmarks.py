@@ -0,0 +1,449 @@
+"""
+Benchmarks of the hot paths of qutils on synthetic data:
+
+    python -m qutils.tests.benchmarks --save baseline.json
+    python -m qutils.tests.benchmarks --compare baseline.json --threshold 0.2
+
+With --compare, the benchmarks whose median time is slower than the baseline by more than the threshold are reported,
+and the exit code is 1 if there are any.
+"""
+import argparse
+import collections
+import importlib.util
+import inspect
+import io
+import json
+import platform
+import random
+import sys
+import types
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+import pandas as pd
+
+from qutils.binary_ext import dumpb, loadb
+from qutils.functions import Profiler, freeze, deep_equal, deep_hash, update, update_many
+from qutils.json_ext import SkyNetJSONable, SkyNetJSONEncoder, SkyNetJSONDecoder, iterload, iterdump
+from qutils.models import JsonModel
+
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name):
+    """
+    registers a benchmark, which is a function of (scale, rand) that prepares the data and returns the function
+    without arguments to time; it can also be a generator yielding the function, to clean up after it's timed
+    """
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+class Skip(Exception):
+    """raised by a benchmark whose optional dependency or pandas feature is missing"""
+
+
+def require_pandas_np():
+    """for the modules using pandas.np, which pandas 2.0 removed"""
+    if not hasattr(pd, 'np'):
+        raise Skip('pandas.np is not available in pandas {}'.format(pd.__version__))
+
+
+def random_document(rand, depth=4, width=6):
+    """a nested config-like document of dicts, lists and scalars"""
+    if depth == 0:
+        return rand.choice([None, True, rand.randrange(1000), rand.random(), 'value-{}'.format(rand.randrange(100))])
+    if rand.random() < 0.2:
+        return [random_document(rand, depth - 1, width) for _ in range(rand.randrange(width))]
+    return {'key-{}'.format(i): random_document(rand, depth - 1, width) for i in range(rand.randrange(1, width))}
+
+
+def random_records(rand, n):
+    start = datetime(2018, 1, 1)
+    return [{
+        'id': i,
+        'name': 'record-{}'.format(rand.randrange(n)),
+        'score': rand.random() * 100,
+        'tags': [rand.choice(['a', 'b', 'c', 'd']) for _ in range(rand.randrange(4))],
+        'created': (start + timedelta(seconds=rand.randrange(10 ** 7))).strftime(JsonModel.DateTimeType.ISO_FORMAT),
+        'owner': {'sstrf': 'owner-{}'.format(rand.randrange(50)), 'sintf': rand.randrange(10 ** 6)},
+    } for i in range(n)]
+
+
+def random_time_exprs(rand, n):
+    start = datetime(2018, 1, 1)
+    return [rand.choice([
+        lambda: 'now',
+        lambda: '-{}{}'.format(rand.randrange(1, 30), rand.choice('smhd')),
+        lambda: (start + timedelta(seconds=rand.randrange(10 ** 7))).strftime('%Y-%m-%d %H:%M:%S'),
+        lambda: str(rand.randrange(1500000000, 1600000000)),
+        lambda: timedelta(minutes=rand.randrange(100)),
+    ])() for _ in range(n)]
+
+
+def random_frame(rand, n):
+    return pd.DataFrame({
+        'id': range(n),
+        'name': ['name-{}'.format(rand.randrange(n)) for _ in range(n)],
+        'value': [rand.choice([rand.random(), float('nan'), float('inf')]) for _ in range(n)],
+        'note': [rand.choice([None, 'x', 'y']) for _ in range(n)],
+    })
+
+
+class FakeTeradataCursor:
+    """stands in for a teradata cursor, recording what is executed instead of sending it anywhere"""
+
+    def __init__(self, rows=(), description=None):
+        super().__init__()
+        self.rows = list(rows)
+        self.description = description
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeTeradataSession:
+    def __init__(self):
+        super().__init__()
+        self.executed = []
+
+    def execute(self, query, params=None, **kwargs):
+        self.executed.append((query, params))
+        return FakeTeradataCursor()
+
+    def executemany(self, query, params, **kwargs):
+        self.executed.append((query, params))
+        return FakeTeradataCursor()
+
+
+class _Owner(JsonModel):
+    __fields__ = {'sstrf': None, 'sintf': None}
+
+
+class _Record(JsonModel):
+    __fields__ = {
+        'id': JsonModel.Field(int, required=True),
+        'name': JsonModel.Field(str),
+        'score': JsonModel.Field(float),
+        'tags': JsonModel.Field(str, list_of=True, default=list),
+        'created': JsonModel.Field(converter=JsonModel.DateTimeType()),
+        'owner': JsonModel.Field(converter=JsonModel.ModelType(_Owner)),
+    }
+
+
+@benchmark('dsl.eval_dsl')
+def bench_eval_dsl(scale, rand):
+    require_pandas_np()
+    from qutils.dsl import eval_dsl
+    # the namespace receives the variables of the code, which cannot read from it
+    lines = ['b = [i * a for i in range(10)]', 'return sum(b) - a']
+    codes = ['\n'.join(['a = {} + 1'.format(rand.randrange(100))] + lines) for _ in range(10)]
+    return lambda: [eval_dsl(codes[i % len(codes)], {}, '__result__') for i in range(100 * scale)]
+
+
+@benchmark('dsl.check_dsl_errors')
+def bench_check_dsl_errors(scale, rand):
+    require_pandas_np()
+    from qutils.dsl import check_dsl_errors
+    code = '\n'.join('v{0} = metric.get_data(now, now - "{0}d").sum() + {0}'.format(i) for i in range(20 * scale))
+    return lambda: check_dsl_errors(code)
+
+
+@benchmark('models.JsonModel.parse')
+def bench_json_model_parse(scale, rand):
+    records = random_records(rand, 200 * scale)
+    return lambda: [_Record.parse(r) for r in records]
+
+
+@benchmark('models.JsonModel.to_json')
+def bench_json_model_to_json(scale, rand):
+    models = [_Record.parse(r) for r in random_records(rand, 200 * scale)]
+    return lambda: [m.to_json() for m in models]
+
+
+@benchmark('functions.freeze')
+def bench_freeze(scale, rand):
+    docs = [random_document(rand) for _ in range(20 * scale)]
+    return lambda: [freeze(d, unordered_list=True) for d in docs]
+
+
+@benchmark('functions.deep_equal')
+def bench_deep_equal(scale, rand):
+    docs = [random_document(rand) for _ in range(20 * scale)]
+    copies = json.loads(json.dumps(docs))
+    return lambda: [deep_equal(d, c, unordered_list=True) for d, c in zip(docs, copies)]
+
+
+@benchmark('functions.deep_hash')
+def bench_deep_hash(scale, rand):
+    docs = [random_document(rand) for _ in range(20 * scale)]
+    return lambda: [deep_hash(d, unordered_list=True) for d in docs]
+
+
+@benchmark('functions.update')
+def bench_update(scale, rand):
+    doc = random_document(rand, depth=5)
+    patches = [random_document(rand, depth=3) for _ in range(20 * scale)]
+    return lambda: [update(doc, p, deep=True) for p in patches]
+
+
+@benchmark('functions.update_many')
+def bench_update_many(scale, rand):
+    doc = random_document(rand, depth=5)
+    patches = [random_document(rand, depth=3) for _ in range(20 * scale)]
+    return lambda: update_many(doc, patches, deep=True)
+
+
+@contextmanager
+def registered_jsonable_types(*classes):
+    """register SkyNetJSONable types temporarily, without leaving them in the global registry"""
+    all_types = dict(SkyNetJSONable.all_types)
+    try:
+        yield classes
+    finally:
+        SkyNetJSONable.all_types.clear()
+        SkyNetJSONable.all_types.update(all_types)
+
+
+def jsonable_point_type():
+    class Point(SkyNetJSONable):
+        type = '_benchmark_point'
+
+        def __init__(self, x=None, y=None, label=None):
+            self.x = x
+            self.y = y
+            self.label = label
+
+        def encode(self):
+            return {'x': self.x, 'y': self.y, 'label': self.label}
+
+        @classmethod
+        def decode(cls, obj):
+            return cls(**obj)
+
+    return Point
+
+
+def random_points(rand, point_type, n):
+    return [point_type(rand.random(), rand.randrange(1000), 'point-{}'.format(rand.randrange(100))) for _ in range(n)]
+
+
+@benchmark('json_ext.SkyNetJSONDecoder')
+def bench_skynet_json_decoder(scale, rand):
+    with registered_jsonable_types():
+        text = json.dumps(random_points(rand, jsonable_point_type(), 2000 * scale), cls=SkyNetJSONEncoder)
+        yield lambda: json.loads(text, cls=SkyNetJSONDecoder)
+
+
+@benchmark('json_ext.iterload')
+def bench_iterload(scale, rand):
+    with registered_jsonable_types():
+        text = json.dumps(random_points(rand, jsonable_point_type(), 2000 * scale), cls=SkyNetJSONEncoder)
+        yield lambda: sum(1 for _ in iterload(io.StringIO(text)))
+
+
+@benchmark('json_ext.SkyNetJSONEncoder')
+def bench_skynet_json_encoder(scale, rand):
+    with registered_jsonable_types():
+        points = random_points(rand, jsonable_point_type(), 2000 * scale)
+        yield lambda: json.dumps(points, cls=SkyNetJSONEncoder)
+
+
+@benchmark('json_ext.iterdump')
+def bench_iterdump(scale, rand):
+    with registered_jsonable_types():
+        points = random_points(rand, jsonable_point_type(), 2000 * scale)
+        yield lambda: iterdump(points, io.StringIO())
+
+
+# the same data as the JSON benchmarks above, for comparing
+@benchmark('binary_ext.dumpb')
+def bench_binary_dumpb(scale, rand):
+    with registered_jsonable_types():
+        points = random_points(rand, jsonable_point_type(), 2000 * scale)
+        yield lambda: dumpb(points)
+
+
+@benchmark('binary_ext.loadb')
+def bench_binary_loadb(scale, rand):
+    with registered_jsonable_types():
+        data = dumpb(random_points(rand, jsonable_point_type(), 2000 * scale))
+        yield lambda: loadb(data)
+
+
+@benchmark('datetime.to_datetime')
+def bench_to_datetime(scale, rand):
+    from qutils.datetime import to_datetime
+    exprs = random_time_exprs(rand, 100 * scale)
+    base = pd.Timestamp('2018-06-01')
+    return lambda: [to_datetime(e, from_datetime=base) for e in exprs]
+
+
+@benchmark('datetime.to_datetime_array')
+def bench_to_datetime_array(scale, rand):
+    from qutils.datetime import to_datetime_array
+    exprs = random_time_exprs(rand, 100 * scale)
+    base = pd.Timestamp('2018-06-01')
+    return lambda: to_datetime_array(exprs, from_datetime=base)
+
+
+@benchmark('monkey_patch.timedeltas_to_human')
+def bench_timedeltas_to_human(scale, rand):
+    from qutils.monkey_patch import timedeltas_to_human
+    tds = pd.to_timedelta([rand.randrange(-10 ** 6, 10 ** 6) for _ in range(2000 * scale)], unit='s')
+    return lambda: timedeltas_to_human(tds)
+
+
+@contextmanager
+def stubbed_teradata_module():
+    """
+    import qutils.io with a stand-in of the teradata driver if it is not installed, which never connects,
+    and forget both afterwards, so a later import of qutils.io is not affected
+    """
+    if importlib.util.find_spec('teradata') is not None:
+        yield
+        return
+    stub = types.ModuleType('teradata')
+    stub.DatabaseError = type('DatabaseError', (Exception,), {})
+    stub.UdaExec = None
+    imported = 'qutils.io' in sys.modules
+    sys.modules['teradata'] = stub
+    try:
+        yield
+    finally:
+        del sys.modules['teradata']
+        if not imported:
+            sys.modules.pop('qutils.io', None)
+
+
+@benchmark('io.Teradata.upsert')
+def bench_teradata_upsert(scale, rand):
+    require_pandas_np()
+    with stubbed_teradata_module():
+        from qutils.io import Teradata
+
+        class LocalTeradata(Teradata):
+            pooling = False
+            session = FakeTeradataSession()
+
+        teradata = LocalTeradata('localhost', 'user', 'password', database='db', table='table')
+        frame = random_frame(rand, 1000 * scale)
+        yield lambda: teradata.upsert(frame, on='id', chunk_size=200)
+
+
+def run_benchmarks(names=None, scale=1, repeat=10, seed=0):
+    """
+    :return: {name: {'count', 'total', 'p50', 'p99', 'max'}} in seconds, or {name: {'skipped' or 'error': reason}}
+    """
+    profiler = Profiler()
+    results = collections.OrderedDict()
+    for name, prepare in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        cleanup = None
+        try:
+            fn = prepare(scale, random.Random(seed))
+            if inspect.isgenerator(fn):
+                cleanup, fn = fn, next(fn)
+            fn()  # warm up
+            for _ in range(repeat):
+                with profiler.span(name):
+                    fn()
+        except Skip as err:
+            results[name] = {'skipped': str(err)}
+            continue
+        except Exception as err:
+            results[name] = {'error': '{}: {}'.format(type(err).__name__, err)[:200]}
+            continue
+        finally:
+            if cleanup is not None:
+                cleanup.close()
+        results[name] = profiler.stats()[name]
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold=0.2):
+    """
+    :return: [(name, baseline p50, current p50)] of the benchmarks slower than the baseline by more than threshold
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or 'p50' not in base or 'p50' not in result:
+            continue
+        if result['p50'] > base['p50'] * (1 + threshold):
+            regressions.append((name, base['p50'], result['p50']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the hot paths of qutils.')
+    parser.add_argument('names', nargs='*', help='the benchmarks to run, all by default')
+    parser.add_argument('--scale', type=int, default=1, help='multiplier of the data sizes')
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs of each benchmark')
+    parser.add_argument('--save', help='save the results as a baseline to this file')
+    parser.add_argument('--compare', help='compare the results with the baseline in this file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='max allowed slowdown of the median time relative to the baseline')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.names, scale=args.scale, repeat=args.repeat)
+    for name, result in results.items():
+        if 'p50' in result:
+            print('{:<32} p50 {:>10.6f}s  p99 {:>10.6f}s  max {:>10.6f}s'
+                  .format(name, result['p50'], result['p99'], result['max']))
+        else:
+            print('{:<32} {}'.format(name, result.get('skipped') or result.get('error')))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'scale': args.scale, 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline['results'], args.threshold)
+        for name, base, current in regressions:
+            print('REGRESSION {}: {:.6f}s -> {:.6f}s ({:+.0%})'.format(name, base, current, current / base - 1))
+        return 1 if regressions else 0
+    return 0
+
+
+class TestBenchmarks(TestCase):
+    def test_run_benchmarks(self):
+        results = run_benchmarks(repeat=1)
+        self.assertEqual(list(BENCHMARKS), list(results))
+        for name, result in results.items():
+            self.assertNotIn('error', result, name)
+            self.assertTrue('p50' in result or 'skipped' in result)
+            if name.startswith(('functions.', 'models.')):
+                self.assertEqual(1, result['count'])
+
+    def test_skip(self):
+        @benchmark('test.skipped')
+        def bench_skipped(scale, rand):
+            raise Skip('not installed')
+
+        try:
+            self.assertEqual({'test.skipped': {'skipped': 'not installed'}},
+                             dict(run_benchmarks(['test.skipped'], repeat=1)))
+        finally:
+            del BENCHMARKS['test.skipped']
+
+    def test_compare_to_baseline(self):
+        baseline = {'a': {'p50': 1.0}, 'b': {'p50': 1.0}, 'c': {'skipped': 'x'}}
+        results = {'a': {'p50': 1.1}, 'b': {'p50': 1.3}, 'c': {'p50': 5}, 'd': {'p50': 5}}
+        self.assertEqual([('b', 1.0, 1.3)], compare_to_baseline(results, baseline, threshold=0.2))
+
+    def test_fake_teradata_session(self):
+        session = FakeTeradataSession()
+        session.executemany('INSERT ...', [[1], [2]])
+        self.assertEqual([('INSERT ...', [[1], [2]])], session.executed)
+        self.assertEqual([], session.execute('SELECT 1').fetchall())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+from unittest import TestCase
+
+from qutils.binary_ext import SkyNetBinaryCodec, dumpb, loadb
+from qutils.json_ext import SkyNetJSONable
+
+
+class TestSkyNetBinaryCodec(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.all_types = dict(SkyNetJSONable.all_types)
+
+        class Point(SkyNetJSONable):
+            type = 'test-point'
+
+            def __init__(self, x, y):
+                self.x = x
+                self.y = y
+
+            def encode(self):
+                return {'x': self.x, 'y': self.y}
+
+            @classmethod
+            def decode(cls, obj):
+                return cls(**obj)
+
+        self.Point = Point
+
+    def tearDown(self):
+        SkyNetJSONable.all_types.clear()
+        SkyNetJSONable.all_types.update(self.all_types)
+        super().tearDown()
+
+    def test_plain(self):
+        values = [None, True, False, 0, 127, 128, 255, 256, 65535, 65536, 2 ** 32, 2 ** 64 - 1,
+                  -1, -32, -33, -128, -129, -32768, -32769, -2 ** 31 - 1, -2 ** 63, 0.0, -1.5, 1e300,
+                  '', 'a' * 31, 'é' * 32, 'x' * 256, 'y' * 65536, b'', b'\x00' * 300,
+                  [], list(range(15)), list(range(16)), list(range(65536)), {}, {str(i): i for i in range(16)},
+                  {'a': [1, {'b': None}], 1: 'int key'}]
+        for value in values:
+            self.assertEqual(value, loadb(dumpb(value)))
+        self.assertEqual([1, [2]], loadb(dumpb((1, (2,)))))
+        self.assertEqual(b'ab', loadb(dumpb(bytearray(b'ab'))))
+        # the same wire format as MessagePack for the plain values, after the empty array of the type keys
+        self.assertEqual(b'\x90\x93\x01\xa1a\x81\xc0\xcb?\xf8\x00\x00\x00\x00\x00\x00',
+                         dumpb([1, 'a', {None: 1.5}]))
+
+    def test_objects(self):
+        points = [self.Point(i, [i, {'z': b'bytes'}]) for i in range(20)]
+        decoded = loadb(dumpb({'points': points, 'nested': self.Point(self.Point(1, 2), None)}))
+        self.assertTrue(all(isinstance(p, self.Point) for p in decoded['points']))
+        self.assertEqual([(p.x, p.y) for p in points], [(p.x, p.y) for p in decoded['points']])
+        self.assertIsInstance(decoded['nested'].x, self.Point)
+        self.assertEqual((1, 2), (decoded['nested'].x.x, decoded['nested'].x.y))
+
+        codec = SkyNetBinaryCodec()
+        self.assertEqual(b'\x91\xaatest-point\xc1\x00\x82\xa1x\x01\xa1y\x02', codec.dumpb(self.Point(1, 2)))
+        with self.assertRaises(ValueError):
+            loadb(b'\x90\xc1\x00\x80')
+
+        class Unregistered(SkyNetJSONable):
+            pass
+
+        with self.assertRaises(TypeError):
+            dumpb(Unregistered())
+        with self.assertRaises(TypeError):
+            dumpb(object())
+
+    def test_registries(self):
+        class Other(SkyNetJSONable):
+            type = 'test-other'
+
+            def encode(self):
+                return {}
+
+            @classmethod
+            def decode(cls, obj):
+                return cls()
+
+        points = dumpb([self.Point(1, 2)])
+        data = dumpb([Other(), self.Point(1, 2)])
+        # decoded by the type keys, though the types registered by the reader differ
+        del SkyNetJSONable.all_types['test-other']
+        self.assertIsInstance(loadb(points)[0], self.Point)
+        with self.assertRaises(ValueError):
+            loadb(data)
+        SkyNetJSONable.all_types['test-other'] = Other
+        self.assertEqual([Other, self.Point], [type(obj) for obj in loadb(data)])
+
+    def test_zero_copy(self):
+        data = dumpb({'blob': b'\x01\x02\x03', 'point': self.Point(b'x', None)})
+        decoded = loadb(data, zero_copy=True)
+        self.assertIsInstance(decoded['blob'], memoryview)
+        self.assertEqual(b'\x01\x02\x03', decoded['blob'])
+        self.assertIs(data, decoded['blob'].obj)
+        self.assertEqual(b'x', decoded['point'].x)
+        self.assertIsInstance(loadb(data)['blob'], bytes)
+
+    def test_invalid(self):
+        data = dumpb(['abc', 1.5])
+        with self.assertRaises(ValueError):
+            loadb(data[:-1])
+        with self.assertRaises(ValueError):
+            loadb(data + b'\x00')
+        with self.assertRaises(ValueError):
+            loadb(b'\xd4\x00\x00')
+        with self.assertRaises(OverflowError):
+            dumpb(2 ** 64)
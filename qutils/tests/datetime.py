@@ -0,0 +1,160 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from qutils.datetime import to_seconds, to_timedelta, to_datetime, to_datetime_array, ensure_timestamps, \
+    time_literal_cache_info, clear_time_literal_cache, WindowScheduler, BULK_OFFSETS_THRESHOLD
+
+
+class TestToDatetimeArray(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.base = pd.Timestamp('2018-06-01 12:00:00')
+
+    def test_classes(self):
+        values = [None, 'now', 'NOW', datetime(2018, 1, 2, 3, 4, 5), pd.Timestamp('2018-01-02', tz='Asia/Shanghai'),
+                  np.datetime64('2018-01-03'), '2018-01-04 05:06:07', '2018-01-04T05:06:07.5', '20180105',
+                  '20180105060708', '3600', 60, 1.5, '-1.5', '-3d', '1h', timedelta(minutes=5), pd.Timedelta('-1s')]
+        expected = [self.base, self.base, self.base, pd.Timestamp('2018-01-02 03:04:05'),
+                    pd.Timestamp('2018-01-01 16:00:00'), pd.Timestamp('2018-01-03'),
+                    pd.Timestamp('2018-01-04 05:06:07'), pd.Timestamp('2018-01-04 05:06:07.5'),
+                    pd.Timestamp('2018-01-05'), pd.Timestamp('2018-01-05 06:07:08'),
+                    self.base + pd.Timedelta('1h'), self.base + pd.Timedelta('1min'),
+                    self.base + pd.Timedelta('1.5s'), self.base - pd.Timedelta('1.5s'), self.base - pd.Timedelta('3D'),
+                    self.base + pd.Timedelta('1h'), self.base + pd.Timedelta('5min'), self.base - pd.Timedelta('1s')]
+        result = to_datetime_array(values, from_datetime=lambda: self.base)
+        self.assertIsInstance(result, pd.DatetimeIndex)
+        self.assertEqual(expected, list(result))
+        for i in (0, 1, 2, 3, 4, 6, 7):  # the same as to_datetime()
+            t = pd.Timestamp(to_datetime(values[i], from_datetime=self.base))
+            self.assertEqual(t if t.tzinfo is None else t.tz_convert(None), result[i])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            to_datetime_array(['-3d', 'yesterday'], from_datetime=self.base)
+        self.assertTrue(to_datetime_array(['-3d', None], if_invalid='return_none').isna().all())
+        with self.assertRaises(ValueError):
+            to_datetime_array(['-3d'], if_invalid='raise')
+        self.assertEqual([pd.Timestamp('2018-01-01')], list(to_datetime_array(['2018-01-01 00:00:00'],
+                                                                             if_invalid='raise')))
+
+    def test_series(self):
+        result = to_datetime_array(pd.Series(['-1h', '2018-01-01 00:00:00'], index=['a', 'b']), self.base)
+        self.assertEqual(['a', 'b'], list(result.index))
+        self.assertEqual(self.base - pd.Timedelta('1h'), result['a'])
+
+    def test_ensure_timestamps(self):
+        self.assertEqual([self.base - pd.Timedelta('1D'), self.base, self.base - pd.Timedelta('1h'), self.base],
+                         ensure_timestamps(['-1d', None, '-1h', self.base]))
+        # the same as converting one by one with to_datetime()
+        values = ['-1d', None, 'now', '1.5', '3600', '20180101', '2018-01-01 08:00:00+08:00', timedelta(minutes=5),
+                  pd.Timedelta('-2h')]
+        for base in self.base, pd.Timestamp('2018-06-01', tz='UTC'):
+            # short enough for the per-value path, and long enough for the bulk path
+            for repeat in 1, BULK_OFFSETS_THRESHOLD:
+                expected = [to_datetime(v, from_datetime=base) for v in values * repeat] + [base]
+                self.assertEqual([(t, getattr(t, 'tzinfo', None)) for t in expected],
+                                 [(t, getattr(t, 'tzinfo', None)) for t in ensure_timestamps(values * repeat + [base])])
+        with self.assertRaises(ValueError):
+            ensure_timestamps(['yesterday', self.base])
+
+
+class TestTimeLiterals(TestCase):
+    def setUp(self):
+        super().setUp()
+        clear_time_literal_cache()
+
+    def test_to_timedelta(self):
+        self.assertEqual(pd.Timedelta('5min'), to_timedelta('5m'))
+        self.assertEqual(pd.Timedelta('-3D'), to_timedelta('-3d'))
+        self.assertEqual(pd.Timedelta('90s'), to_timedelta(90))
+        self.assertEqual(pd.Timedelta('1.5s'), to_timedelta('1.5'))
+        self.assertEqual(pd.Timedelta('1000s'), to_timedelta('1e3'))
+        self.assertEqual(pd.Timedelta('5min'), to_timedelta(timedelta(minutes=5)))
+        self.assertEqual(3600, to_seconds('1h'))
+        with self.assertRaises(ValueError):
+            to_timedelta('yesterday')
+
+    def test_cache_info(self):
+        for _ in range(10):
+            to_seconds('5m')
+            to_datetime('1500000000', from_datetime=pd.Timestamp('2018-01-01'))
+            to_datetime('2018-01-01 00:00:00')
+        info = time_literal_cache_info()
+        self.assertEqual({'hits': 18, 'misses': 2, 'size': 2, 'hit_rate': 0.9},
+                         {k: v for k, v in info['timedelta'].items() if k != 'maxsize'})
+        self.assertEqual((18, 2), (info['datetime']['hits'], info['datetime']['misses']))
+        clear_time_literal_cache()
+        self.assertIsNone(time_literal_cache_info()['timedelta']['hit_rate'])
+
+
+class TestWindowScheduler(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = pd.Timestamp('2018-06-01 12:00:00')
+        self.scheduler = WindowScheduler(max_workers=2, timer=lambda: self.now)
+
+    def tearDown(self):
+        self.scheduler.executor.shutdown()
+        super().tearDown()
+
+    def run_pending(self):
+        return [f.exception() or f.result() for f in self.scheduler.run_pending()]
+
+    def test_policies(self):
+        window = lambda start, end: (start, end)
+        catch_up = self.scheduler.add(window, '1h', ['-1h', 'now'], policy=WindowScheduler.CATCH_UP)
+        skip = self.scheduler.add(window, '1h', ['-30m', 'now'], start='-1m')
+        failing = self.scheduler.add(lambda now: 1 / 0, '1h', start='10m')
+        self.assertEqual([(self.now - pd.Timedelta('31m'), self.now - pd.Timedelta('1m')),
+                          (self.now - pd.Timedelta('1h'), self.now)], self.run_pending())
+        self.assertEqual([], self.run_pending())
+        self.now += pd.Timedelta('3h')
+        results = self.run_pending()
+        self.assertEqual([(self.now - pd.Timedelta(h, 'h'), self.now - pd.Timedelta(h - 1, 'h')) for h in (3, 2, 1)],
+                         [r for r in results if isinstance(r, tuple) and r[1].minute == 0])
+        self.assertEqual([(self.now - pd.Timedelta('31m'), self.now - pd.Timedelta('1m'))],
+                         [r for r in results if isinstance(r, tuple) and r[1].minute == 59])
+        self.assertEqual((4, 2, 2, 1), (catch_up.runs, skip.runs, skip.skipped, failing.errors))
+        self.assertIsInstance(failing.last_error, ZeroDivisionError)
+        self.scheduler.remove(catch_up)
+        self.now += pd.Timedelta('1h')
+        self.assertEqual(1, len([r for r in self.run_pending() if isinstance(r, tuple)]))
+        self.assertEqual(self.now + pd.Timedelta('59m'), skip.next_time)
+        with self.assertRaises(ValueError):
+            self.scheduler.add(window, '1h', policy='never')
+
+    def test_timer_thread(self):
+        scheduler = WindowScheduler(max_workers=1)
+        fired = threading.Event()
+        scheduler.add(lambda t: fired.set(), '1h', start='0.05')
+        scheduler.start()
+        try:
+            self.assertTrue(fired.wait(2))
+        finally:
+            scheduler.stop()
+            scheduler.executor.shutdown()
+
+    def test_run_async(self):
+        scheduler = WindowScheduler(max_workers=1)
+        fired = []
+
+        async def job(start, end):
+            fired.append(end - start)
+            scheduler.stop()
+
+        async def run():
+            scheduler.add(job, '1h', ['-5m', 'now'], start='0.01')
+            await asyncio.wait_for(scheduler.run_async(), 2)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+            scheduler.executor.shutdown()
+        self.assertEqual([pd.Timedelta('5m')], fired)
@@ -0,0 +1,266 @@
+import asyncio
+import importlib.util
+import json
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from unittest import TestCase, skipUnless
+
+from qutils.dlmanager import DLManager, DL, User, ResponseCache, MembershipGraph, CircuitBreaker
+
+
+class StubDLServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubDLHandler)
+        self.dls = {}
+        self.failures = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def prefix(self):
+        return 'http://{}:{}/API'.format(*self.server_address)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubDLHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.handle_request(json.loads(self.rfile.read(length).decode()) if length else None)
+
+    def handle_request(self, body=None):
+        server = self.server
+        parts = self.path.split('/')[2:-2]  # strip "/API" and "executor/token"
+        with server.lock:
+            server.requests.append('/'.join(parts))
+            failures = server.failures.get(parts[-1], 0)
+            if failures:
+                server.failures[parts[-1]] = failures - 1
+        if failures:
+            return self.reply(500, 'server error')
+        route = '/'.join(parts[:-1])
+        dl_name = parts[-1]
+        if route == 'DL/exist':
+            return self.reply(200, 'true' if dl_name in server.dls else 'false')
+        if dl_name not in server.dls:
+            return self.reply(400 if route == 'DL/properties' else 500, 'no such DL')
+        members = server.dls[dl_name]
+        if route == 'DL/properties':
+            return self.reply(200, json.dumps({'samAccountName': dl_name, 'type': 'DL'}))
+        if route in ('DL/members', 'DL/members/recursive'):
+            return self.reply(200, json.dumps([{'samAccountName': m, 'type': 'DL' if m in server.dls else 'User'}
+                                               for m in members]))
+        if route == 'DL/members/add':
+            members.extend(body)
+            return self.reply(200, '')
+        if route == 'DL/members/remove':
+            members[:] = [m for m in members if m not in body]
+            return self.reply(200, '')
+        self.reply(404, 'not found')
+
+    def reply(self, code, text):
+        data = text.encode()
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class TestDLManager(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = StubDLServer()
+        self.server.dls.update({'dl-a': ['alice', 'bob'], 'dl-b': ['carol'], 'dl-c': []})
+        self.server.start()
+        self.dlm = DLManager('executor', 'token', url_prefix=self.server.prefix)
+        self.dlm.BULK_RETRY_BACKOFF = 0
+
+    def tearDown(self):
+        self.server.stop()
+        super().tearDown()
+
+    def test_get_many_dl_properties(self):
+        results, errors = self.dlm.get_many_dl_properties(['dl-a', 'dl-b', 'dl-x'])
+        self.assertEqual(['dl-a', 'dl-b'], list(results))
+        self.assertTrue(all(isinstance(d, DL) for d in results.values()))
+        self.assertEqual('dl-b', results['dl-b'].samAccountName)
+        self.assertEqual(['dl-x'], list(errors))
+        self.assertIsInstance(errors['dl-x'], DLManager.DLNotExist)
+
+    def test_get_many_dl_members_retries_server_errors(self):
+        self.server.failures.update({'dl-a': 2, 'dl-b': 10})
+        results, errors = self.dlm.get_many_dl_members(['dl-a', 'dl-b', 'dl-c'])
+        self.assertEqual(['alice', 'bob'], [u.samAccountName for u in results['dl-a']])
+        self.assertTrue(all(isinstance(u, User) for u in results['dl-a']))
+        self.assertEqual([], results['dl-c'])
+        self.assertIsInstance(errors['dl-b'], DLManager.CallAPIError)
+        self.assertEqual(500, errors['dl-b'].status_code)
+
+    def test_cached_reads(self):
+        self.dlm.cache = ResponseCache(ttl=60)
+        for _ in range(3):
+            self.assertEqual(['alice', 'bob'], [u.samAccountName for u in self.dlm.get_dl_members('dl-a')])
+            self.assertTrue(self.dlm.exists_dl('dl-a'))
+        self.assertEqual(['DL/members/dl-a', 'DL/exist/dl-a'], self.server.requests)
+        self.dlm.remove_dl_members('dl-a', User(samAccountName='bob'))
+        self.assertEqual(['alice'], [u.samAccountName for u in self.dlm.get_dl_members('dl-a', False)])
+        self.assertTrue(self.dlm.exists_dl('dl-a'))
+        self.assertEqual(4, len(self.server.requests))
+
+    def test_exists_check(self):
+        self.dlm.exists_check = 'off'
+        with self.assertRaises(DLManager.CallAPIError) as ctx:
+            self.dlm.get_dl_members('dl-x')
+        self.assertNotIsInstance(ctx.exception, DLManager.DLNotExist)
+        self.assertEqual('dl-x', ctx.exception.dl_name)
+        self.assertEqual(['DL/members/dl-x'], self.server.requests)
+
+        self.dlm.exists_check = 'cache'
+        self.dlm.cache = ResponseCache()
+        self.assertFalse(self.dlm.exists_dl('dl-x'))
+        with self.assertRaises(DLManager.DLNotExist):
+            self.dlm.get_dl_members('dl-x')
+        self.assertEqual(['DL/members/dl-x', 'DL/exist/dl-x', 'DL/members/dl-x'], self.server.requests)
+
+    def test_circuit_breaker(self):
+        now = [0]
+        self.dlm.circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, timer=lambda: now[0])
+        self.server.failures['dl-a'] = 3
+        for _ in range(2):
+            with self.assertRaises(DLManager.CallAPIError):
+                self.dlm.get_dl_members('dl-a')
+        # the failed call and its existence check opened the circuit, so the second call failed fast
+        self.assertEqual(['DL/members/dl-a', 'DL/exist/dl-a'], self.server.requests)
+        with self.assertRaises(DLManager.CircuitOpen):
+            self.dlm.get_dl_members('dl-b')
+        now[0] = 10
+        with self.assertRaises(DLManager.CallAPIError):
+            self.dlm.get_dl_members('dl-a')  # the trial call fails and the circuit opens again
+        with self.assertRaises(DLManager.CircuitOpen):
+            self.dlm.get_dl_members('dl-b')
+        now[0] = 20
+        self.assertEqual(['carol'], [u.samAccountName for u in self.dlm.get_dl_members('dl-b')])
+        self.assertTrue(self.dlm.circuit_breaker.closed)
+        self.assertEqual(4, len(self.server.requests))
+
+    def test_stale_while_revalidate(self):
+        now = [0]
+        cache = ResponseCache(ttl=10, stale_ttl=10, timer=lambda: now[0])
+        fetched = []
+
+        def fetch():
+            fetched.append(now[0])
+            return len(fetched)
+
+        self.assertEqual(1, cache.get('k', fetch))
+        now[0] = 15
+        self.assertEqual(1, cache.get('k', fetch))  # stale value is served while being refreshed
+        cache._executor.shutdown(wait=True)
+        self.assertEqual(2, cache.get('k', fetch))
+        now[0] = 50
+        self.assertEqual(3, cache.get('k', fetch))  # expired
+        self.assertEqual([0, 15, 50], fetched)
+        self.assertEqual((1, 1, 2), (cache.hits, cache.stale_hits, cache.misses))
+
+
+class TestMembershipGraph(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = StubDLServer()
+        self.server.dls.update({'dl-a': ['alice', 'dl-b'], 'dl-b': ['bob', 'dl-c'], 'dl-c': ['carol', 'dl-a']})
+        self.server.start()
+        self.graph = MembershipGraph(DLManager('executor', 'token', url_prefix=self.server.prefix))
+
+    def tearDown(self):
+        self.server.stop()
+        super().tearDown()
+
+    def test_nested_cycle(self):
+        self.assertEqual({}, self.graph.load('dl-a'))
+        self.assertEqual(3, len(self.server.requests))
+        self.assertEqual({'dl-a', 'dl-b', 'dl-c'}, self.graph.memberships('alice'))
+        self.assertEqual({'dl-a', 'dl-c'}, self.graph.memberships('dl-b'))
+        self.assertEqual({'alice', 'bob', 'carol', 'dl-b', 'dl-c'}, self.graph.members('dl-a'))
+        self.assertTrue(self.graph.is_member(User(samAccountName='carol'), 'dl-b'))
+
+    def test_refresh(self):
+        self.graph.load('dl-a')
+        self.server.dls['dl-c'].remove('dl-a')
+        self.server.dls['dl-b'].remove('dl-c')
+        self.graph.set_user_memberships('dave', ['dl-c'])
+        self.assertEqual({}, self.graph.refresh(max_age=3600))
+        self.assertEqual({'dl-a', 'dl-b', 'dl-c'}, self.graph.memberships('alice'))
+        self.assertEqual({}, self.graph.refresh())
+        self.assertEqual({'dl-a'}, self.graph.memberships('alice'))
+        self.assertEqual(set(), self.graph.memberships('dave'))  # refreshed members of dl-c do not include dave
+        self.assertFalse(self.graph.is_member('carol', 'dl-a'))
+        self.assertEqual({'alice', 'bob', 'dl-b'}, self.graph.members('dl-a'))
+
+
+@skipUnless(importlib.util.find_spec('aiohttp') is not None, 'aiohttp is not installed')
+class TestAsyncDLManager(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = StubDLServer()
+        self.server.dls.update({'dl-a': ['alice', 'bob'], 'dl-b': ['carol']})
+        self.server.start()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        self.server.stop()
+        super().tearDown()
+
+    def run_with_manager(self, coro_fn, **kwargs):
+        from qutils.aiodlmanager import AsyncDLManager
+
+        async def run():
+            async with AsyncDLManager('executor', 'token', url_prefix=self.server.prefix, **kwargs) as dlm:
+                dlm.BULK_RETRY_BACKOFF = 0
+                return await coro_fn(dlm)
+        return self.loop.run_until_complete(run())
+
+    def test_api_calls(self):
+        async def calls(dlm):
+            await dlm.add_dl_members('dl-b', ['dave', User(samAccountName='erin')])
+            return await dlm.get_dl_properties('dl-a'), await dlm.get_dl_members('dl-b'), await dlm.exists_dl('dl-x')
+
+        dl, members, exists = self.run_with_manager(calls, pool_size=2, keepalive_timeout=None)
+        self.assertIsInstance(dl, DL)
+        self.assertEqual('dl-a', dl.samAccountName)
+        self.assertEqual(['carol', 'dave', 'erin'], [u.samAccountName for u in members])
+        self.assertFalse(exists)
+
+    def test_errors(self):
+        with self.assertRaises(DLManager.DLNotExist):
+            self.run_with_manager(lambda dlm: dlm.get_dl_members('dl-x'))
+        self.server.failures['dl-a'] = 2
+        with self.assertRaises(DLManager.CallAPIError):
+            self.run_with_manager(lambda dlm: dlm.get_dl_members('dl-a'))
+        # no response cache to look the existence up in
+        with self.assertRaises(ValueError):
+            self.run_with_manager(lambda dlm: dlm.get_dl_members('dl-a'), exists_check='cache')
+
+    def test_get_many_dl_members(self):
+        self.server.failures.update({'dl-a': 2})
+        results, errors = self.run_with_manager(lambda dlm: dlm.get_many_dl_members(['dl-a', 'dl-b', 'dl-x']),
+                                                pool_size=1)
+        self.assertEqual(['alice', 'bob'], [u.samAccountName for u in results['dl-a']])
+        self.assertEqual(['dl-x'], list(errors))
+        self.assertIsInstance(errors['dl-x'], DLManager.DLNotExist)
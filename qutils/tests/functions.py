@@ -0,0 +1,325 @@
+import asyncio
+import json
+import os
+import pickle
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+from enum import IntEnum
+from unittest import TestCase
+
+import numpy as np
+
+from qutils.functions import lazy, timeit, Profiler, update, update_many, freeze, deep_equal, deep_hash, \
+    deep_diff, diff_to_patch, Diff, DELETE
+
+
+class TestUpdate(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.current = {'a': {'b': {'c': 1, 'd': [1, 2]}, 'e': [{'f': 1}, {'g': 2}]}, 'h': {'i': 1}, 'j': None}
+
+    def test_options(self):
+        current = self.current
+        self.assertEqual({'a': {'x': 1}, 'h': {'i': 1}, 'j': None}, update(current, {'a': {'x': 1}}))
+        self.assertEqual({'a': {'b': {'c': 2, 'd': [1, 2]}, 'e': [{'f': 1}, {'g': 2}]}, 'h': {'i': 1}, 'j': 1},
+                         update(current, {'a': {'b': {'c': 2}}, 'j': 1}, deep=True))
+        self.assertEqual({'a': {'b': {'c': 1, 'd': [3, 2]}, 'e': [{'f': 1, 'k': 1}, {'g': 2}, 3]},
+                          'h': {'i': 1}, 'j': None},
+                         update(current, {'a': {'b': {'d': [3]}, 'e': [{'k': 1}, None, 3]}},
+                                deep=True, update_list=True, ignore_none=True))
+        self.assertEqual([1, 2, 3],
+                         update(current, {'a': {'b': {'d': [3]}}}, deep=True, extend_list=True)['a']['b']['d'])
+        self.assertEqual({'a': current['a'], 'h': {'i': 1}, 'j': None, 'k': 1},
+                         update(current, {'a': {'b': 1}, 'j': 2, 'k': 1}, deep=True, ignore_exist=True))
+        self.assertEqual(OrderedDict([('a', 1), ('b', 2)]), update(OrderedDict([('a', 1)]), {'b': 2}))
+        self.assertEqual([{'a': 1, 'b': 2}, 3], update(({'a': 1},), [{'b': 2}, 3], deep=True, update_list=True))
+        self.assertEqual(2, update(1, 2))
+
+    def test_structural_sharing(self):
+        current = self.current
+        frozen = deepcopy(current)
+        to_update = {'a': {'b': {'c': 2}}}
+        updated = update(current, to_update, deep=True)
+        self.assertEqual(frozen, current)
+        self.assertEqual({'a': {'b': {'c': 1}}}, update(to_update, {'a': {'b': {'c': 1}}}, deep=True))
+        self.assertEqual({'a': {'b': {'c': 2}}}, to_update)
+        self.assertIsNot(current['a']['b'], updated['a']['b'])
+        self.assertIs(current['a']['b']['d'], updated['a']['b']['d'])
+        self.assertIs(current['a']['e'], updated['a']['e'])
+        self.assertIs(current['h'], updated['h'])
+        # nothing changes: a new container at the top level only, so that modifying it leaves current intact
+        unchanged = update(current, {'a': {'b': {'c': 1}}, 'h': {'i': 1}}, deep=True)
+        self.assertIsNot(current, unchanged)
+        self.assertEqual(current, unchanged)
+        self.assertIs(current['a'], unchanged['a'])
+        unchanged['k'] = 1
+        self.assertEqual(frozen, current)
+        self.assertIsNot(current['a']['b']['d'], update(current['a']['b']['d'], [], update_list=True))
+
+    def test_deep_nesting(self):
+        current, to_update = {}, {'z': 1}
+        for _ in range(10000):
+            current, to_update = {'x': current, 'y': 0}, {'x': to_update}
+        updated = update(current, to_update, deep=True)
+        for _ in range(10000):
+            self.assertEqual(0, updated['y'])
+            updated = updated['x']
+        self.assertEqual({'z': 1}, updated)
+
+    def test_update_many(self):
+        current = self.current
+        frozen = deepcopy(current)
+        patches = [{'a': {'b': {'c': 2}}}, {'a': {'b': 5}}, {'a': {'b': {'x': [1]}}}, {'a': {'b': {'x': [2]}}},
+                   {'a': {'e': [None, {'g': 3}]}}, {'h': None, 'j': {'k': 1}}]
+        options = dict(deep=True, extend_list=True, ignore_none=True)
+        expected = current
+        for patch in patches:
+            expected = update(expected, patch, **options)
+        self.assertEqual(expected, update_many(current, patches, **options))
+        self.assertEqual({'x': [1, 2]}, expected['a']['b'])
+        self.assertEqual(frozen, current)
+        self.assertEqual({'x': [1]}, patches[2]['a']['b'])
+
+
+class TestDeepEqual(TestCase):
+    def test_deep_equal(self):
+        lhs = {'a': [1, {'b': (2, 3)}], 'c': {'d': None, 'e': 'x'}}
+        rhs = {'c': {'e': 'x', 'd': None}, 'a': [1.0, {'b': [2, 3]}]}
+        self.assertTrue(deep_equal(lhs, rhs))
+        self.assertFalse(deep_equal(lhs, dict(rhs, a=[{'b': [2, 3]}, 1])))
+        self.assertTrue(deep_equal(lhs, dict(rhs, a=[{'b': [3, 2]}, 1]), unordered_list=True))
+        self.assertFalse(deep_equal(lhs, dict(rhs, a=[{'b': [3, 3]}, 1]), unordered_list=True))
+        self.assertFalse(deep_equal([1, 1, 2], [1, 2, 2], unordered_list=True))
+        self.assertFalse(deep_equal({'a': 1}, [('a', 1)]))
+        self.assertFalse(deep_equal({'a': 1}, {'b': 1}))
+        self.assertFalse(deep_equal([[]], [{}]))
+        # tuples are kept by freeze(), so a tuple only equals a list as the tuple of its frozen items
+        self.assertTrue(deep_equal((1, 2), [1, 2]))
+        self.assertFalse(deep_equal(({'a': 1},), [{'a': 1}]))
+        self.assertFalse(deep_equal((2, 1), [1, 2], unordered_list=True))
+        self.assertEqual(freeze([{'a': 1}]) == freeze(({'a': 1},)), deep_equal([{'a': 1}], ({'a': 1},)))
+
+    def test_deep_hash(self):
+        lhs = {'a': [1, {'b': [2, 3]}], 'c': {'d': None, 'e': {'x'}}}
+        rhs = {'c': {'e': {'x'}, 'd': None}, 'a': [1, {'b': (2, 3)}]}
+        self.assertEqual(deep_hash(lhs), deep_hash(rhs))
+        self.assertNotEqual(deep_hash(lhs), deep_hash(dict(rhs, a=[{'b': [3, 2]}, 1])))
+        self.assertEqual(deep_hash(lhs, True), deep_hash(dict(rhs, a=[{'b': [3, 2]}, 1]), True))
+        cache = {}
+        self.assertEqual(deep_hash(lhs), deep_hash(lhs, cache=cache))
+        self.assertEqual(5, len(cache))
+        lhs['a'][1]['b'].append(4)
+        self.assertEqual(deep_hash(lhs, cache=cache), deep_hash(rhs))  # stale until the cache is dropped
+        self.assertNotEqual(deep_hash(lhs), deep_hash(rhs))
+        self.assertEqual(deep_hash([1, 2.0, True]), deep_hash([1.0, 2, 1]))
+        self.assertEqual(deep_hash(lhs, stable=False), deep_hash(deepcopy(lhs), stable=False))
+
+    def test_deep_hash_stable(self):
+        # the same across processes, while the hash() of str is randomized
+        code = 'from qutils.functions import deep_hash; print(deep_hash({"a": ["x", 1.5, None, b"y", {"z"}]}, True))'
+        hashes = set()
+        for seed in ('1', '2'):
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            hashes.add(subprocess.check_output([sys.executable, '-c', code], env=env, universal_newlines=True))
+        self.assertEqual({'{}\n'.format(deep_hash({'a': ['x', 1.5, None, b'y', {'z'}]}, True))}, hashes)
+
+    def test_deep_hash_subclasses(self):
+        class Code(IntEnum):
+            OK = 1
+
+        class Name(str):
+            pass
+
+        # equal values have the same hash, whatever their types
+        for lhs, rhs in [(Code.OK, 1), (True, 1), (Name('a'), 'a'), (np.int64(2), 2), (np.float64(2.5), 2.5),
+                         ({'a': [Code.OK, Name('b')]}, {'a': [1, 'b']})]:
+            self.assertTrue(deep_equal(lhs, rhs), (lhs, rhs))
+            self.assertEqual(deep_hash(rhs), deep_hash(lhs), (lhs, rhs))
+
+    def test_freeze(self):
+        self.assertEqual(((1, 2), ('a', (1, 'x'))), freeze({1: 2, 'a': ['x', 1]}, unordered_list=True))
+        self.assertEqual(freeze({'a': [3, 1]}, True), freeze({'a': [1, 3]}, True))
+
+
+class TestDeepDiff(TestCase):
+    def test_deep_diff(self):
+        lhs = {'a': {'b': 1, 'c': [1, {'x': 1}], 'd': {'e': 1}}, 'f': 2, 'g': [3, 1]}
+        rhs = {'a': {'b': 2, 'c': [1, {'x': 2}], 'd': {}}, 'g': [1, 3, 4], 'h': None}
+        self.assertEqual([Diff('change', ('a', 'b'), 1, 2),
+                          Diff('change', ('a', 'c', 1, 'x'), 1, 2),
+                          Diff('remove', ('a', 'd', 'e'), 1, None),
+                          Diff('remove', ('f',), 2, None),
+                          Diff('change', ('g', 0), 3, 1),
+                          Diff('change', ('g', 1), 1, 3),
+                          Diff('add', ('g', 2), None, 4),
+                          Diff('add', ('h',), None, None)],
+                         list(deep_diff(lhs, rhs)))
+        self.assertEqual([Diff('remove', ('a', 'c', 1), {'x': 1}, None),
+                          Diff('add', ('a', 'c', 1), None, {'x': 2}),
+                          Diff('add', ('g', 2), None, 4)],
+                         [d for d in deep_diff(lhs, rhs, unordered_list=True) if len(d.path) > 1 and d.path[1] != 'b'
+                          and d.path[1] != 'd'])
+        self.assertEqual([], list(deep_diff(lhs, deepcopy(lhs))))
+        self.assertEqual([Diff('change', (), lhs, [])], list(deep_diff(lhs, [])))
+
+    def test_patch(self):
+        lhs = {'a': {'b': 1, 'c': [1, {'x': 1}], 'd': {'e': 1}}, 'f': 2, 'g': [3, 1]}
+        rhs = {'a': {'b': 2, 'c': [1, {'x': 2}], 'd': {}}, 'g': [1, 3, 4], 'h': None}
+        patch = diff_to_patch(deep_diff(lhs, rhs), rhs)
+        self.assertEqual({'a': {'b': 2, 'c': [1, {'x': 2}], 'd': {'e': DELETE}}, 'f': DELETE, 'g': [1, 3, 4],
+                          'h': None}, patch)
+        self.assertEqual(rhs, update(lhs, patch, deep=True))
+        self.assertIs(DELETE, pickle.loads(pickle.dumps(DELETE)))
+        self.assertIs(DELETE, deepcopy(DELETE))
+
+        rand = random.Random(0)
+
+        def random_doc(depth):
+            if depth == 0 or rand.random() < 0.2:
+                return rand.choice([None, 0, 1, 'x', [1, 2]])
+            return {rand.choice('abcde'): random_doc(depth - 1) for _ in range(rand.randrange(4))}
+
+        for _ in range(200):
+            lhs, rhs = random_doc(4), random_doc(4)
+            self.assertEqual(rhs, update(lhs, diff_to_patch(deep_diff(lhs, rhs), rhs), deep=True))
+
+
+class TestLazy(TestCase):
+    def test_single_flight(self):
+        calls = []
+
+        def load():
+            calls.append(1)
+            time.sleep(0.05)
+            return len(calls)
+
+        fn = lazy(load)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(fn())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([1] * 8, results)
+        self.assertEqual((7, 1), (fn.hits, fn.misses))
+        fn.reset()
+        self.assertEqual(2, fn())
+        self.assertEqual('load', fn.__name__)
+
+    def test_ttl(self):
+        now = [0]
+        calls = []
+
+        def load():
+            calls.append(now[0])
+            if now[0] == 5:
+                raise ValueError()
+            return now[0]
+
+        fn = lazy(load, ttl=10, refresh_ahead=2, timer=lambda: now[0])
+        self.assertEqual(0, fn())
+        now[0] = 5
+        self.assertEqual(0, fn())
+        fn.reset()
+        with self.assertRaises(ValueError):
+            fn()
+        now[0] = 6
+        self.assertEqual(6, fn())
+        now[0] = 15
+        self.assertEqual(6, fn())  # served while refreshing in the background
+        for _ in range(100):
+            if not fn._refreshing:
+                break
+            time.sleep(0.01)
+        self.assertEqual(15, fn())
+        now[0] = 30
+        self.assertEqual(30, fn())
+        self.assertEqual([0, 5, 6, 15, 30], calls)
+
+    def test_async(self):
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        fn = lazy(load)
+
+        async def run():
+            return await asyncio.gather(*(fn() for _ in range(5))), await fn()
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(([1] * 5, 1), loop.run_until_complete(run()))
+        finally:
+            loop.close()
+        self.assertEqual((5, 1), (fn.hits, fn.misses))
+
+
+class TestProfiler(TestCase):
+    def test_timeit(self):
+        output = []
+        with timeit('x', output.append) as t:
+            pass
+        self.assertEqual(['Start x.', 'Done x. Took {} seconds.'.format(t.interval)], output)
+        self.assertAlmostEqual(time.time(), t.time_end, delta=1)
+        self.assertLessEqual(t.time_start, t.time_end)
+
+    def test_nested_spans(self):
+        profiler = Profiler()
+
+        @profiler.span()
+        def leaf():
+            pass
+
+        @profiler.span('task')
+        async def task():
+            async with profiler.span('io'):
+                await asyncio.sleep(0)
+            leaf()
+
+        for _ in range(10):
+            with profiler.span('outer'):
+                leaf()
+                with profiler.span('inner'):
+                    leaf()
+
+        async def tasks():
+            await asyncio.gather(task(), task())
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(tasks())
+        finally:
+            loop.close()
+
+        tree = profiler.to_dict()
+        self.assertEqual(['outer', 'task'], [s['title'] for s in tree])
+        self.assertEqual([('TestProfiler.test_nested_spans.<locals>.leaf', 10), ('inner', 10)],
+                         [(s['title'], s['count']) for s in tree[0]['children']])
+        self.assertEqual(['io', 'TestProfiler.test_nested_spans.<locals>.leaf'],
+                         [s['title'] for s in tree[1]['children']])
+        stats = profiler.stats()
+        self.assertEqual(22, stats['TestProfiler.test_nested_spans.<locals>.leaf']['count'])
+        self.assertEqual(2, stats['task']['count'])
+        for s in stats.values():
+            self.assertLessEqual(s['p50'], s['p99'])
+            self.assertLessEqual(s['p99'], s['max'])
+        self.assertEqual(tree, json.loads(profiler.to_json()))
+        folded = profiler.to_folded().split('\n')
+        self.assertEqual(7, len(folded))
+        self.assertTrue(folded[3].startswith('outer;inner;TestProfiler.test_nested_spans.<locals>.leaf '))
+
+    def test_histogram(self):
+        histogram = Profiler.Histogram()
+        for i in range(1, 1001):
+            histogram.add(i * 1000)
+        self.assertAlmostEqual(500000, histogram.percentile(50), delta=500000 / 16)
+        self.assertAlmostEqual(990000, histogram.percentile(99), delta=990000 / 16)
+        self.assertEqual(1000000, histogram.percentile(100))
@@ -1,6 +1,8 @@
+import io
+import json
 from unittest import TestCase
 
-from qutils.json_ext import SkyNetJSONable
+from qutils.json_ext import SkyNetJSONable, SkyNetJSONEncoder, SkyNetJSONDecoder, iterload, iterdump
 
 
 class TestJSONExt(TestCase):
@@ -23,3 +25,126 @@ class TestJSONExt(TestCase):
                 type = 'a'
 
 
+class TestSkyNetJSONDecoder(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.all_types = dict(SkyNetJSONable.all_types)
+
+        class Point(SkyNetJSONable):
+            type = 'test-point'
+
+            def __init__(self, x, y):
+                self.x = x
+                self.y = y
+
+            def encode(self):
+                return {'x': self.x, 'y': self.y}
+
+            @classmethod
+            def decode(cls, obj):
+                return cls(**obj)
+
+        self.Point = Point
+        self.points = [Point(i, [i, {'z': 'é' * i}]) for i in range(50)]
+        self.text = json.dumps(self.points + [{'_type': 'unknown'}, 12345, None], cls=SkyNetJSONEncoder)
+
+    def tearDown(self):
+        SkyNetJSONable.all_types.clear()
+        SkyNetJSONable.all_types.update(self.all_types)
+        super().tearDown()
+
+    def assert_decoded(self, decoded):
+        self.assertEqual([(p.x, p.y) for p in self.points], [(p.x, p.y) for p in decoded[:50]])
+        self.assertTrue(all(isinstance(p, self.Point) for p in decoded[:50]))
+        self.assertEqual([{'_type': 'unknown'}, 12345, None], decoded[50:])
+
+    def test_object_hook(self):
+        self.assert_decoded(json.loads(self.text, cls=SkyNetJSONDecoder))
+        obj = {'x': 1, 'y': 2, '_type': 'test-point'}
+        self.assertIsInstance(SkyNetJSONDecoder.object_hook(obj), self.Point)
+        self.assertEqual({'x': 1, 'y': 2, '_type': 'test-point'}, obj)
+
+    def test_decode_without_copy(self):
+        decoded = []
+
+        class Recorded(SkyNetJSONable):
+            type = 'test-recorded'
+
+            @classmethod
+            def decode(cls, obj):
+                decoded.append(obj)
+                return obj
+
+        hooked = []
+
+        def object_hook(obj):
+            hooked.append(obj)
+            return SkyNetJSONDecoder._object_hook(obj)
+
+        result = json.loads('[{"_type": "test-recorded", "a": {"b": 1}}]', cls=SkyNetJSONDecoder,
+                            object_hook=object_hook)
+        self.assertEqual([{'a': {'b': 1}}], result)
+        # decode() gets the dict created by the decoder itself
+        self.assertIs(hooked[-1], decoded[0])
+        self.assertIs(result[0], decoded[0])
+
+    def test_iterload(self):
+        for chunk_size in (1, 7, 65536):
+            self.assert_decoded(list(iterload(io.StringIO(self.text), chunk_size=chunk_size)))
+            self.assert_decoded(list(iterload(io.BytesIO(self.text.encode()), chunk_size=chunk_size)))
+        self.assertEqual([], list(iterload(io.StringIO(' [ ] '))))
+        # the bytes read by chunk_size=1 end in the middle of the characters
+        self.assertEqual(['é', {'ü': '中文'}], list(iterload(io.BytesIO('["é", {"ü": "中文"}]'.encode()),
+                                                             cls=json.JSONDecoder, chunk_size=1)))
+        self.assertEqual([1, {'a': 2}], list(iterload(io.StringIO('[1, {"a": 2}]'), cls=json.JSONDecoder)))
+        items = iterload(io.StringIO('[1, 2 3]'), chunk_size=1)
+        self.assertEqual(1, next(items))
+        self.assertEqual(2, next(items))
+        with self.assertRaises(json.JSONDecodeError):
+            next(items)
+        with self.assertRaises(json.JSONDecodeError):
+            list(iterload(io.StringIO('{}')))
+
+    def test_encoder(self):
+        class Plain(SkyNetJSONable):
+            type = 'test-plain'
+
+            def __init__(self, a=None):
+                self.a = a
+
+        class Child(self.Point):
+            pass
+
+        plain = Plain(1)
+        self.assertEqual({'a': 1, '_type': 'test-plain'}, json.loads(json.dumps(plain, cls=SkyNetJSONEncoder)))
+        self.assertEqual({'a': 1}, plain.__dict__)
+        self.assertEqual({'x': 1, 'y': 2, '_type': 'test-point'},
+                         json.loads(json.dumps(Child(1, 2), cls=SkyNetJSONEncoder)))
+        with self.assertRaises(TypeError):
+            json.dumps(object(), cls=SkyNetJSONEncoder)
+
+        class Listed(SkyNetJSONable):
+            type = 'test-listed'
+
+            def encode(self):
+                return [1, 2]
+
+        with self.assertRaises(TypeError):
+            json.dumps(Listed(), cls=SkyNetJSONEncoder)
+
+    def test_iterdump(self):
+        objs = self.points + [{'_type': 'unknown'}, 12345, None]
+        fp = io.StringIO()
+        self.assertEqual(53, iterdump(iter(objs), fp))
+        self.assertEqual(self.text, fp.getvalue())
+        fp = io.BytesIO()
+        iterdump(objs, fp, separators=(',', ':'))
+        self.assert_decoded(list(iterload(io.BytesIO(fp.getvalue()))))
+        # round trip through a text file, read in chunks smaller than an object
+        fp = io.StringIO()
+        iterdump(iter(objs), fp)
+        fp.seek(0)
+        self.assert_decoded(list(iterload(fp, chunk_size=7)))
+        fp = io.StringIO()
+        self.assertEqual(0, iterdump([], fp))
+        self.assertEqual('[]', fp.getvalue())
@@ -0,0 +1,114 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import TestCase, skipUnless
+
+from qutils.misc import ProcessLock, is_single_instance
+
+HOLD_LOCK = '''
+import sys
+from qutils.misc import ProcessLock
+lock = ProcessLock(sys.argv[1], sys.argv[2], sys.argv[3])
+print(lock.acquire(blocking=False), flush=True)
+sys.stdin.read()
+'''
+
+
+class TestProcessLock(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.lock_dir = tempfile.TemporaryDirectory()
+        self.methods = [ProcessLock.FCNTL] + ([ProcessLock.SOCKET] if sys.platform.startswith('linux') else [])
+        self.name = 'test-{}-{}'.format(os.getpid(), id(self))
+
+    def tearDown(self):
+        self.lock_dir.cleanup()
+        super().tearDown()
+
+    def new_lock(self, method, **kwargs):
+        return ProcessLock(self.name, method, self.lock_dir.name, **kwargs)
+
+    def test_acquire(self):
+        for method in self.methods:
+            lock, other = self.new_lock(method), self.new_lock(method)
+            self.assertIsNone(other.holder())
+            self.assertTrue(lock.acquire(blocking=False))
+            self.assertTrue(lock.locked)
+            with self.assertRaises(RuntimeError):
+                lock.acquire()
+            self.assertFalse(other.acquire(blocking=False))
+            start = time.monotonic()
+            self.assertFalse(other.acquire(timeout=0.05))
+            self.assertGreaterEqual(time.monotonic() - start, 0.05)
+            self.assertEqual(os.getpid(), other.holder())
+            lock.release()
+            self.assertIsNone(other.holder())
+            with other:
+                self.assertTrue(other.locked)
+                with self.assertRaises(TimeoutError):
+                    with self.new_lock(method, timeout=0.01):
+                        pass
+            self.assertFalse(other.locked)
+            with self.assertRaises(RuntimeError):
+                other.release()
+
+    def test_stale_file(self):
+        with open(os.path.join(self.lock_dir.name, self.name + '.lock'), 'w') as f:
+            f.write('999999999\n')
+        lock = self.new_lock(ProcessLock.FCNTL)
+        self.assertIsNone(lock.holder())
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.release()
+
+    def test_processes(self):
+        for method in self.methods:
+            process = subprocess.Popen([sys.executable, '-c', HOLD_LOCK, self.name, method, self.lock_dir.name],
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+            try:
+                self.assertEqual('True', process.stdout.readline().strip())
+                lock = self.new_lock(method)
+                self.assertEqual(process.pid, lock.holder())
+                self.assertFalse(lock.acquire(blocking=False))
+                # released by the OS, without releasing by the process
+                process.kill()
+                process.wait()
+                self.assertTrue(lock.acquire(timeout=5))
+                lock.release()
+            finally:
+                process.kill()
+                process.stdin.close()
+                process.stdout.close()
+                process.wait()
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            ProcessLock('../escape')
+        with self.assertRaises(ValueError):
+            ProcessLock('name', method='never')
+
+    @skipUnless(sys.platform.startswith('linux'), 'abstract Unix sockets are Linux only')
+    def test_is_single_instance(self):
+        self.assertTrue(is_single_instance(self.name))
+        self.assertFalse(is_single_instance(self.name))
+        self.assertFalse(ProcessLock(self.name, ProcessLock.SOCKET).acquire(blocking=False))
+
+    @skipUnless(os.name == 'posix' and os.geteuid() != 0, 'root opens any file')
+    def test_file_of_another_user(self):
+        import fcntl
+        lock = self.new_lock(ProcessLock.FCNTL)
+        with open(lock.path, 'w'):
+            pass
+        os.chmod(lock.path, 0o444)
+        # held through another open file, as by the process of the user owning the file
+        with open(lock.path) as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            self.assertFalse(lock.acquire(blocking=False))
+            self.assertFalse(lock.acquire(timeout=0.01))
+            self.assertIsNone(lock.holder())
+        # not held any more, but it can never be taken over
+        with self.assertRaises(PermissionError):
+            lock.acquire(blocking=False)
+        with self.assertRaises(PermissionError):
+            lock.acquire()
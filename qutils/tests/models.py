@@ -1,9 +1,13 @@
+import io
+import json
+import pickle
 from unittest import TestCase
 
 import pandas as pd
 
 from qutils.functions import deep_equal
-from qutils.models import JsonModel, ItemRef
+from qutils.json_ext import get_json_backend
+from qutils.models import JsonModel, ItemRef, OView
 
 
 class SubToyModel(JsonModel):
@@ -25,6 +29,24 @@ class ToyModel(JsonModel):
     }
 
 
+class WeirdModel(ToyModel):
+    __fields__ = dict(ToyModel.__fields__, **{'weird key': None, 'listf': JsonModel.ModelType(SubToyModel)})
+
+
+class LazyToyModel(ToyModel):
+    __lazy__ = True
+
+
+class SpecToyModel(JsonModel):
+    __fields__ = {
+        'intf': JsonModel.Field(int, required=True),
+        'boolf': JsonModel.Field(bool, default=False),
+        'listf': JsonModel.Field(float, list_of=True, default=list),
+        'datetimef': JsonModel.Field(converter=JsonModel.DateTimeType()),
+        'modelf': JsonModel.Field(converter=JsonModel.ModelType(ToyModel), list_of=False),
+    }
+
+
 class TestJsonModel(TestCase):
     def setUp(self):
         super().setUp()
@@ -87,6 +109,139 @@ class TestJsonModel(TestCase):
         with self.assertRaises(KeyError):
             print(self.toy_model.not_exist_field)
 
+    def test_compiled_fields(self):
+        self.assertFalse(hasattr(self.toy_model, '__dict__'))
+        self.assertEqual(('weird key', 'listf'), tuple(k for k in WeirdModel.__fields__ if k not in ToyModel.__fields__))
+        self.assertEqual(('listf',), WeirdModel.__slots__)
+        weird_json = dict(self.toy_json, **{'weird key': 1, 'listf': [self.sub_toy_json, self.sub_toy_model],
+                                            'unknown key': 2})
+        weird_model = WeirdModel(weird_json)
+        self.assertEqual(1, weird_model['weird key'])
+        self.assertTrue(all(isinstance(m, SubToyModel) for m in weird_model.listf))
+        self.assertIsNone(WeirdModel().strf)
+        self.assertTrue(deep_equal(weird_model.to_dict(), pickle.loads(pickle.dumps(weird_model)).to_dict()))
+        weird_json.pop('unknown key')
+        weird_json['listf'] = [weird_model.listf[0].to_dict()] * 2
+        weird_json['datetimef'] = '1990-07-09T07:00:05.007000'
+        weird_json['modelf'] = self.sub_toy_model.to_dict()
+        self.assertTrue(deep_equal(weird_json, weird_model.to_dict()))
+
+    def test_lazy_model(self):
+        toy_json = dict(self.toy_json, modelf=dict(self.sub_toy_json, unknown='kept as is'))
+        lazy_model = LazyToyModel(toy_json, intf=54321)
+        self.assertFalse(hasattr(lazy_model, '__values__'))
+        self.assertEqual(dict(toy_json, intf=54321), lazy_model.to_dict())
+        self.assertIsInstance(lazy_model.modelf, SubToyModel)
+        self.assertIs(lazy_model.modelf, lazy_model.modelf)
+        self.assertEqual(self.sub_toy_json['sdatetimef'] + '000', lazy_model.to_dict()['modelf']['sdatetimef'])
+        lazy_model.datetimef = pd.to_datetime('2016-07-09T00:00:00.001')
+        self.assertEqual('2016-07-09T00:00:00.001000', lazy_model.to_dict()['datetimef'])
+        self.assertIsNone(LazyToyModel({}).modelf)
+        with self.assertRaises(TypeError):
+            LazyToyModel(None)
+        with self.assertRaises(TypeError):
+            print(LazyToyModel({'modelf': 'this is an invalid field value'}).modelf)
+
+    def test_json_backends(self):
+        for dt in '2016-07-09T00:00:00', '2016-07-09T00:00:00.001', '2016-07-09T00:00:00.001+08:00':
+            self.toy_model.datetimef = pd.to_datetime(dt)
+            expected = self.toy_model.to_dict()
+            for backend in {'json', get_json_backend('auto').name}:
+                ToyModel.__json_backend__ = backend
+                try:
+                    self.assertEqual(expected, ToyModel(self.toy_model.to_json()).to_dict())
+                    for fp in io.StringIO(), io.BytesIO():
+                        self.assertEqual(2, ToyModel.dump_json(iter([self.toy_model] * 2), fp, chunk_size=10))
+                        self.assertEqual([expected] * 2, [ToyModel(d).to_dict() for d in json.loads(fp.getvalue())])
+                finally:
+                    del ToyModel.__json_backend__
+        # the format is still strict for the json dicts
+        with self.assertRaises(ValueError):
+            ToyModel({'datetimef': '2016-07-09T00:00:00'})
+
+    def test_field_specs(self):
+        model = SpecToyModel.parse('{"intf": "3", "listf": [1, "2.5"], "modelf": {"intf": 4}, "unknown": 0}')
+        self.assertEqual((3, False, [1.0, 2.5], None), (model.intf, model.boolf, model.listf, model.datetimef))
+        self.assertEqual(4, model.modelf.intf)
+        self.assertEqual([], SpecToyModel(intf=1).listf)
+        self.assertIsNot(SpecToyModel().listf, SpecToyModel().listf)
+
+        json_obj = {'boolf': 'maybe', 'listf': 1.0, 'datetimef': 'not a time',
+                    'modelf': {'datetimef': '1990-07-09T07:00:05.007', 'modelf': 'not a model'}}
+        errors = SpecToyModel.validate(json_obj)
+        self.assertEqual(['intf', 'boolf', 'listf', 'datetimef', 'modelf.modelf'], [path for path, _ in errors])
+        with self.assertRaises(JsonModel.ValidationError) as ctx:
+            SpecToyModel.parse(json_obj)
+        self.assertEqual(errors, ctx.exception.errors)
+        self.assertEqual('1.0', SpecToyModel.parse({'listf': '1.0'}, trusted=True).listf)
+
+    def test_coercions(self):
+        class CoercedModel(JsonModel):
+            __fields__ = {
+                'intf': JsonModel.Field(int),
+                'floatf': JsonModel.Field(float),
+                'strf': JsonModel.Field(str),
+            }
+
+        model = CoercedModel.parse({'intf': 3.0, 'floatf': 3, 'strf': 1.5})
+        self.assertEqual((3, 3.0, '1.5'), (model.intf, model.floatf, model.strf))
+        self.assertEqual((int, float), (type(model.intf), type(model.floatf)))
+        model = CoercedModel.parse({'intf': '-3', 'floatf': '2.5', 'strf': 2})
+        self.assertEqual((-3, 2.5, '2'), (model.intf, model.floatf, model.strf))
+        # the values that would lose data or are not scalars
+        for key, value in [('intf', 2.5), ('intf', '2.5'), ('intf', True),
+                           ('floatf', 2 ** 53 + 1), ('floatf', False), ('floatf', 'x'),
+                           ('strf', {'a': 1}), ('strf', True)]:
+            self.assertEqual([key], [path for path, _ in CoercedModel.validate({key: value})], value)
+
+    def test_from_records(self):
+        other_json = {'strf': 'another', 'datetimef': '2016-07-09T00:00:00.001', 'unknown': 1}
+        frame = ToyModel.from_records([self.toy_json, other_json])
+        self.assertEqual(['strf', 'intf', 'floatf', 'datetimef',
+                          'modelf.sstrf', 'modelf.sintf', 'modelf.sfloatf', 'modelf.sdatetimef'], list(frame.columns))
+        self.assertEqual(['this is a string field', 'another'], list(frame['strf']))
+        self.assertEqual([pd.to_datetime('1990-07-09T07:00:05.007'), pd.to_datetime('2016-07-09T00:00:00.001')],
+                         list(frame['datetimef']))
+        self.assertEqual(pd.to_datetime('1990-07-09T23:42:55.325'), frame['modelf.sdatetimef'][0])
+        self.assertTrue(pd.isnull(frame['modelf.sdatetimef'][1]))
+        self.assertTrue(frame.equals(ToyModel.to_frame([self.toy_model, ToyModel(other_json)])))
+        self.assertEqual(['modelf_sstrf'], [c for c in ToyModel.from_records([], sep='_').columns if 'sstrf' in c])
+
+
+class TestOView(TestCase):
+    def test_view(self):
+        config = {'a': {'b': {'c': 1}, 'l': [{'d': 2}]}, '_private': 3}
+        view = OView(config)
+        self.assertEqual(1, view.a.b.c)
+        self.assertEqual([{'d': 2}], view.a.l)
+        self.assertEqual(3, view['_private'])
+        self.assertIs(config['a'], view.a.to_dict())
+        view.a.b.e = OView({'f': 4})
+        self.assertFalse(view.missing.key)
+        self.assertTrue(hasattr(view, 'typo'))
+        self.assertNotIn('missing', config)
+        self.assertNotIn('typo', config)
+        x = view.x
+        x.y.z = 5
+        self.assertEqual({'c': 1, 'e': {'f': 4}}, config['a']['b'])
+        self.assertEqual({'y': {'z': 5}}, config['x'])
+        del view.x
+        self.assertNotIn('x', view)
+
+    def test_frozen(self):
+        view = OView({'a': {'b': 1}}).freeze()
+        self.assertTrue(view.a.frozen)
+        self.assertEqual(1, view.a.b)
+        with self.assertRaises(AttributeError):
+            print(view.a.c)
+        self.assertFalse(hasattr(view, 'c'))
+        with self.assertRaises(KeyError):
+            print(view['c'])
+        with self.assertRaises(TypeError):
+            view.a.b = 2
+        with self.assertRaises(TypeError):
+            del view.a
+
 
 class TestItemRef(TestCase):
     def test_getter(self):
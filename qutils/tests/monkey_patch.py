@@ -1,9 +1,9 @@
 from datetime import timedelta
-from unittest import TestCase
+from unittest import TestCase, skipIf
 
 import pandas as pd
 
-from qutils.monkey_patch import timedelta_to_human
+from qutils.monkey_patch import timedelta_to_human, timedeltas_to_human, TimedeltaProperties
 
 
 class TestMonkeyPatch(TestCase):
@@ -14,3 +14,38 @@ class TestMonkeyPatch(TestCase):
         for td in timedelta(days=-1, seconds=-3900), pd.to_timedelta('-1d1h5m'):
             self.assertEqual('1.05 days ago', timedelta_to_human(td, precision=2))
             self.assertEqual('1.0 day ago', timedelta_to_human(td, precision=1))
+
+    def test_timedelta_to_human_units(self):
+        self.assertEqual('30.0 secs', timedelta_to_human(timedelta(seconds=30)))
+        self.assertEqual('0.0 sec', timedelta_to_human(timedelta(0)))
+        self.assertEqual('1.5 minutes ago', timedelta_to_human(timedelta(seconds=-90), short=False))
+        self.assertEqual('90.0 secs', timedelta_to_human(timedelta(seconds=90), unit='seconds'))
+        self.assertEqual('1.5 mins', timedelta_to_human(timedelta(seconds=90), cache=False))
+        with self.assertRaises(ValueError):
+            timedelta_to_human(timedelta(seconds=90), unit='week')
+        self.assertEqual('2.0 hours', pd.Timedelta('2h').to_human())
+
+    def test_timedeltas_to_human(self):
+        tds = pd.to_timedelta(['1d1h5m', '-1d1h5m', '30s', '0s', '-90s', '2h', '59m59s', '1.5s', None])
+        # the nanoseconds are truncated by Timedelta.total_seconds()
+        nanos = pd.to_timedelta([90500838, -90500838, 6685000000, -1, 3599999999999], unit='ns')
+        tds = nanos.append(tds)
+        for short in True, False:
+            for precision in 0, 2:
+                for unit in None, 'hours':
+                    expected = [timedelta_to_human(td, short, precision, unit) for td in tds[:-1]]
+                    expected.append(None)
+                    self.assertEqual(expected, list(timedeltas_to_human(tds, short, precision, unit)))
+        self.assertIsInstance(tds.to_human(), pd.Index)
+        self.assertEqual('0.09 sec', tds.to_human(precision=2)[0])
+        with self.assertRaises(ValueError):
+            timedeltas_to_human(tds, unit='week')
+
+    @skipIf(TimedeltaProperties is None, 'the accessor class of Series.dt is not found in this pandas version')
+    def test_series_to_human(self):
+        series = pd.Series(pd.to_timedelta(['1d1h5m', '30s', None]), index=list('abc'), name='elapsed')
+        humans = series.dt.to_human(precision=2)
+        self.assertEqual(list(series.index), list(humans.index))
+        self.assertEqual('elapsed', humans.name)
+        self.assertEqual(['1.05 days', '30.0 secs'], list(humans[:2]))
+        self.assertIsNone(humans['c'])
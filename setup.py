@@ -36,5 +36,8 @@ setup(
         'pandas>=0.17.0',
         'PyYAML>=3.12',
         'teradata>=15.10.0.20'
-    ]
+    ],
+    extras_require={
+        'async': ['aiohttp>=3.3']
+    }
 )